@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark the position-shift bookkeeping of the mutator.
+
+Usage:
+  {command} [variants...]
+
+  variants: Number of variants in the allele (default: 10, 100, 300 and
+            1000).
+
+For each allele size, a random allele of non-overlapping deletions,
+insertions and substitutions is applied to a random sequence of 1 Mbp, from
+left to right and in random order. Printed are the time to apply the allele
+(without visualisation and restriction site analysis) and the time to shift
+500 splice sites to the mutated sequence afterwards.
+"""
+
+
+from __future__ import unicode_literals
+
+import random
+import sys
+import timeit
+
+from Bio.Seq import Seq
+
+from mutalyzer.mutator import Mutator
+from mutalyzer.output import Output
+from mutalyzer.util import format_usage
+
+
+SEQUENCE_LENGTH = 1000000
+SITES = 500
+
+REPEAT = 3
+
+
+def _allele(count):
+    """
+    Random non-overlapping variants as interbase positions and inserted
+    sequence, sorted by position.
+    """
+    spacing = SEQUENCE_LENGTH // count
+    variants = []
+    for i in range(count):
+        start = i * spacing + random.randint(1, spacing // 2)
+        kind = random.choice(['del', 'ins', 'subst'])
+        if kind == 'del':
+            variants.append((start, start + random.randint(1, 10), ''))
+        elif kind == 'ins':
+            variants.append((start, start, 'ACGT' * random.randint(1, 3)))
+        else:
+            variants.append((start, start + 1, 'A'))
+    return variants
+
+
+def _apply(sequence, variants):
+    mutator = Mutator(sequence, Output(__file__))
+    for pos1, pos2, ins in variants:
+        mutator._mutate(pos1, pos2, ins)
+    return mutator
+
+
+def _best(function):
+    """
+    Best time in milliseconds of one call to `function`.
+    """
+    return min(timeit.repeat(function, repeat=REPEAT, number=1)) * 1000
+
+
+def main(counts):
+    """
+    Time applying alleles of the given sizes and print the results to
+    standard output.
+    """
+    sequence = Seq(''.join(random.choice('ACGT')
+                           for _ in range(SEQUENCE_LENGTH)))
+    sites = sorted(random.sample(range(1, SEQUENCE_LENGTH), SITES))
+
+    print '%10s %14s %14s %12s' % ('variants', 'ordered (ms)',
+                                   'shuffled (ms)', 'sites (ms)')
+    for count in counts:
+        variants = _allele(count)
+        shuffled = random.sample(variants, len(variants))
+        ordered = _best(lambda: _apply(sequence, variants))
+        unordered = _best(lambda: _apply(sequence, shuffled))
+        mutator = _apply(sequence, variants)
+        shift_sites = _best(lambda: mutator.shift_sites(sites))
+        print '%10d %14.1f %14.1f %12.1f' % (count, ordered, unordered,
+                                              shift_sites)
+
+
+if __name__ == '__main__':
+    if any(argument in ('-h', '--help') for argument in sys.argv[1:]):
+        print format_usage()
+        sys.exit(1)
+    main([int(argument) for argument in sys.argv[1:]] or [10, 100, 300, 1000])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Benchmark the GenBank parser.
+
+Usage:
+  {command} [file...]
+
+  file: GenBank file, optionally compressed with bzip2 (default: the GenBank
+        files in tests/data).
+
+For each file, the time to read the file with the fast reader and with
+BioPython is printed, together with the size of the sequence data in memory
+for both.
+
+Transcript-protein links are not looked up, so no network access or Redis
+server is needed.
+"""
+
+
+from __future__ import unicode_literals
+
+import codecs
+import glob
+import io
+import os
+import sys
+import timeit
+import warnings
+
+from Bio import SeqIO
+
+from mutalyzer import compression
+from mutalyzer.parsers import genbank_fast
+from mutalyzer.util import format_usage
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        os.pardir, os.pardir, 'tests', 'data')
+
+REPEAT = 3
+NUMBER = 5
+
+
+def _best(function):
+    """
+    Best time in milliseconds of one call to `function`.
+    """
+    times = timeit.repeat(function, repeat=REPEAT, number=NUMBER)
+    return min(times) / NUMBER * 1000
+
+
+def _read_fast(data):
+    record = genbank_fast.read(data)
+    record.seq
+    return record
+
+
+def _read_biopython(data):
+    handle = codecs.getreader('utf-8')(io.BytesIO(data))
+    return SeqIO.read(handle, 'genbank')
+
+
+def main(filenames):
+    """
+    Time the GenBank readers on the given files and print the results to
+    standard output.
+    """
+    warnings.simplefilter('ignore')
+
+    print '%-26s %10s %10s %14s %10s %14s' % (
+        'file', 'size (kB)', 'fast (ms)', 'seq fast (kB)', 'bio (ms)',
+        'seq bio (kB)')
+    for filename in filenames:
+        data = compression.read_file(filename)
+        try:
+            seq = _read_fast(data).seq
+        except genbank_fast.UnsupportedRecord:
+            fast, seq_fast = float('nan'), 0
+        else:
+            fast = _best(lambda: _read_fast(data))
+            seq_fast = sys.getsizeof(seq._data)
+        biopython = _best(lambda: _read_biopython(data))
+        seq_biopython = sys.getsizeof(_read_biopython(data).seq._data)
+        print '%-26s %10d %10.1f %14d %10.1f %14d' % (
+            os.path.basename(filename), len(data) // 1024, fast,
+            seq_fast // 1024, biopython, seq_biopython // 1024)
+
+
+if __name__ == '__main__':
+    if any(argument in ('-h', '--help') for argument in sys.argv[1:]):
+        print format_usage()
+        sys.exit(1)
+    main(sys.argv[1:] or
+         sorted(glob.glob(os.path.join(DATA_DIR, '*.gb.bz2'))))
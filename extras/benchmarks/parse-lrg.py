@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Benchmark the LRG parser.
+
+Usage:
+  {command} [file...]
+
+  file: LRG file, optionally compressed with bzip2 (default: the LRG files
+        in tests/data).
+
+For each file, the time to create a record with the LRG parser is printed,
+together with the time to only build a DOM of the file with minidom (which is
+what the parser used to do before extracting anything).
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import glob
+import os
+import sys
+import timeit
+import xml.dom.minidom
+
+from mutalyzer.parsers import lrg
+from mutalyzer.util import format_usage
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        os.pardir, os.pardir, 'tests', 'data')
+
+REPEAT = 5
+NUMBER = 10
+
+
+def _read(filename):
+    if filename.endswith('.bz2'):
+        with bz2.BZ2File(filename) as handle:
+            return handle.read()
+    with open(filename, 'rb') as handle:
+        return handle.read()
+
+
+def _best(function):
+    """
+    Best time in milliseconds of one call to `function`.
+    """
+    times = timeit.repeat(function, repeat=REPEAT, number=NUMBER)
+    return min(times) / NUMBER * 1000
+
+
+def main(filenames):
+    """
+    Time the LRG parser on the given files and print the results to standard
+    output.
+    """
+    print '%-20s %10s %12s %12s' % ('file', 'size (kB)', 'parser (ms)',
+                                     'minidom (ms)')
+    for filename in filenames:
+        data = _read(filename)
+        parser = _best(lambda: lrg.create_record(data))
+        minidom = _best(lambda: xml.dom.minidom.parseString(data))
+        print '%-20s %10d %12.1f %12.1f' % (
+            os.path.basename(filename), len(data) // 1024, parser, minidom)
+
+
+if __name__ == '__main__':
+    if any(argument in ('-h', '--help') for argument in sys.argv[1:]):
+        print format_usage()
+        sys.exit(1)
+    main(sys.argv[1:] or
+         sorted(glob.glob(os.path.join(DATA_DIR, 'LRG_*.xml.bz2'))))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Measure the memory footprint of parsed records.
+
+Usage:
+  {command} [file...]
+
+  file: GenBank or LRG file, optionally compressed with bzip2 (default: the
+        GenBank and LRG files in tests/data).
+
+For each file, a record is created with the GenBank or LRG parser and the
+following is printed:
+
+- The number of objects in the record.
+- The size in memory of these objects, not counting the sequence.
+- The size in memory of the sequence.
+- The size of the record in pickled form, as it is stored in the record cache
+  and in record files.
+
+Transcript-protein links are not looked up, so no network access or Redis
+server is needed.
+"""
+
+
+from __future__ import unicode_literals
+
+import cPickle as pickle
+import gc
+import glob
+import os
+import sys
+import types
+
+from mutalyzer import ncbi
+from mutalyzer.parsers import genbank
+from mutalyzer.parsers import lrg
+from mutalyzer import compression
+from mutalyzer.util import format_usage
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        os.pardir, os.pardir, 'tests', 'data')
+
+# Objects shared between records, these are not counted.
+SHARED = (type, types.ModuleType, types.FunctionType)
+
+
+def _no_link(*args, **kwargs):
+    raise ncbi.NoLinkError()
+
+
+def _create_record(filename):
+    if '.xml' in filename:
+        return lrg.create_record(compression.read_file(filename))
+    return genbank.GBparser().create_record(filename)
+
+
+def _sequence_data(record):
+    # Both Bio.Seq.Seq and our own sequence objects keep the sequence in the
+    # `_data` attribute.
+    return getattr(record.seq, '_data', record.seq)
+
+
+def _size(record, exclude):
+    """
+    Number of objects reachable from `record` and their total size in bytes,
+    not counting the objects in `exclude`.
+    """
+    seen = set(id(o) for o in exclude)
+    seen.add(id(record))
+    pending = [record]
+    count = size = 0
+
+    while pending:
+        obj = pending.pop()
+        count += 1
+        size += sys.getsizeof(obj)
+        for referent in gc.get_referents(obj):
+            if id(referent) not in seen and not isinstance(referent, SHARED):
+                seen.add(id(referent))
+                pending.append(referent)
+
+    return count, size
+
+
+def main(filenames):
+    """
+    Measure the records created from the given files and print the results
+    to standard output.
+    """
+    ncbi.transcript_to_protein = _no_link
+
+    print '%-26s %10s %12s %10s %12s' % (
+        'file', 'objects', 'model (kB)', 'seq (kB)', 'pickle (kB)')
+    for filename in filenames:
+        record = _create_record(filename)
+        sequence = _sequence_data(record)
+        objects, model = _size(record, [sequence])
+        pickled = len(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        print '%-26s %10d %12.1f %10.1f %12.1f' % (
+            os.path.basename(filename), objects, model / 1024.0,
+            sys.getsizeof(sequence) / 1024.0, pickled / 1024.0)
+
+
+if __name__ == '__main__':
+    if any(argument in ('-h', '--help') for argument in sys.argv[1:]):
+        print format_usage()
+        sys.exit(1)
+    main(sys.argv[1:] or
+         sorted(glob.glob(os.path.join(DATA_DIR, '*.gb.bz2')) +
+                glob.glob(os.path.join(DATA_DIR, 'LRG_*.xml.bz2'))))
@@ -17,6 +17,9 @@ search for them each time.
 
 from __future__ import unicode_literals
 
+import cPickle as pickle
+import io
+
 from mutalyzer import util
 from mutalyzer import Crossmap
 
@@ -43,6 +46,11 @@ class PList(object) :
         - list     ; A list (with an even amount of entries) of splice sites.
     """
 
+    # A record can have thousands of PList, Locus and Gene objects, so these
+    # classes use slots instead of a dictionary per instance. Attributes that
+    # are not listed here cannot be set.
+    __slots__ = ('location', 'positionList')
+
     def __init__(self) :
         """
         Initialise the class.
@@ -72,6 +80,13 @@ class Locus(object) :
         - exon ; A position list object.
     """
 
+    __slots__ = ('name', 'current', 'mRNA', 'CDS', 'location', 'exon',
+                 'txTable', 'CM', 'transcriptID', 'proteinID', 'genomicID',
+                 'molType', 'description', 'proteinDescription',
+                 'proteinRange', 'locusTag', 'link', 'transcribe',
+                 'translate', 'linkMethod', 'transcriptProduct',
+                 'proteinProduct')
+
     def __init__(self, name) :
         """
         Initialise the class.
@@ -156,6 +171,9 @@ class Gene(object) :
         - transcriptslist; A list of Locus objects.
     """
 
+    __slots__ = ('name', 'orientation', 'transcriptList', 'location',
+                 'longName', '__locusTag', '_loci', '_links')
+
     def __init__(self, name) :
         """
         Initialise the class.
@@ -168,6 +186,8 @@ class Gene(object) :
             - longName ;
         Private variables (altered):
             - __locusTag ;
+            - _loci      ; Index of transcripts by name (see index()).
+            - _links     ; Index of transcripts by link (see index()).
 
         @arg name: gene name
         @type name: unicode
@@ -179,8 +199,26 @@ class Gene(object) :
         self.location = []
         self.longName = ""
         self.__locusTag = "000"
+        self._loci = None
+        self._links = None
     #__init__
 
+    def index(self) :
+        """
+        Build the indexes used by findLocus() and findLink().
+
+        Until this is called, these methods scan the transcript list. The
+        indexes are not updated automatically, so this must be called again
+        after changing the transcript list.
+        """
+
+        self._loci = {}
+        self._links = {}
+        for position, locus in enumerate(self.transcriptList) :
+            self._loci.setdefault(locus.name, (position, locus))
+            self._links.setdefault(locus.link, locus)
+    #index
+
     def newLocusTag(self) :
         """
         Generates a new Locus tag.
@@ -205,9 +243,17 @@ class Gene(object) :
         @rtype: object
         """
 
-        for i in self.transcriptList :
-            if i.name == name or i.name == "%03i" % int(name):
-                return i
+        if self._loci is None :
+            for i in self.transcriptList :
+                if i.name == name or i.name == "%03i" % int(name):
+                    return i
+            return None
+
+        # The first transcript matching either name, like the scan above.
+        matches = [self._loci[key] for key in (name, "%03i" % int(name))
+                   if key in self._loci]
+        if matches :
+            return min(matches)[1]
         return None
     #findLocus
 
@@ -236,10 +282,13 @@ class Gene(object) :
         @rtype: object
         """
 
-        for i in self.transcriptList :
-            if i.link == protAcc :
-                return i
-        return None
+        if self._links is None :
+            for i in self.transcriptList :
+                if i.link == protAcc :
+                    return i
+            return None
+
+        return self._links.get(protAcc)
     #findLink
 #Gene
 
@@ -261,6 +310,15 @@ class Record(object) :
                       is present.
     """
 
+    # The id, source_* and organism attributes are set by the parsers and
+    # retrievers.
+    __slots__ = ('geneList', 'molType', 'seq', 'mapping', 'organelle',
+                 'source', 'description', '_sourcetype', 'version',
+                 'chromOffset', 'chromDescription', 'orientation', 'recordId',
+                 'id', 'source_id', 'source_accession', 'source_version',
+                 'organism', 'cache_key', '_genes', '_transcripts',
+                 '_sequences', '_new_sequences')
+
     def __init__(self) :
         """
         Initialise the class.
@@ -278,6 +336,18 @@ class Record(object) :
                           which one).
             - source    ; A fake gene that can be used when no gene
                           information is present.
+            - cache_key ; Accession number, checksum and file type under
+                          which the record is cached (set by the
+                          retrievers), None if the record is not cached.
+
+        Private variables (altered):
+            - _genes       ; Index of genes by name (see index()).
+            - _transcripts ; Index of transcript selectors by transcript
+                             accession (see index()).
+            - _sequences   ; Reference sequences of transcripts (see
+                             addSequences()).
+            - _new_sequences ; Keys of the reference sequences added since
+                               the record was cached.
         """
 
         self.geneList = []
@@ -293,8 +363,35 @@ class Record(object) :
         self.chromDescription = ""
         self.orientation = 1
         self.recordId = None
+        self.cache_key = None
+        self._genes = None
+        self._transcripts = None
+        self._sequences = {}
+        self._new_sequences = set()
     #__init__
 
+    def index(self) :
+        """
+        Build the indexes used by findGene() and get_transcript_selector(),
+        and those of all genes (see Gene.index()).
+
+        This should be called by the parsers once the record is complete.
+        Until then, these methods scan the gene and transcript lists. The
+        indexes are not updated automatically, so this must be called again
+        after changing the gene list or any of the transcript lists.
+        """
+
+        self._genes = {}
+        self._transcripts = {}
+        for gene in self.geneList :
+            gene.index()
+            self._genes.setdefault(gene.name, gene)
+            for transcript in gene.transcriptList :
+                self._transcripts.setdefault(transcript.transcriptID,
+                                             (gene.name, transcript.name))
+        self.source.index()
+    #index
+
     def findGene(self, name) :
         """
         Returns a Gene object, given its name.
@@ -306,10 +403,13 @@ class Record(object) :
         @rtype: object
         """
 
-        for i in self.geneList :
-            if i.name == name :
-                return i
-        return None
+        if self._genes is None :
+            for i in self.geneList :
+                if i.name == name :
+                    return i
+            return None
+
+        return self._genes.get(name)
     #findGene
 
     def get_transcript_selector(self, accession):
@@ -321,12 +421,95 @@ class Record(object) :
         @return: tuple(unicode, unicode)
         """
 
-        for gene in self.geneList:
-            for transcript in gene.transcriptList:
-                if transcript.transcriptID == accession:
-                    return gene.name, transcript.name
+        if self._transcripts is None:
+            for gene in self.geneList:
+                for transcript in gene.transcriptList:
+                    if transcript.transcriptID == accession:
+                        return gene.name, transcript.name
+            return None
+
+        return self._transcripts.get(accession)
     #getInfoByTranscriptID
 
+    def getSequences(self, key) :
+        """
+        Returns the reference sequences of a transcript added with
+        addSequences().
+
+        @arg key: Gene name, transcript name and translation table of the
+            transcript.
+        @type key: tuple(unicode, unicode, int)
+
+        @return: The sequences, or None if they were not added.
+        @rtype: dict
+        """
+
+        return self._sequences.get(key)
+    #getSequences
+
+    def addSequences(self, key, sequences) :
+        """
+        Remember the reference sequences (mRNA, CDS, protein) of a
+        transcript. They are kept with the record in the record cache, see
+        popNewSequences().
+
+        @arg key: Gene name, transcript name and translation table of the
+            transcript.
+        @type key: tuple(unicode, unicode, int)
+        @arg sequences: The sequences.
+        @type sequences: dict
+        """
+
+        self._sequences[key] = sequences
+        self._new_sequences.add(key)
+    #addSequences
+
+    def popNewSequences(self) :
+        """
+        Returns the reference sequences added with addSequences() since the
+        record was cached (or since the last call of this method).
+
+        @return: The sequences by key.
+        @rtype: dict
+        """
+
+        new_sequences = dict((key, self._sequences[key])
+                             for key in self._new_sequences)
+        self._new_sequences = set()
+        return new_sequences
+    #popNewSequences
+
+    def copier(self) :
+        """
+        Returns a function creating fresh copies of this record, to check
+        several variant descriptions on the same record.
+
+        The copies share the sequence and the reference sequences of
+        transcripts (see addSequences()) with this record, since they are
+        not modified while checking a variant description. So copying does
+        not depend on the length of the sequence.
+
+        @return: Function without arguments returning a copy.
+        @rtype: callable
+        """
+
+        shared = {'seq': self.seq, 'sequences': self._sequences}
+        shared_ids = dict((id(value), key) for key, value in shared.items())
+
+        handle = io.BytesIO()
+        pickler = pickle.Pickler(handle, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: shared_ids.get(id(obj))
+        pickler.dump(self)
+        data = handle.getvalue()
+
+        def copy() :
+            unpickler = pickle.Unpickler(io.BytesIO(data))
+            unpickler.persistent_load = shared.__getitem__
+            return unpickler.load()
+
+        return copy
+    #copier
+
     def listGenes(self) :
         """
         List the names of all genes found in this record.
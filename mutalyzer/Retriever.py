@@ -9,11 +9,13 @@ to re-download the file.
 
 from __future__ import unicode_literals
 
-import bz2
 import chardet
+import codecs
 import hashlib
 import io
 import os
+import re
+import tempfile
 import urllib2
 
 from Bio import Entrez
@@ -21,9 +23,13 @@ from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 from Bio.Seq import UnknownSeq
 from httplib import HTTPException
+from lxml import etree
 from sqlalchemy.orm.exc import NoResultFound
-from xml.dom import DOMException
 
+from mutalyzer import cache
+from mutalyzer import compression
+from mutalyzer import entrez
+from mutalyzer import nc_db
 from mutalyzer import util
 from mutalyzer.config import settings
 from mutalyzer.db import session
@@ -32,6 +38,22 @@ from mutalyzer.parsers import genbank
 from mutalyzer.parsers import lrg
 
 
+#: Maximum number of records fetched from the NCBI in one EFetch request.
+EFETCH_BATCH_SIZE = 100
+
+#: Number of bytes read at a time when downloading a reference file. The
+#: encoding of the file is detected from the first chunk.
+DOWNLOAD_CHUNK_SIZE = 65536
+
+# Accession number with version of a GenBank record.
+GENBANK_VERSION = re.compile(br'^VERSION\s+(\S+)', re.MULTILINE)
+
+# A GenBank record in an EFetch result, terminated by a line containing just
+# `//` and followed by blank lines, exactly as it is returned for a single
+# accession number.
+GENBANK_RECORD = re.compile(br'.*?\n//\n\n*', re.DOTALL)
+
+
 class Retriever(object):
     """
     Retrieve a record from either the cache or the NCBI.
@@ -46,9 +68,6 @@ class Retriever(object):
         self._output = output
         if not os.path.isdir(settings.CACHE_DIR):
             os.mkdir(settings.CACHE_DIR)
-        Entrez.email = settings.EMAIL
-        if hasattr(settings, 'ENTREZ_API_KEY'):
-            Entrez.api_key = settings.ENTREZ_API_KEY
         self.file_type = None
 
     def _name_to_file(self, name):
@@ -63,42 +82,168 @@ class Retriever(object):
         return os.path.join(
             settings.CACHE_DIR, '{}.{}.bz2'.format(name, self.file_type))
 
-    def _write(self, raw_data, filename):
+    def _download(self, handle, max_size=None, markers=()):
         """
-        Write raw data to a compressed file.
-
-        :arg str raw_data: The raw_data to be compressed and written.
-        :arg unicode filename: The intended name of the output filename.
-
-        :returns: The full path and name of the file written.
-        :rtype: unicode
+        Stream data from a file-like object to a temporary file in the cache
+        directory.
+
+        The data is read in chunks which are converted to UTF-8, compressed
+        and written as they come in, so only one chunk is kept in memory at
+        any time. The encoding is detected from the first chunk. The md5sum is
+        calculated over the data as it was read.
+
+        :arg object handle: File-like object to read from.
+        :arg int max_size: Maximum number of bytes to read. If the data is
+          larger, the download is aborted.
+        :arg tuple(str) markers: Byte strings to look for in the (UTF-8
+          encoded) data.
+
+        :returns: Tuple of the temporary filename, the md5sum, the first chunk
+          of (UTF-8 encoded) data, and the set of markers found, or None in
+          case of an error. The temporary file should be passed to
+          :meth:`_store` or :meth:`_discard`.
+        :rtype: tuple(unicode, unicode, str, set(str))
         """
-        result = chardet.detect(raw_data)
+        prefix = b''
+        while len(prefix) < DOWNLOAD_CHUNK_SIZE:
+            chunk = handle.read(DOWNLOAD_CHUNK_SIZE - len(prefix))
+            if not chunk:
+                break
+            prefix += chunk
+
+        result = chardet.detect(prefix)
         if result['confidence'] > 0.5:
             encoding = unicode(result['encoding'])
         else:
             encoding = 'utf-8'
 
-        if not util.is_utf8_alias(encoding):
+        # ASCII is a subset of UTF-8, and a prefix in pure ASCII says nothing
+        # about the rest of the data.
+        if util.is_utf8_alias(encoding) or encoding.lower() == 'ascii':
+            decoder = None
+        else:
             try:
-                raw_data = raw_data.decode(encoding).encode('utf-8')
-            except UnicodeDecodeError:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            except LookupError:
                 self._output.addMessage(
                     __file__, 4, 'ENOPARSE',
                     'Could not decode file (using {} encoding).'.format(
                         encoding))
                 return None
 
-        # Compress the data to save disk space.
-        comp = bz2.BZ2Compressor()
-        data = comp.compress(raw_data)
-        data += comp.flush()
-        out_handle = open(self._name_to_file(filename), 'wb')
-        out_handle.write(data)
-        out_handle.close()
+        hash_func = hashlib.md5()
+        compressor = compression.compressor()
+        size = 0
+        found = set()
+        tail = b''
+        first = True
+        overlap = max([len(marker) for marker in markers] or [1]) - 1
+
+        out_handle = tempfile.NamedTemporaryFile(
+            dir=settings.CACHE_DIR, prefix='.download-', delete=False)
+        try:
+            with out_handle:
+                chunk = prefix
+                while chunk:
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        self._output.addMessage(
+                            __file__, 4, 'EFILESIZE',
+                            'Filesize is not within the allowed boundaries.')
+                        self._discard(out_handle.name)
+                        return None
+
+                    hash_func.update(chunk)
+
+                    if decoder is not None:
+                        try:
+                            chunk = decoder.decode(chunk).encode('utf-8')
+                        except UnicodeDecodeError:
+                            self._output.addMessage(
+                                __file__, 4, 'ENOPARSE',
+                                'Could not decode file (using {} '
+                                'encoding).'.format(encoding))
+                            self._discard(out_handle.name)
+                            return None
+                        if first:
+                            prefix = chunk
+                    first = False
+
+                    # Markers can span two chunks.
+                    for marker in markers:
+                        if (marker in chunk or
+                                marker in tail + chunk[:overlap]):
+                            found.add(marker)
+                    tail = chunk[len(chunk) - overlap:] if overlap else b''
+
+                    out_handle.write(compressor.compress(chunk))
+                    chunk = handle.read(DOWNLOAD_CHUNK_SIZE)
+
+                out_handle.write(compressor.flush())
+        except:
+            self._discard(out_handle.name)
+            raise
+
+        return out_handle.name, unicode(hash_func.hexdigest()), prefix, found
+
+    def _store(self, tempname, filename):
+        """
+        Move a downloaded file into place in the cache directory.
+
+        :arg unicode tempname: Temporary file as returned by
+          :meth:`_download`.
+        :arg unicode filename: The intended name of the output filename.
+
+        :returns: The full path and name of the file written.
+        :rtype: unicode
+        """
+        path = self._name_to_file(filename)
+
+        # Temporary files are only readable by their owner.
+        os.chmod(tempname, 0o644)
+        os.rename(tempname, path)
+
+        # Make room for the new file in the cache directory.
+        cache.evict(keep=path)
 
         # Return the full path to the file.
-        return out_handle.name
+        return path
+
+    def _discard(self, tempname):
+        """
+        Remove a downloaded file that is not stored. Does nothing if the file
+        was already stored or removed.
+
+        :arg unicode tempname: Temporary file as returned by
+          :meth:`_download`.
+        """
+        try:
+            os.unlink(tempname)
+        except OSError:
+            pass
+
+    def cache_record(self, reference):
+        """
+        Parse a reference file in the cache and store the record in the
+        record cache, replacing any previously cached record.
+
+        :arg object reference: The reference (as stored in the database).
+
+        :returns: True if the record was cached, False if the reference file
+          is not in the cache or could not be parsed.
+        :rtype: bool
+        """
+        filename = self._name_to_file(reference.accession)
+        if not os.path.isfile(filename):
+            return False
+
+        record = self._parse_record(filename, reference.accession)
+        if record is None:
+            return False
+
+        cache.put_record(reference.accession, reference.checksum,
+                         self.file_type, record)
+        return True
 
     def _calculate_hash(self, content):
         """
@@ -125,9 +270,9 @@ class Retriever(object):
         ud = util.generate_id()
         return 'UD_' + unicode(ud)
 
-    def _update_db_md5(self, raw_data, name, source):
+    def _update_db_md5(self, md5sum, name, source):
         """
-        :arg str raw_data:
+        :arg unicode md5sum:
         :arg unicode name:
         :arg unicode source:
 
@@ -142,7 +287,6 @@ class Retriever(object):
             current_md5sum = None
 
         if current_md5sum:
-            md5sum = self._calculate_hash(raw_data)
             if md5sum != current_md5sum:
                 self._output.addMessage(
                     __file__, -1, 'WHASH',
@@ -152,7 +296,7 @@ class Retriever(object):
                     {'checksum': md5sum})
                 session.commit()
         else:
-            reference = Reference(name, self._calculate_hash(raw_data), source)
+            reference = Reference(name, md5sum, source)
             session.add(reference)
             session.commit()
         return self._name_to_file(name)
@@ -192,21 +336,51 @@ class GenBankRetriever(Retriever):
             - 1 ; id
         :rtype: unicode
         """
-        if raw_data.strip() == b'Nothing has been found':
+        download = self._download(io.BytesIO(raw_data))
+        if download is None:
+            return None
+
+        tempname, _, prefix, _ = download
+        try:
+            return self._write_download(tempname, prefix, filename, extract)
+        finally:
+            self._discard(tempname)
+
+    def _write_download(self, tempname, prefix, filename, extract):
+        """
+        Store a downloaded file in the cache. The file is parsed before it is
+        stored, see :meth:`write`.
+
+        :arg unicode tempname: Temporary file as returned by
+          :meth:`_download`.
+        :arg str prefix: The first chunk of data as returned by
+          :meth:`_download`.
+        :arg unicode filename: The intended name of the file.
+        :arg int extract: Flag that indicates whether to extract the record ID:
+            - 0 ; Do not extract, use 'filename'
+            - 1 ; Extract
+
+        :returns: Depending on the value of 'extract':
+            - 0 ; filename
+            - 1 ; id
+        :rtype: unicode
+        """
+        if prefix.strip() == b'Nothing has been found':
             self._output.addMessage(
                 __file__, 4, 'ENORECORD', 'The record could not be retrieved.')
             return None
 
-        # BioPython needs a file handle.
-        fake_handle = io.BytesIO()
-        fake_handle.write(raw_data)
-        fake_handle.seek(0)
+        # BioPython reads the file incrementally, but the parsed record is
+        # kept in memory.
+        handle = compression.open_file(tempname)
         try:
-            record = SeqIO.read(fake_handle, 'genbank')
+            record = SeqIO.read(handle, 'genbank')
         except (ValueError, AttributeError):
             self._output.addMessage(
                 __file__, 4, 'ENOPARSE', 'The file could not be parsed.')
             return None
+        finally:
+            handle.close()
 
         if type(record.seq) == UnknownSeq:
             self._output.addMessage(
@@ -231,69 +405,211 @@ class GenBankRetriever(Retriever):
                     'number to reduce downloading overhead.'.format(
                         unicode(record.id)))
 
-        if not self._write(raw_data, out_filename):
-            return None
-
+        self._store(tempname, out_filename)
         return out_filename
 
     def fetch(self, name):
         """
-        Todo: Documentation.
+        Fetch a GenBank record from the NCBI and store it in the cache.
+
+        If another process is already fetching the same record, we wait for
+        it to finish and use its result.
+
+        :arg unicode name: The accession number.
+
+        :returns: The full path to the file or None in case of failure.
+        :rtype: unicode
+        """
+        with cache.single_flight('ncbi:{}'.format(name)) as waited:
+            if waited:
+                reference = Reference.query.filter_by(accession=name).first()
+                if reference is not None:
+                    filename = self._name_to_file(reference.accession)
+                    if os.path.isfile(filename):
+                        cache.register_coalesced()
+                        return filename
+
+            return self._fetch(name)
+
+    def _fetch_length(self, name):
+        """
+        Get the length of a GenBank record from an Entrez esummary query,
+        without downloading the record itself.
+
+        :arg unicode name: The accession number.
 
-        Todo: A better implementation would probably use an esummary query
-            first to get the length of the sequence. If this is within limits,
-            use efetch with rettype=gbwithparts to download the GenBank file.
+        :returns: Length of the sequence in base pairs, or None if it could
+          not be determined.
+        :rtype: int
         """
         try:
-            net_handle = Entrez.efetch(
-                db='nuccore', id=name, rettype='gb', retmode='text')
-            raw_data = net_handle.read()
-            net_handle.close()
+            handle = entrez.esummary(db='nuccore', id=name)
         except (IOError, urllib2.HTTPError, HTTPException) as e:
             self._output.addMessage(
                 __file__, -1, 'INFO',
                 'Error connecting to Entrez nuccore database: {}'.format(
                     unicode(e)))
+            return None
+
+        try:
+            summary = Entrez.read(handle)
+            return int(summary[0]['Length'])
+        except (Entrez.Parser.ValidationError, RuntimeError, IndexError,
+                KeyError, ValueError):
             self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(name))
+                __file__, -1, 'INFO', 'Error reading Entrez esummary result.')
             return None
+        finally:
+            handle.close()
+
+    def _efetch(self, name, rettype, markers=()):
+        """
+        Download a GenBank record from the NCBI to a temporary file in the
+        cache directory.
 
-        # Check if the file is empty or not.
-        if raw_data.strip() == b'':
+        :arg unicode name: The accession number.
+        :arg unicode rettype: Entrez efetch return type, ``gb`` or
+          ``gbwithparts``.
+        :arg tuple(str) markers: See :meth:`_download`.
+
+        :returns: See :meth:`_download`.
+        :rtype: tuple(unicode, unicode, str, set(str))
+        """
+        try:
+            net_handle = entrez.efetch(
+                db='nuccore', id=name, rettype=rettype, retmode='text')
+            download = self._download(net_handle, markers=markers)
+            net_handle.close()
+        except (IOError, urllib2.HTTPError, HTTPException) as e:
+            self._output.addMessage(
+                __file__, -1, 'INFO',
+                'Error connecting to Entrez nuccore database: {}'.format(
+                    unicode(e)))
             self._output.addMessage(
                 __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(name))
             return None
 
-        if b'Resource temporarily unavailable' in raw_data:
+        return download
+
+    def _fetch(self, name):
+        """
+        Download a GenBank record from the NCBI and store it in the cache.
+
+        The length of the record is looked up with an esummary query first.
+        Records exceeding the maximum file size are rejected without
+        downloading them, others are downloaded with their parts included
+        (rettype ``gbwithparts``), so constructed records (CON division) need
+        only one request.
+
+        If the length cannot be determined, the record is downloaded without
+        parts (rettype ``gb``) and downloaded again with parts if it turns out
+        to be a constructed record.
+
+        :arg unicode name: The accession number.
+
+        :returns: The full path to the file or None in case of failure.
+        :rtype: unicode
+        """
+        length = self._fetch_length(name)
+        if length is not None and length > settings.MAX_FILE_SIZE:
             self._output.addMessage(
                 __file__, 4, 'ERETR',
-                'Resource temporarily unavailable from NCBI servers: '
-                '{}.'.format(name))
+                'Could not retrieve {} (exceeds maximum file size of {} '
+                'megabytes).'.format(name, settings.MAX_FILE_SIZE // 1048576))
             return None
 
-        # This is a hack to detect constructed references, the proper way to
-        # do this would be to check the data_file_division attribute of the
-        # parsed GenBank file (it would be 'CON').
-        if b'\nCONTIG' in raw_data:
-            try:
-                # Get the length in base pairs
-                length = int(
-                    raw_data[:raw_data.index(b' bp', 0, 500)].split()[-1])
-            except (ValueError, IndexError):
+        if length is None:
+            download = self._efetch(name, 'gb', markers=(b'\nCONTIG',))
+        else:
+            download = self._efetch(name, 'gbwithparts')
+
+        if download is None:
+            return None
+
+        tempname, md5sum, prefix, found = download
+        try:
+            # Check if the file is empty or not.
+            if prefix.strip() == b'':
                 self._output.addMessage(
-                    __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(
-                        name))
+                    __file__, 4, 'ERETR',
+                    'Could not retrieve {}.'.format(name))
                 return None
-            if length > settings.MAX_FILE_SIZE:
+
+            if b'Resource temporarily unavailable' in prefix:
                 self._output.addMessage(
                     __file__, 4, 'ERETR',
-                    'Could not retrieve {} (exceeds maximum file size of {} '
-                    'megabytes).'.format(
-                        name, settings.MAX_FILE_SIZE // 1048576))
+                    'Resource temporarily unavailable from NCBI servers: '
+                    '{}.'.format(name))
                 return None
+
+            # This is a hack to detect constructed references, the proper way
+            # to do this would be to check the data_file_division attribute
+            # of the parsed GenBank file (it would be 'CON').
+            if b'\nCONTIG' in found:
+                self._discard(tempname)
+                try:
+                    # Get the length in base pairs
+                    length = int(
+                        prefix[:prefix.index(b' bp', 0, 500)].split()[-1])
+                except (ValueError, IndexError):
+                    self._output.addMessage(
+                        __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(
+                            name))
+                    return None
+                if length > settings.MAX_FILE_SIZE:
+                    self._output.addMessage(
+                        __file__, 4, 'ERETR',
+                        'Could not retrieve {} (exceeds maximum file size of '
+                        '{} megabytes).'.format(
+                            name, settings.MAX_FILE_SIZE // 1048576))
+                    return None
+
+                download = self._efetch(name, 'gbwithparts')
+                if download is None:
+                    return None
+                tempname, md5sum, prefix, _ = download
+
+            name = self._write_download(tempname, prefix, name, 1)
+        finally:
+            self._discard(tempname)
+
+        if name:
+            # Processing went okay.
+            return self._update_db_md5(md5sum, name, 'ncbi')
+        else:
+            # Parse error in the GenBank file.
+            return None
+
+    def prefetch(self, accessions):
+        """
+        Fetch GenBank records that are not yet in the cache from the NCBI,
+        using one EFetch request for many records.
+
+        Constructed records (CON division) are skipped, they are fetched with
+        their parts included by :meth:`fetch` when they are needed.
+
+        Errors are only logged, since records that could not be prefetched
+        are fetched by :meth:`loadrecord` when they are needed.
+
+        :arg list(unicode) accessions: Accession numbers (including version).
+
+        :returns: Number of records fetched.
+        :rtype: int
+        """
+        missing = []
+        for accession in accessions:
+            reference = Reference.query.filter_by(accession=accession).first()
+            if reference is None or (
+                    reference.source == 'ncbi' and
+                    not os.path.isfile(self._name_to_file(accession))):
+                missing.append(accession)
+
+        fetched = 0
+        for i in range(0, len(missing), EFETCH_BATCH_SIZE):
+            batch = missing[i:i + EFETCH_BATCH_SIZE]
             try:
-                net_handle = Entrez.efetch(
-                    db='nuccore', id=name, rettype='gbwithparts',
+                net_handle = entrez.efetch(
+                    db='nuccore', id=','.join(batch), rettype='gb',
                     retmode='text')
                 raw_data = net_handle.read()
                 net_handle.close()
@@ -302,18 +618,25 @@ class GenBankRetriever(Retriever):
                     __file__, -1, 'INFO',
                     'Error connecting to Entrez nuccore database: {}'.format(
                         unicode(e)))
-                self._output.addMessage(
-                    __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(
-                        name))
-                return None
-
-        name = self.write(raw_data, name, 1)
-        if name:
-            # Processing went okay.
-            return self._update_db_md5(raw_data, name, 'ncbi')
-        else:
-            # Parse error in the GenBank file.
-            return None
+                continue
+
+            # Keep the exact bytes of each record, so its checksum is the
+            # same as when it is fetched on its own.
+            for match in GENBANK_RECORD.finditer(raw_data):
+                record_data = match.group()
+                if b'\nCONTIG' in record_data:
+                    continue
+
+                version = GENBANK_VERSION.search(record_data)
+                if version is None:
+                    continue
+                name = self.write(record_data, version.group(1).decode(), 1)
+                if name:
+                    self._update_db_md5(
+                        self._calculate_hash(record_data), name, 'ncbi')
+                    fetched += 1
+
+        return fetched
 
     def retrieveslice(self, accno, start, stop, orientation):
         """
@@ -368,26 +691,76 @@ class GenBankRetriever(Retriever):
             # It's still present.
             return reference.accession
 
-        # It's not present, so download it.
-        try:
-            # EFetch `seq_start` and `seq_stop` are one-based, inclusive, and
-            # in reference orientation.
-            handle = Entrez.efetch(
-                db='nuccore', rettype='gbwithparts', retmode='text', id=accno,
-                seq_start=start, seq_stop=stop, strand=orientation)
-            raw_data = handle.read()
-            handle.close()
-        except (IOError, urllib2.HTTPError, HTTPException) as e:
-            self._output.addMessage(
-                __file__, -1, 'INFO',
-                'Error connecting to Entrez nuccore database: {}'.format(
-                    unicode(e)))
-            self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve slice.')
+        lock_key = 'ncbi_slice:{}'.format(source_data)
+        with cache.single_flight(lock_key) as waited:
+            if waited:
+                # Another process might have downloaded it in the meantime.
+                reference = Reference.query.filter_by(
+                    source='ncbi_slice',
+                    source_data=source_data
+                ).first()
+                if reference and os.path.isfile(
+                        self._name_to_file(reference.accession)):
+                    cache.register_coalesced()
+                    return reference.accession
+
+            return self._fetch_slice(
+                accno, start, stop, orientation, source_data, reference)
+
+    def _fetch_slice(self, accno, start, stop, orientation, source_data,
+                     reference):
+        """
+        Download a slice of a chromosome and store it in the cache.
+
+        :arg unicode accno: The accession number of the chromosome.
+        :arg int start: Start position of the slice (one-based, inclusive, in
+          reference orientation).
+        :arg int stop: End position of the slice (one-based, inclusive, in
+          reference orientation).
+        :arg int orientation: Orientation of the slice:
+            - 1 ; Forward.
+            - 2 ; Reverse complement.
+        :arg unicode source_data: Value of the Reference.source_data field for
+          this slice.
+        :arg object reference: The reference for this slice if we have seen it
+          before, None otherwise.
+
+        :returns: An UD number.
+        :rtype: unicode
+        """
+        raw_data = None
+        if settings.LOCAL_SLICES:
+            # Build the slice from the local chromosome sequences if they are
+            # available, falling back to the NCBI otherwise.
+            raw_data = nc_db.get_slice_genbank(accno, start, stop,
+                                               orientation)
+
+        if raw_data is not None:
+            download = self._download(io.BytesIO(raw_data))
+        else:
+            try:
+                # EFetch `seq_start` and `seq_stop` are one-based, inclusive,
+                # and in reference orientation.
+                handle = entrez.efetch(
+                    db='nuccore', rettype='gbwithparts', retmode='text',
+                    id=accno, seq_start=start, seq_stop=stop,
+                    strand=orientation)
+                download = self._download(handle)
+                handle.close()
+            except (IOError, urllib2.HTTPError, HTTPException) as e:
+                self._output.addMessage(
+                    __file__, -1, 'INFO',
+                    'Error connecting to Entrez nuccore database: {}'.format(
+                        unicode(e)))
+                self._output.addMessage(
+                    __file__, 4, 'ERETR', 'Could not retrieve slice.')
+                return None
+
+        if download is None:
             return None
 
-        # Calculate the hash of the downloaded file.
-        md5sum = self._calculate_hash(raw_data)
+        # The hash of the downloaded file is calculated while downloading.
+        tempname, md5sum, prefix, _ = download
 
         if reference is not None:
             # We have seen this one before.
@@ -409,8 +782,11 @@ class GenBankRetriever(Retriever):
             session.add(reference)
             session.commit()
 
-        if self.write(raw_data, reference.accession, 0):
-            return reference.accession
+        try:
+            if self._write_download(tempname, prefix, reference.accession, 0):
+                return reference.accession
+        finally:
+            self._discard(tempname)
 
     def retrievegene(self, gene, organism, upstream=0, downstream=0):
         """
@@ -428,7 +804,7 @@ class GenBankRetriever(Retriever):
         # Search the NCBI for a specific gene in an organism.
         query = '{}[Gene] AND {}[Orgn]'.format(gene, organism)
         try:
-            handle = Entrez.esearch(db='gene', term=query)
+            handle = entrez.esearch(db='gene', term=query)
             try:
                 search_result = Entrez.read(handle)
             except Entrez.Parser.ValidationError:
@@ -456,7 +832,7 @@ class GenBankRetriever(Retriever):
         for i in search_result['IdList']:
             # Inspect all results.
             try:
-                handle = Entrez.esummary(db='gene', id=i)
+                handle = entrez.esummary(db='gene', id=i)
                 try:
                     summary = Entrez.read(handle)
                 except Entrez.Parser.ValidationError:
@@ -573,27 +949,38 @@ class GenBankRetriever(Retriever):
         if info.gettype() == 'text/plain':
             length = int(info['Content-Length'])
             if 512 < length < settings.MAX_FILE_SIZE:
-                raw_data = handle.read()
-                md5sum = self._calculate_hash(raw_data)
+                download = self._download(
+                    handle, max_size=settings.MAX_FILE_SIZE)
+                handle.close()
+                if download is None:
+                    return None
+                tempname, md5sum, prefix, _ = download
 
                 ud = None
                 try:
-                    reference = Reference.query.filter_by(
-                        checksum=md5sum).one()
-                except NoResultFound:
-                    ud = self._new_ud()
-                    if not os.path.isfile(self._name_to_file(ud)):
-                        ud = self.write(raw_data, ud, 0) and ud
-                    if ud:
-                        # Parsing went OK, add to DB.
-                        reference = Reference(ud, md5sum, source='url',
-                                              source_data=url)
-                        session.add(reference)
-                        session.commit()
-                else:
-                    if (os.path.isfile(self._name_to_file(reference.accession)) or
-                            self.write(raw_data, reference.accession, 0)):
-                        ud = reference.accession
+                    try:
+                        reference = Reference.query.filter_by(
+                            checksum=md5sum).one()
+                    except NoResultFound:
+                        ud = self._new_ud()
+                        if not os.path.isfile(self._name_to_file(ud)):
+                            ud = self._write_download(
+                                tempname, prefix, ud, 0) and ud
+                        if ud:
+                            # Parsing went OK, add to DB.
+                            reference = Reference(ud, md5sum, source='url',
+                                                  source_data=url)
+                            session.add(reference)
+                            session.commit()
+                    else:
+                        if (os.path.isfile(
+                                self._name_to_file(reference.accession)) or
+                                self._write_download(
+                                    tempname, prefix, reference.accession,
+                                    0)):
+                            ud = reference.accession
+                finally:
+                    self._discard(tempname)
 
                 # Returns the UD or None.
                 return ud
@@ -658,6 +1045,7 @@ class GenBankRetriever(Retriever):
 
         if reference is None:
             # We don't know it, fetch it from NCBI.
+            cache.register_miss()
             filename = self.fetch(accession)
 
         else:
@@ -666,37 +1054,41 @@ class GenBankRetriever(Retriever):
 
             if os.path.isfile(filename):
                 # It is still in the cache, so filename is valid.
-                pass
-
-            elif reference.source == 'ncbi_slice':
-                # It was previously created by slicing.
-                cast_orientation = {
-                    None: None, 'forward': 1, 'reverse': 2}
-                (slice_accession,
-                 slice_start,
-                 slice_stop,
-                 slice_orientation) = reference.source_data.split(':')
-                slice_start = int(slice_start)
-                slice_stop = int(slice_stop)
-                slice_orientation = cast_orientation[slice_orientation]
-                if not self.retrieveslice(slice_accession, slice_start,
-                                          slice_stop, slice_orientation):
-                    filename = None
-
-            elif reference.source == 'url':
-                # It was previously created by URL.
-                if not self.downloadrecord(reference.source_data):
-                    filename = None
-
-            elif reference.source == 'ncbi':
-                # It was previously fetched from NCBI.
-                filename = self.fetch(reference.accession)
+                cache.register_hit(filename)
 
             else:
-                # It was previously created by uploading.
-                self._output.addMessage(
-                    __file__, 4, 'ERETR', 'Please upload this sequence again.')
-                filename = None
+                cache.register_miss()
+
+                if reference.source == 'ncbi_slice':
+                    # It was previously created by slicing.
+                    cast_orientation = {
+                        None: None, 'forward': 1, 'reverse': 2}
+                    (slice_accession,
+                     slice_start,
+                     slice_stop,
+                     slice_orientation) = reference.source_data.split(':')
+                    slice_start = int(slice_start)
+                    slice_stop = int(slice_stop)
+                    slice_orientation = cast_orientation[slice_orientation]
+                    if not self.retrieveslice(slice_accession, slice_start,
+                                              slice_stop, slice_orientation):
+                        filename = None
+
+                elif reference.source == 'url':
+                    # It was previously created by URL.
+                    if not self.downloadrecord(reference.source_data):
+                        filename = None
+
+                elif reference.source == 'ncbi':
+                    # It was previously fetched from NCBI.
+                    filename = self.fetch(reference.accession)
+
+                else:
+                    # It was previously created by uploading.
+                    self._output.addMessage(
+                        __file__, 4, 'ERETR',
+                        'Please upload this sequence again.')
+                    filename = None
 
         # If filename is None, we could not retrieve the record.
         if filename is None:
@@ -704,12 +1096,38 @@ class GenBankRetriever(Retriever):
             self._output.addOutput('BatchFlags', ('S1', accession))
             return None
 
-        # Now we have the file, so we can parse it.
+        if reference is None:
+            return self._parse_record(filename)
+
+        # Records we have seen before might still be in the record cache.
+        record = cache.get_record(
+            reference.accession, reference.checksum, self.file_type)
+
+        if record is None:
+            # Now we have the file, so we can parse it.
+            record = self._parse_record(filename, reference.accession)
+            if record is not None:
+                cache.put_record(reference.accession, reference.checksum,
+                                 self.file_type, record)
+
+        return record
+
+    def _parse_record(self, filename, accession=None):
+        """
+        Parse a RefSeq record from a file in the cache.
+
+        :arg unicode filename: Path to the GenBank file.
+        :arg unicode accession: Accession number of the record (if known).
+
+        :returns: A parsed RefSeq record or `None` if the record is not
+          supported.
+        :rtype: object
+        """
         genbank_parser = genbank.GBparser()
         record = genbank_parser.create_record(filename)
 
-        if reference:
-            record.id = reference.accession
+        if accession:
+            record.id = accession
         else:
             record.id = record.source_id
 
@@ -748,8 +1166,11 @@ class LRGRetriever(Retriever):
         # Make a filename based upon the identifier.
         filename = self._name_to_file(identifier)
 
-        if not os.path.isfile(filename):
+        if os.path.isfile(filename):
+            cache.register_hit(filename)
+        else:
             # We can't find the file.
+            cache.register_miss()
             filename = self.fetch(identifier)
 
         if filename is None:
@@ -758,17 +1179,39 @@ class LRGRetriever(Retriever):
             # return None in case of error.
             return None
 
-        # Now we have the file, so we can parse it.
-        file_handle = bz2.BZ2File(filename, 'r')
+        reference = Reference.query.filter_by(accession=identifier).first()
+        if reference is None:
+            return self._parse_record(filename, identifier)
+
+        # Records we have seen before might still be in the record cache.
+        record = cache.get_record(
+            reference.accession, reference.checksum, self.file_type)
+
+        if record is None:
+            # Now we have the file, so we can parse it.
+            record = self._parse_record(filename, identifier)
+            cache.put_record(reference.accession, reference.checksum,
+                             self.file_type, record)
 
+        return record
+
+    def _parse_record(self, filename, accession):
+        """
+        Parse a LRG record from a file in the cache.
+
+        :arg unicode filename: Path to the LRG file.
+        :arg unicode accession: The name of the LRG record.
+
+        :returns: GenRecord.Record of LRG file.
+        :rtype: object
+        """
         # Create GenRecord.Record from LRG file.
-        record = lrg.create_record(file_handle.read())
-        file_handle.close()
+        record = lrg.create_record(compression.read_file(filename))
 
         # We don't create LRGs from other sources, so id is always the same
         # as source_id.
-        record.id = identifier
-        record.source_id = identifier
+        record.id = accession
+        record.source_id = accession
 
         return record
 
@@ -776,6 +1219,9 @@ class LRGRetriever(Retriever):
         """
         Fetch the LRG file and store in the cache directory.
 
+        If another process is already fetching the same file, we wait for it
+        to finish and use its result.
+
         :arg unicode name: The name of the LRG file to fetch.
 
         :returns: the full path to the file; None in case of an error.
@@ -784,11 +1230,18 @@ class LRGRetriever(Retriever):
         url = '{}/{}.xml'.format(settings.LRG_PREFIX_URL.rstrip('/'), name)
         filename = None
 
-        try:
-            filename = self.downloadrecord(url, name)
-        except urllib2.URLError:
-            self._output.addMessage(
-                __file__, 4, 'ERETR', 'Could not retrieve {}.'.format(name))
+        with cache.single_flight('lrg:{}'.format(name)) as waited:
+            if waited and os.path.isfile(self._name_to_file(name)):
+                # Another process fetched it in the meantime.
+                cache.register_coalesced()
+                return self._name_to_file(name)
+
+            try:
+                filename = self.downloadrecord(url, name)
+            except urllib2.URLError:
+                self._output.addMessage(
+                    __file__, 4, 'ERETR',
+                    'Could not retrieve {}.'.format(name))
 
         return filename
 
@@ -817,11 +1270,14 @@ class LRGRetriever(Retriever):
 
             length = int(info['Content-Length'])
             if 512 < length < settings.MAX_FILE_SIZE:
-                raw_data = handle.read()
+                download = self._download(
+                    handle, max_size=settings.MAX_FILE_SIZE)
                 handle.close()
+                if download is None:
+                    return None
 
                 # Do an md5 check.
-                md5sum = self._calculate_hash(raw_data)
+                tempname, md5sum, _, _ = download
                 try:
                     reference = Reference.query.filter_by(
                         accession=lrg_id).one()
@@ -849,13 +1305,17 @@ class LRGRetriever(Retriever):
                     # Hash the same as in db.
                     pass
 
-                if not os.path.isfile(filename):
-                    return self.write(raw_data, lrg_id)
-                else:
-                    # This can only occur if synchronus calls to mutalyzer are
-                    # made to recover a file that did not exist. Still leaves
-                    # a window in between the check and the write.
-                    return filename
+                try:
+                    if not os.path.isfile(filename):
+                        return self._write_download(tempname, lrg_id)
+                    else:
+                        # This can only occur if synchronus calls to mutalyzer
+                        # are made to recover a file that did not exist.
+                        # Still leaves a window in between the check and the
+                        # write.
+                        return filename
+                finally:
+                    self._discard(tempname)
             else:
                 self._output.addMessage(
                     __file__, 4, 'EFILESIZE',
@@ -873,6 +1333,29 @@ class LRGRetriever(Retriever):
         :arg str raw_data: The data.
         :arg unicode filename: The intended name of the file.
 
+        :returns: The full path and name of the file written, None in case of
+          an error.
+        :rtype: unicode
+        """
+        download = self._download(io.BytesIO(raw_data))
+        if download is None:
+            return None
+
+        tempname = download[0]
+        try:
+            return self._write_download(tempname, filename)
+        finally:
+            self._discard(tempname)
+
+    def _write_download(self, tempname, filename):
+        """
+        Store a downloaded LRG file in the cache. The file is parsed before it
+        is stored, if a parse error occurs None is returned.
+
+        :arg unicode tempname: Temporary file as returned by
+          :meth:`_download`.
+        :arg unicode filename: The intended name of the file.
+
         :returns: The full path and name of the file written, None in case of
           an error.
         :rtype: unicode
@@ -880,12 +1363,12 @@ class LRGRetriever(Retriever):
         # Dirty way to test if a file is valid,
         # Parse the file to see if it's a real LRG file.
         try:
-            lrg.create_record(raw_data)
-        except DOMException:
+            lrg.create_record(compression.read_file(tempname))
+        except etree.XMLSyntaxError:
             self._output.addMessage(
                 __file__, 4, 'ERECPARSE', 'Could not parse file.')
             # Explicit return on Error.
             return None
 
         # Returns full path.
-        return self._write(raw_data, filename)
+        return self._store(tempname, filename)
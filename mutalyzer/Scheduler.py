@@ -21,6 +21,7 @@ import io
 import os                               # os.path.exists
 import smtplib                          # smtplib.STMP
 from email.mime.text import MIMEText    # MIMEText
+from pyparsing import ParseException
 from sqlalchemy import func
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -28,9 +29,10 @@ from mutalyzer.config import settings
 from mutalyzer.db import queries, session
 from mutalyzer.db.models import Assembly, BatchJob, BatchQueueItem
 from mutalyzer import ncbi
+from mutalyzer import Retriever
 from mutalyzer import stats
 from mutalyzer import variantchecker
-from mutalyzer.grammar import Grammar
+from mutalyzer.grammar import Grammar, parse_string
 from mutalyzer.output import Output
 from mutalyzer.mapping import Converter
 from mutalyzer import website
@@ -63,6 +65,7 @@ class Scheduler() :
         @todo: documentation
         """
         self.__run = True
+        self.__prefetched = set()
     #__init__
 
     def stop(self):
@@ -415,6 +418,10 @@ Mutalyzer batch scheduler""" % download_url)
                 if self.stopped():
                     break
 
+                if (batch_job.job_type == 'name-checker' and
+                        batch_job.id not in self.__prefetched):
+                    self._prefetchNameBatch(batch_job)
+
                 batch_queue_item = queries.pop_batch_queue_item(batch_job)
 
                 if batch_queue_item is not None:
@@ -441,6 +448,40 @@ Mutalyzer batch scheduler""" % download_url)
                     session.commit()
     #process
 
+    def _prefetchNameBatch(self, batch_job):
+        """
+        Fetch the reference sequences used in a name checker batch job that
+        are not yet in the cache, so the entries do not each have to wait for
+        their own download from the NCBI.
+
+        Only GenBank references with a version number are prefetched, others
+        are retrieved as usual while processing the entries.
+
+        @arg batch_job: Batch job.
+        @type batch_job: BatchJob
+        """
+        self.__prefetched.add(batch_job.id)
+
+        accessions = set()
+        for item, flags in session.query(
+                BatchQueueItem.item, BatchQueueItem.flags).filter(
+                BatchQueueItem.batch_job_id == batch_job.id):
+            if 'S' in flags:
+                continue
+            try:
+                parsed = parse_string(Grammar.RefOne, item)
+            except ParseException:
+                continue
+            if (parsed.RefSeqAcc and parsed.Version and
+                    not parsed.RefSeqAcc.isdigit() and
+                    'NC' not in parsed.RefSeqAcc):
+                accessions.add(parsed.RefSeqAcc + '.' + parsed.Version)
+
+        if accessions:
+            retriever = Retriever.GenBankRetriever(Output(__file__))
+            retriever.prefetch(sorted(accessions))
+    #_prefetchNameBatch
+
     def _processNameBatch(self, batch_job, cmd, flags):
         """
         Process an entry from the Name Batch, write the results
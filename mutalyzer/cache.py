@@ -0,0 +1,578 @@
+"""
+Caching of parsed reference sequence records and management of the cache
+directory.
+
+Parsing a reference file is by far the most expensive step in checking a
+variant description, so we keep parsed records in two cache tiers:
+
+1. Recently used records in memory.
+2. Records in pickled form in the cache directory, next to the reference
+   files they were parsed from. This tier survives restarts of the Mutalyzer
+   processes.
+
+Records are keyed by their accession number and the checksum of the reference
+file (as stored in the `references` table), which means an updated reference
+file is never answered with a stale record.
+
+Records are modified while checking a variant description (descriptions are
+added to the transcripts, the selected transcript is marked, etcetera), so we
+store them in pickled form and every lookup returns a fresh copy.
+
+The reference sequences of transcripts (mRNA, CDS, protein) are computed
+when they are first needed and are then added to the cached record (see
+:func:`add_sequences`), so later lookups get them for free.
+
+The size of the cache directory can be bounded with the `MAX_CACHE_DIR_SIZE`
+configuration setting. Reference files are touched whenever they are used, so
+their modification time is their last access time. If the cache directory
+grows too large, the least recently used reference files (and their record
+files) are removed. Uploaded reference files are never removed, since they
+cannot be retrieved again.
+
+Retrieval of reference files is serialized over all processes sharing the
+cache directory using file locks (see :func:`single_flight`), so a reference
+file that is requested by many processes at once is only downloaded once.
+"""
+
+
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import cPickle as pickle
+import errno
+import fcntl
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+
+from mutalyzer.config import settings
+from mutalyzer.db import session
+from mutalyzer.db.models import Reference
+from mutalyzer import stats
+
+
+#: Version of the record file format. Increment this whenever the layout of
+#: the :mod:`mutalyzer.GenRecord` classes changes, so existing record files
+#: are ignored.
+RECORD_FORMAT = 4
+
+#: Maximum time to wait for another process retrieving the same reference
+#: file (in seconds). After this, we retrieve it ourselves.
+LOCK_TIMEOUT = 120
+
+#: Interval for checking if another process finished retrieving a reference
+#: file (in seconds).
+LOCK_POLL_INTERVAL = 0.1
+
+# Characters not to be used in lock filenames.
+_LOCK_NAME_INVALID = re.compile(r'[^\w.:-]')
+
+
+class RecordCache(object):
+    """
+    Least recently used cache of parsed records, bounded by the total size of
+    the pickled records (in bytes).
+
+    The cache is safe to use from multiple threads.
+    """
+    def __init__(self, max_size=None):
+        """
+        :arg int max_size: Maximum total size of the cached records (in
+          bytes). If `None`, the `RECORD_CACHE_SIZE` configuration setting is
+          used.
+        """
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return settings.RECORD_CACHE_SIZE
+        return self._max_size
+
+    def get(self, key):
+        """
+        Get a fresh copy of a cached record.
+
+        :arg tuple key: Accession number and checksum of the record.
+
+        :returns: The record, or `None` if it is not in the cache.
+        :rtype: GenRecord.Record
+        """
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries[key] = data
+            self.hits += 1
+
+        return pickle.loads(data)
+
+    def peek(self, key):
+        """
+        Get a cached record in pickled form, without counting this as a hit
+        or miss and without marking it as recently used.
+
+        :arg tuple key: Accession number and checksum of the record.
+
+        :returns: The pickled record, or `None` if it is not in the cache.
+        :rtype: str
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, record):
+        """
+        Store a record in the cache. Least recently used records are evicted
+        until the cache fits within its size limit.
+
+        :arg tuple key: Accession number and checksum of the record.
+        :arg GenRecord.Record record: The record.
+        """
+        max_size = self.max_size
+        if not max_size:
+            return
+
+        self.put_pickled(key, pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+
+    def put_pickled(self, key, data):
+        """
+        Store a pickled record in the cache.
+
+        :arg tuple key: Accession number and checksum of the record.
+        :arg str data: The pickled record.
+        """
+        max_size = self.max_size
+        if len(data) > max_size:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = data
+            self.size += len(data)
+
+            while self.size > max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all records from the cache and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def statistics(self):
+        """
+        Get cache statistics.
+
+        :returns: Dictionary with the number of cached records, their total
+          size (in bytes), and the number of hits, misses, and evictions.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'records': len(self._entries),
+                    'size': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+def record_file(accession, file_type):
+    """
+    Get the path to the record file for an accession number.
+
+    :arg unicode accession: The accession number.
+    :arg unicode file_type: Type of the reference file the record was parsed
+      from (`gb` or `xml`).
+
+    :returns: Path to the record file.
+    :rtype: unicode
+    """
+    return os.path.join(
+        settings.CACHE_DIR, '{}.{}.record'.format(accession, file_type))
+
+
+def _record_header(checksum):
+    """
+    Record files start with a header line identifying the file format and the
+    checksum of the reference file the record was parsed from.
+    """
+    return 'mutalyzer-record {} {}\n'.format(
+        RECORD_FORMAT, checksum).encode('ascii')
+
+
+def read_record_file(accession, checksum, file_type):
+    """
+    Read a pickled record from its record file.
+
+    :arg unicode accession: The accession number.
+    :arg unicode checksum: Checksum of the reference file.
+    :arg unicode file_type: Type of the reference file.
+
+    :returns: The pickled record, or `None` if there is no record file for
+      this version of the reference file.
+    :rtype: str
+    """
+    try:
+        with open(record_file(accession, file_type), 'rb') as handle:
+            if handle.readline() != _record_header(checksum):
+                return None
+            return handle.read()
+    except IOError:
+        return None
+
+
+def write_record_file(accession, checksum, file_type, data):
+    """
+    Write a pickled record to its record file.
+
+    The file is written under a temporary name first and then renamed, so
+    readers in other processes never see a partially written record file.
+
+    :arg unicode accession: The accession number.
+    :arg unicode checksum: Checksum of the reference file.
+    :arg unicode file_type: Type of the reference file.
+    :arg str data: The pickled record.
+
+    :returns: Path to the record file, or `None` if it could not be written.
+    :rtype: unicode
+    """
+    filename = record_file(accession, file_type)
+
+    try:
+        handle = tempfile.NamedTemporaryFile(
+            dir=settings.CACHE_DIR, prefix='.record-', delete=False)
+        with handle:
+            handle.write(_record_header(checksum))
+            handle.write(data)
+        # Temporary files are only readable by their owner.
+        os.chmod(handle.name, 0o644)
+        os.rename(handle.name, filename)
+    except (IOError, OSError):
+        return None
+
+    return filename
+
+
+def get_record(accession, checksum, file_type):
+    """
+    Get a fresh copy of a cached record from the first cache tier containing
+    it.
+
+    :arg unicode accession: The accession number.
+    :arg unicode checksum: Checksum of the reference file.
+    :arg unicode file_type: Type of the reference file.
+
+    :returns: The record, or `None` if it is not cached.
+    :rtype: GenRecord.Record
+    """
+    key = accession, checksum
+
+    record = records.get(key)
+    if record is not None or not settings.RECORD_CACHE_FILES:
+        return record
+
+    data = read_record_file(accession, checksum, file_type)
+    if data is None:
+        return None
+
+    try:
+        record = pickle.loads(data)
+    except Exception:
+        # Unreadable record files are simply rebuilt from the reference file.
+        return None
+
+    records.put_pickled(key, data)
+    return record
+
+
+def put_record(accession, checksum, file_type, record):
+    """
+    Store a record in all cache tiers.
+
+    :arg unicode accession: The accession number.
+    :arg unicode checksum: Checksum of the reference file.
+    :arg unicode file_type: Type of the reference file.
+    :arg GenRecord.Record record: The record. Its `cache_key` attribute is
+      set, so it can be found again by :func:`add_sequences`.
+    """
+    record.cache_key = accession, checksum, file_type
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    records.put_pickled((accession, checksum), data)
+    if settings.RECORD_CACHE_FILES:
+        write_record_file(accession, checksum, file_type, data)
+
+
+def add_sequences(record):
+    """
+    Add the transcript reference sequences that were computed for a record to
+    the cached version of the record in all cache tiers.
+
+    The cached version is not replaced by `record` itself, since that is
+    modified while checking a variant description.
+
+    This may be called long after the record was retrieved, so the record
+    file is only rewritten if it is still there for the same version of the
+    reference file. Otherwise, we would leave behind a record file for an
+    evicted reference file, or replace the record file of a newer version.
+
+    :arg GenRecord.Record record: The record.
+    """
+    new_sequences = record.popNewSequences()
+    if not new_sequences or record.cache_key is None:
+        return
+
+    accession, checksum, file_type = record.cache_key
+    key = accession, checksum
+
+    data_file = None
+    if settings.RECORD_CACHE_FILES and os.path.exists(os.path.join(
+            settings.CACHE_DIR, '{}.{}.bz2'.format(accession, file_type))):
+        data_file = read_record_file(accession, checksum, file_type)
+
+    data = records.peek(key) or data_file
+    if data is None:
+        return
+
+    try:
+        cached = pickle.loads(data)
+    except Exception:
+        return
+
+    for sequence_key, sequences in new_sequences.items():
+        cached.addSequences(sequence_key, sequences)
+    cached.popNewSequences()
+
+    if data_file is None:
+        records.put(key, cached)
+    else:
+        put_record(accession, checksum, file_type, cached)
+
+
+def register_hit(filename):
+    """
+    Register the use of a reference file from the cache directory.
+
+    :arg unicode filename: Path to the reference file.
+    """
+    # The modification time of a reference file is its last access time,
+    # filesystems are often mounted without updating the real access time.
+    try:
+        os.utime(filename, None)
+    except OSError:
+        pass
+    stats.increment_counter('cache-dir/hit')
+
+
+def register_miss():
+    """
+    Register a reference file missing from the cache directory.
+    """
+    stats.increment_counter('cache-dir/miss')
+
+
+def register_coalesced():
+    """
+    Register the use of a reference file that was retrieved by another
+    process while we were waiting for it.
+    """
+    stats.increment_counter('cache-dir/coalesced')
+
+
+@contextlib.contextmanager
+def single_flight(key):
+    """
+    Context manager for retrieving a reference file by only one process at a
+    time.
+
+    The first process entering the context for a given key continues
+    immediately. Other processes entering the context for the same key wait
+    until the first process exits it. They should then first check if the
+    reference file has been retrieved in the meantime.
+
+    Locking is done with `flock` on a lock file in the cache directory, which
+    also works between threads of the same process. The lock file is removed
+    again when the lock is released.
+
+    :arg unicode key: Identification of the reference file to retrieve.
+
+    :returns: Context manager yielding True if we had to wait for another
+      process, False otherwise.
+    """
+    filename = os.path.join(
+        settings.CACHE_DIR, '.lock-' + _LOCK_NAME_INVALID.sub('_', key))
+    deadline = time.time() + LOCK_TIMEOUT
+    waited = locked = False
+
+    handle = open(filename, 'a')
+    try:
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    # Locking is not supported, so just continue.
+                    break
+            else:
+                # The process we waited for may have removed the lock file
+                # before we got the lock, in which case we hold a lock on a
+                # file no other process can see.
+                try:
+                    current = os.stat(filename).st_ino
+                except OSError:
+                    current = None
+                if current == os.fstat(handle.fileno()).st_ino:
+                    locked = True
+                    break
+                handle.close()
+                handle = open(filename, 'a')
+                continue
+            waited = True
+            if time.time() > deadline:
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+
+        try:
+            yield waited
+        finally:
+            if locked:
+                # Remove the lock file while still holding the lock, so
+                # nobody can get a lock on it after we released it.
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+                fcntl.flock(handle, fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+def _cache_dir_files():
+    """
+    List all files in the cache directory, except for hidden (temporary and
+    lock) files.
+
+    :returns: List of tuples (filename, size, modification time).
+    :rtype: list(tuple(unicode, int, float))
+    """
+    files = []
+    for filename in os.listdir(settings.CACHE_DIR):
+        if filename.startswith('.'):
+            continue
+        try:
+            status = os.stat(os.path.join(settings.CACHE_DIR, filename))
+        except OSError:
+            # Removed by another process in the meantime.
+            continue
+        if stat.S_ISREG(status.st_mode):
+            files.append((filename, status.st_size, status.st_mtime))
+    return files
+
+
+def evict(keep=None):
+    """
+    Remove least recently used reference files from the cache directory
+    until its total size is within `MAX_CACHE_DIR_SIZE`.
+
+    Record files are removed with their reference files. Uploaded reference
+    files and other files (e.g., batch job results) are never removed.
+
+    :arg unicode keep: Path to a reference file that should not be removed
+      (e.g., because it was just written).
+
+    :returns: Number of reference files removed.
+    :rtype: int
+    """
+    max_size = settings.MAX_CACHE_DIR_SIZE
+    if max_size is None:
+        return 0
+
+    files = _cache_dir_files()
+    size = sum(file_size for _, file_size, _ in files)
+    if size <= max_size:
+        return 0
+
+    sizes = {filename: file_size for filename, file_size, _ in files}
+    keep = keep and os.path.basename(keep)
+    pinned = set(accession for accession, in
+                 session.query(Reference.accession).filter_by(source='upload'))
+
+    evicted = 0
+    for modified, filename in sorted(
+            (modified, filename) for filename, _, modified in files
+            if filename.endswith(('.gb.bz2', '.xml.bz2'))):
+        if size <= max_size:
+            break
+
+        accession, file_type, _ = filename.rsplit('.', 2)
+        if filename == keep or accession in pinned:
+            continue
+
+        for removed in (filename, '{}.{}.record'.format(accession, file_type)):
+            try:
+                os.remove(os.path.join(settings.CACHE_DIR, removed))
+            except OSError:
+                continue
+            size -= sizes.get(removed, 0)
+
+        evicted += 1
+        stats.increment_counter('cache-dir/eviction')
+
+    return evicted
+
+
+def cache_dir_statistics():
+    """
+    Get cache directory statistics.
+
+    Hits, misses, coalesced retrievals, and evictions are counted over all
+    Mutalyzer processes sharing the same Redis server.
+
+    :returns: Dictionary with the number of files in the cache directory,
+      their total size (in bytes), the maximum size, and the number of hits,
+      misses, coalesced retrievals, and evictions.
+    :rtype: dict
+    """
+    files = _cache_dir_files()
+
+    return {'files': len(files),
+            'size': sum(file_size for _, file_size, _ in files),
+            'max_size': settings.MAX_CACHE_DIR_SIZE,
+            'hits': stats.get_total('cache-dir/hit'),
+            'misses': stats.get_total('cache-dir/miss'),
+            'coalesced': stats.get_total('cache-dir/coalesced'),
+            'evictions': stats.get_total('cache-dir/eviction')}
+
+
+def clear_records(value=None):
+    """
+    Remove all records from the global record cache.
+    """
+    records.clear()
+
+
+# The cached records are tied to the contents of the cache directory.
+settings.on_update(clear_records, 'CACHE_DIR')
+settings.on_update(clear_records, 'RECORD_CACHE_SIZE')
+
+
+#: Global :class:`RecordCache` instance used by the retrievers.
+records = RecordCache()
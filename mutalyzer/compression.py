@@ -0,0 +1,242 @@
+"""
+Compression of reference files in the cache directory.
+
+The codec used for writing files is set with the `CACHE_COMPRESSION`
+configuration setting. Reading files does not depend on this setting, the
+codec is detected from the file contents. This means a cache directory can
+contain files written with different codecs, for example after changing the
+setting.
+
+The zstd and lz4 codecs are only available if the `zstandard` and `lz4`
+packages are installed.
+
+.. note:: Reference files keep their `.bz2` filename suffix regardless of the
+    codec they were written with, since the suffix is used by other
+    installations to synchronize their cache with ours.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+import io
+import os
+import tempfile
+import zlib
+
+from mutalyzer.config import settings
+
+
+# We try to minimize non-trivial dependencies for non-critical features. The
+# zstd and lz4 codecs are implemented as C extensions, so we use them as
+# optional dependencies.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+#: Magic bytes at the start of files written with each codec.
+MAGIC = [('bz2', b'BZh'),
+         ('gzip', b'\x1f\x8b'),
+         ('zstd', b'\x28\xb5\x2f\xfd'),
+         ('lz4', b'\x04\x22\x4d\x18')]
+
+
+class _NoCompressor(object):
+    """
+    Compressor object for uncompressed files.
+    """
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _LZ4Compressor(object):
+    """
+    Compressor object for lz4 frames with the same interface as the other
+    compressor objects.
+    """
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._begin = self._compressor.begin()
+
+    def compress(self, data):
+        result = self._begin + self._compressor.compress(data)
+        self._begin = b''
+        return result
+
+    def flush(self):
+        return self._begin + self._compressor.flush()
+
+
+def available_codecs():
+    """
+    Get the codecs available for writing files.
+
+    :returns: List of codec names.
+    :rtype: list(unicode)
+    """
+    codecs = ['bz2', 'gzip', 'none']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4 is not None:
+        codecs.append('lz4')
+    return codecs
+
+
+def compressor(codec=None):
+    """
+    Create a compressor object for incrementally compressing data.
+
+    :arg unicode codec: Name of the codec. If `None`, the `CACHE_COMPRESSION`
+      configuration setting is used.
+
+    :returns: Object with `compress(data)` and `flush()` methods, just like
+      `bz2.BZ2Compressor`.
+
+    :raises ValueError: If the codec is unknown or not available.
+    """
+    codec = codec or settings.CACHE_COMPRESSION
+    if codec not in available_codecs():
+        raise ValueError('Compression codec not available: %s' % codec)
+
+    if codec == 'bz2':
+        return bz2.BZ2Compressor()
+    if codec == 'gzip':
+        # A window size of 16 + MAX_WBITS gives gzip headers and trailers.
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    if codec == 'lz4':
+        return _LZ4Compressor()
+    return _NoCompressor()
+
+
+def compress(data, codec=None):
+    """
+    Compress data.
+
+    :arg str data: The data to compress.
+    :arg unicode codec: Name of the codec. If `None`, the `CACHE_COMPRESSION`
+      configuration setting is used.
+
+    :returns: The compressed data.
+    :rtype: str
+    """
+    comp = compressor(codec)
+    return comp.compress(data) + comp.flush()
+
+
+def detect(data):
+    """
+    Detect the codec from the first bytes of a file.
+
+    :arg str data: At least the first four bytes of the file.
+
+    :returns: Name of the codec.
+    :rtype: unicode
+    """
+    for codec, magic in MAGIC:
+        if data.startswith(magic):
+            return codec
+    return 'none'
+
+
+def detect_file(filename):
+    """
+    Detect the codec a file was written with.
+
+    :arg unicode filename: Path to the file.
+
+    :returns: Name of the codec.
+    :rtype: unicode
+    """
+    with open(filename, 'rb') as handle:
+        return detect(handle.read(4))
+
+
+def open_file(filename):
+    """
+    Open a compressed file for reading.
+
+    :arg unicode filename: Path to the file.
+
+    :returns: File-like object with the uncompressed contents.
+
+    :raises ValueError: If the file was written with a codec that is not
+      available.
+    """
+    codec = detect_file(filename)
+
+    if codec == 'bz2':
+        return bz2.BZ2File(filename, 'r')
+    if codec == 'gzip':
+        return gzip.GzipFile(filename, 'rb')
+    if codec == 'none':
+        return io.open(filename, 'rb')
+    if codec == 'zstd' and zstandard is not None:
+        with open(filename, 'rb') as handle:
+            return io.BytesIO(
+                zstandard.ZstdDecompressor().decompressobj().decompress(
+                    handle.read()))
+    if codec == 'lz4' and lz4 is not None:
+        return lz4.frame.open(filename, 'rb')
+
+    raise ValueError('Compression codec not available: %s' % codec)
+
+
+def read_file(filename):
+    """
+    Read the uncompressed contents of a compressed file.
+
+    :arg unicode filename: Path to the file.
+
+    :returns: The uncompressed contents.
+    :rtype: str
+    """
+    handle = open_file(filename)
+    try:
+        return handle.read()
+    finally:
+        handle.close()
+
+
+def recompress(filename, codec=None):
+    """
+    Re-encode a compressed file in place.
+
+    The re-encoded file is written under a temporary name first and then
+    renamed, so readers in other processes never see a partially written
+    file.
+
+    :arg unicode filename: Path to the file.
+    :arg unicode codec: Name of the codec. If `None`, the `CACHE_COMPRESSION`
+      configuration setting is used.
+
+    :returns: True if the file was re-encoded, False if it was already
+      written with the given codec.
+    :rtype: bool
+    """
+    codec = codec or settings.CACHE_COMPRESSION
+    if detect_file(filename) == codec:
+        return False
+
+    data = compress(read_file(filename), codec)
+
+    handle = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(filename), prefix='.recompress-', delete=False)
+    with handle:
+        handle.write(data)
+    os.chmod(handle.name, os.stat(filename).st_mode)
+    os.rename(handle.name, filename)
+
+    return True
@@ -13,10 +13,29 @@ DEBUG = False
 # We are running unit tests.
 TESTING = False
 
+# Measure the duration of the stages of the name checker (parsing,
+# retrieval, protein prediction, etcetera). Durations are added to the output
+# of the name checker and to latency histograms per stage in Redis.
+STAGE_TIMINGS = False
+
 # This email address is used in contact information on the website and sent
 # with NCBI Entrez calls.
 EMAIL = 'info@mutalyzer.nl'
 
+# Maximum number of NCBI Entrez requests per second. If `None`, this is 10 if
+# `ENTREZ_API_KEY` is set and 3 otherwise, as allowed by the NCBI.
+ENTREZ_RATE_LIMIT = None
+
+# Also apply `ENTREZ_RATE_LIMIT` across processes, coordinated through Redis.
+ENTREZ_RATE_LIMIT_SHARED = False
+
+# Number of tries for NCBI Entrez requests before giving up.
+ENTREZ_MAX_TRIES = 3
+
+# Delay before retrying a failed NCBI Entrez request (in seconds). The delay
+# is doubled for every further retry.
+ENTREZ_RETRY_DELAY = 1
+
 # This email address is used as sender in batch job notifications. If `None`,
 # the value of `EMAIL` will be used.
 BATCH_NOTIFICATION_EMAIL = None
@@ -25,9 +44,35 @@ BATCH_NOTIFICATION_EMAIL = None
 # reference files from NCBI or user) and batch job results.
 CACHE_DIR = '/tmp'
 
+# Maximum total size of the cache directory (in bytes). If exceeded, least
+# recently used reference files are removed. If `None`, the size of the cache
+# directory is not bounded.
+MAX_CACHE_DIR_SIZE = None
+
 # Maximum size for uploaded and downloaded files (in bytes).
 MAX_FILE_SIZE = 10 * 1048576 # 10 MB
 
+# Compression codec for reference files in the cache directory. Can be one of
+# `bz2`, `gzip`, `none`, and, if the zstandard or lz4 package is installed,
+# `zstd` or `lz4`.
+CACHE_COMPRESSION = 'bz2'
+
+# Maximum total size of parsed reference records kept in memory (in bytes).
+# Set to 0 to disable the in-memory record cache.
+RECORD_CACHE_SIZE = 256 * 1048576 # 256 MB
+
+# Store parsed reference records in the cache directory, next to the reference
+# files they were parsed from.
+RECORD_CACHE_FILES = True
+
+# Maximum number of entries in the packrat cache of the HGVS parser. The cache
+# is cleared after each parse.
+PACKRAT_CACHE_SIZE = 10000
+
+# Maximum number of descriptions for which the outcome of parsing is kept in
+# memory. Set to 0 to disable this cache.
+PARSE_CACHE_SIZE = 10000
+
 # Maximum sequence length for description extractor (in bases).
 EXTRACTOR_MAX_INPUT_LENGTH = 50 * 1000 # 50 Kbp
 
@@ -50,6 +95,11 @@ DEFAULT_ASSEMBLY = 'hg19'
 # Database for NC (dbgb) connection URI (can be any SQLAlchemy connection URI).
 DATABASE_GB_URI = 'sqlite://'
 
+# Build slices of chromosomes from the sequences in `SEQ_PATH` and the
+# annotations in the NC (dbgb) database instead of retrieving them from the
+# NCBI. Chromosomes not available locally are still retrieved from the NCBI.
+LOCAL_SLICES = False
+
 # Name and location of the log file.
 LOG_FILE = '/tmp/mutalyzer.log'
 
@@ -0,0 +1,290 @@
+"""
+Shared client for the NCBI Entrez Programming Utilities.
+
+All Entrez traffic should go through the functions in this module, which have
+the same signatures as their counterparts in `Bio.Entrez`. On top of
+`Bio.Entrez`, this module:
+
+- Reuses HTTP connections to the NCBI (keep-alive) within each process.
+- Limits the number of requests per second with a token bucket in each
+  process and, optionally, with a counter in Redis across all processes. This
+  replaces the fixed delay between requests of `Bio.Entrez`.
+- Retries failed requests with exponential backoff.
+- Keeps a latency histogram of the HTTP requests for each utility (see
+  :func:`mutalyzer.stats.get_histogram`).
+
+Results can be parsed with `Bio.Entrez.read` as usual.
+
+.. note:: The NCBI allows at most 3 requests per second, or 10 requests per
+    second with an API key. See the `E-utilities documentation
+    <https://www.ncbi.nlm.nih.gov/books/NBK25497/>`_.
+"""
+
+
+from __future__ import unicode_literals
+
+import httplib
+import threading
+import time
+import urllib2
+
+from Bio import Entrez
+import requests
+
+from mutalyzer.config import settings
+from mutalyzer.redisclient import client as redis
+from mutalyzer import stats
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, safe to share between threads.
+    """
+    def __init__(self, rate, capacity=1):
+        """
+        :arg float rate: Number of tokens added per second.
+        :arg int capacity: Maximum number of tokens in the bucket.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting for one to become available if
+        the bucket is empty.
+
+        :returns: Number of seconds waited.
+        :rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+
+            # Waiting inside the lock keeps the order of waiting threads.
+            wait = -self._tokens / self.rate
+            time.sleep(wait)
+            return wait
+
+
+def rate_limit():
+    """
+    Maximum number of Entrez requests per second.
+    """
+    if settings.ENTREZ_RATE_LIMIT is not None:
+        return settings.ENTREZ_RATE_LIMIT
+    if getattr(settings, 'ENTREZ_API_KEY', None):
+        return 10
+    return 3
+
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def _acquire_local():
+    """
+    Wait for a token from the process-wide token bucket.
+    """
+    global _bucket
+
+    rate = rate_limit()
+    with _bucket_lock:
+        if _bucket is None or _bucket.rate != rate:
+            _bucket = TokenBucket(rate)
+        bucket = _bucket
+
+    bucket.acquire()
+
+
+def _acquire_shared():
+    """
+    Wait for a free slot in the per-second request counter in Redis, which is
+    shared by all processes.
+    """
+    rate = rate_limit()
+    while True:
+        now = time.time()
+        window = int(now)
+        key = 'entrez:requests:%d' % window
+
+        pipe = redis.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, 2)
+        count = pipe.execute()[0]
+
+        if count <= rate:
+            return
+        time.sleep(window + 1 - now)
+
+
+class _Transport(object):
+    """
+    Replacement for the `urlopen` function used by `Bio.Entrez`, reusing
+    connections from a pool.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # Sessions are not guaranteed to be thread-safe, so we use one per
+        # thread.
+        try:
+            return self._local.session
+        except AttributeError:
+            self._local.session = requests.Session()
+            return self._local.session
+
+    def __call__(self, url, data=None):
+        start = time.time()
+        if data is None:
+            response = self.session.get(url, stream=True)
+        else:
+            response = self.session.post(
+                url, data=data, stream=True,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        latency = time.time() - start
+
+        if response.status_code >= 400:
+            response.close()
+            # This is what `Bio.Entrez` and our callers expect.
+            raise urllib2.HTTPError(url, response.status_code,
+                                    response.reason, response.headers, None)
+
+        # For example, `efetch` for `.../entrez/eutils/efetch.fcgi?db=...`.
+        utility = url.split('?')[0].rsplit('/', 1)[-1].split('.')[0]
+        stats.observe_latency('entrez/%s' % utility, latency)
+
+        # The connection is returned to the pool once the response has been
+        # read completely.
+        response.raw.decode_content = True
+        return response.raw
+
+
+_transport = _Transport()
+
+
+class _Clock(object):
+    """
+    Replacement for the `time` module used by `Bio.Entrez`, without sleeping.
+
+    `Bio.Entrez` sleeps between requests to stay within the rate limit of the
+    NCBI, without a lock and only within the current process. We already
+    limit the rate of requests ourselves (see :func:`_call`), so this would
+    only delay requests twice.
+    """
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def sleep(seconds):
+        pass
+
+
+_clock = _Clock()
+
+
+def _configure():
+    """
+    Configure `Bio.Entrez` from the settings.
+    """
+    Entrez.email = settings.EMAIL
+    if hasattr(settings, 'ENTREZ_API_KEY'):
+        Entrez.api_key = settings.ENTREZ_API_KEY
+
+    # We retry failed requests ourselves.
+    Entrez.max_tries = 1
+
+    # This is not part of the public interface of `Bio.Entrez`, but it is the
+    # only way to reuse connections.
+    if hasattr(Entrez, '_urlopen'):
+        Entrez._urlopen = _transport
+
+    # Neither is this, but otherwise requests are rate limited twice. Since
+    # we set `max_tries` to 1, the only sleep left in `Bio.Entrez` is the one
+    # for its own rate limit.
+    if hasattr(Entrez, 'time'):
+        Entrez.time = _clock
+
+
+def _is_retryable(error):
+    """
+    Only retry on errors that are likely to be temporary.
+    """
+    # Client errors will not go away by retrying, but the NCBI sometimes
+    # responds with 429 (Too Many Requests) even if we honour the rate limit.
+    if isinstance(error, urllib2.HTTPError):
+        return error.code // 100 != 4 or error.code == 429
+    return True
+
+
+def _call(utility, **keywords):
+    """
+    Call an Entrez utility through `Bio.Entrez`.
+
+    :arg unicode utility: Name of the utility (e.g., ``efetch``).
+    :arg keywords: Arguments for the utility.
+
+    :returns: The result handle.
+
+    :raises IOError: If the request failed on all tries.
+    :raises httplib.HTTPException: If the request failed on all tries.
+    """
+    _configure()
+
+    # Always try at least once.
+    max_tries = max(1, settings.ENTREZ_MAX_TRIES)
+
+    for attempt in range(max_tries):
+        _acquire_local()
+        if settings.ENTREZ_RATE_LIMIT_SHARED:
+            _acquire_shared()
+
+        try:
+            handle = getattr(Entrez, utility)(**keywords)
+        except (IOError, httplib.HTTPException) as e:
+            stats.increment_counter('entrez/%s/error' % utility)
+            if attempt + 1 >= max_tries or not _is_retryable(e):
+                raise
+            time.sleep(settings.ENTREZ_RETRY_DELAY * 2 ** attempt)
+        else:
+            return handle
+
+
+def efetch(**keywords):
+    """
+    Call the Entrez EFetch utility, see `Bio.Entrez.efetch`.
+    """
+    return _call('efetch', **keywords)
+
+
+def esearch(**keywords):
+    """
+    Call the Entrez ESearch utility, see `Bio.Entrez.esearch`.
+    """
+    return _call('esearch', **keywords)
+
+
+def esummary(**keywords):
+    """
+    Call the Entrez ESummary utility, see `Bio.Entrez.esummary`.
+    """
+    return _call('esummary', **keywords)
+
+
+def elink(**keywords):
+    """
+    Call the Entrez ELink utility, see `Bio.Entrez.elink`.
+    """
+    return _call('elink', **keywords)
@@ -19,11 +19,17 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from . import _cli_string
 from .. import announce
+from .. import cache
+from .. import compression
 from .. import db
+from .. import grammar
+from ..config import settings
 from ..db import session
-from ..db.models import Assembly, BatchJob, BatchQueueItem, Chromosome
+from ..db.models import (Assembly, BatchJob, BatchQueueItem, Chromosome,
+                         Reference)
 from .. import mapping
 from .. import output
+from .. import Retriever
 from .. import sync
 from .. import util
 
@@ -175,6 +181,91 @@ def sync_cache(wsdl_url, url_template, history=7):
            % (inserted, downloaded))
 
 
+def rebuild_record_cache():
+    """
+    Rebuild the cached parsed records for all reference files in the cache.
+    """
+    # For long-running processes it can be convenient to have a short and
+    # human-readable process name.
+    util.set_process_name('mutalyzer: rebuild-records')
+
+    o = output.Output(__file__)
+    retrievers = [Retriever.GenBankRetriever(o), Retriever.LRGRetriever(o)]
+
+    rebuilt = 0
+    for reference in Reference.query.order_by(Reference.id):
+        if any(retriever.cache_record(reference)
+               for retriever in retrievers):
+            rebuilt += 1
+
+    print 'Rebuilt %d cached records.' % rebuilt
+
+
+def cache_status():
+    """
+    Show size and usage statistics of the cache directory and the parser
+    caches.
+    """
+    statistics = cache.cache_dir_statistics()
+
+    lookups = statistics['hits'] + statistics['misses']
+    if lookups:
+        hit_rate = '%.1f%%' % (100.0 * statistics['hits'] / lookups)
+    else:
+        hit_rate = 'n/a'
+
+    if statistics['max_size'] is None:
+        max_size = 'unbounded'
+    else:
+        max_size = '%d bytes' % statistics['max_size']
+
+    print 'Files:     %d' % statistics['files']
+    print 'Size:      %d bytes' % statistics['size']
+    print 'Max size:  %s' % max_size
+    print 'Hits:      %d' % statistics['hits']
+    print 'Misses:    %d' % statistics['misses']
+    print 'Hit rate:  %s' % hit_rate
+    print 'Coalesced: %d' % statistics['coalesced']
+    print 'Evictions: %d' % statistics['evictions']
+
+    parser = grammar.published_statistics()
+
+    print
+    print 'Parser:'
+    print '  Common parses:         %d' % parser['common-parses']
+    print '  Full parses:           %d' % parser['parses']
+    print '  Parse errors:          %d' % parser['errors']
+    print '  Parse cache hits:      %d' % parser['parse-cache-hits']
+    print '  Parse cache misses:    %d' % parser['parse-cache-misses']
+    print '  Parse cache evictions: %d' % parser['parse-cache-evictions']
+    print '  Packrat hits:          %d' % parser['packrat-hits']
+    print '  Packrat misses:        %d' % parser['packrat-misses']
+    print '  Packrat evictions:     %d' % parser['packrat-evictions']
+
+
+def recompress_cache(codec=None):
+    """
+    Re-encode all reference files in the cache with another compression codec.
+    """
+    codec = codec or settings.CACHE_COMPRESSION
+    if codec not in compression.available_codecs():
+        raise UserError('Compression codec not available: %s' % codec)
+
+    util.set_process_name('mutalyzer: recompress-cache')
+
+    total = recompressed = 0
+    for filename in sorted(os.listdir(settings.CACHE_DIR)):
+        if not filename.endswith(('.gb.bz2', '.xml.bz2')):
+            continue
+        total += 1
+        if compression.recompress(os.path.join(settings.CACHE_DIR, filename),
+                                  codec):
+            recompressed += 1
+
+    print ('Re-encoded %d of %d reference files with %s.'
+           % (recompressed, total, codec))
+
+
 def list_batch_jobs():
     """
     List batch jobs.
@@ -396,6 +487,42 @@ def main():
         description=unset_announcement.__doc__.split('\n\n')[0])
     p.set_defaults(func=unset_announcement)
 
+    # Subparsers for 'cache'.
+    s = subparsers.add_parser(
+        'cache', help='manage the cache',
+        description='Manage the cache of reference files and parsed records.'
+        ).add_subparsers()
+
+    # Subparser 'cache status'.
+    p = s.add_parser(
+        'status', help='show cache usage',
+        description=cache_status.__doc__.split('\n\n')[0],
+        epilog='Hits, misses, coalesced retrievals, and evictions are '
+        'counted over all Mutalyzer processes sharing the same Redis server.')
+    p.set_defaults(func=cache_status)
+
+    # Subparser 'cache rebuild-records'.
+    p = s.add_parser(
+        'rebuild-records', help='rebuild cached parsed records',
+        description=rebuild_record_cache.__doc__.split('\n\n')[0],
+        epilog='Intended use is after upgrading Mutalyzer, so worker '
+        'processes do not have to parse reference files again.')
+    p.set_defaults(func=rebuild_record_cache)
+
+    # Subparser 'cache recompress'.
+    p = s.add_parser(
+        'recompress', help='re-encode reference files',
+        description=recompress_cache.__doc__.split('\n\n')[0],
+        epilog='The codec of existing reference files is detected '
+        'automatically, so this can safely be run while Mutalyzer is '
+        'running.')
+    p.add_argument(
+        '--codec', metavar='CODEC', dest='codec', type=_cli_string,
+        help='compression codec to use, one of: %s (default: value of the '
+        'CACHE_COMPRESSION setting)'
+        % ', '.join(compression.available_codecs()))
+    p.set_defaults(func=recompress_cache)
+
     # Subparser 'batch-jobs'.
     p = subparsers.add_parser(
         'batch-jobs', help='list batch jobs',
@@ -11,6 +11,14 @@ informal overview, see [2].
 
 The grammar is described in [3].
 
+Packrat parsing is enabled once for the whole process, using a bounded cache
+that is shared by all parsers. Since this cache is global in pyparsing, all
+parsing is done while holding a lock (see L{parse_string}).
+
+Most descriptions we get are simple, e.g., NM_003002.2:c.274G>T. These are
+recognised by a regular expression and their parse tree is built directly
+(see L{parse_common}), which is a lot faster than using the full grammar.
+
 @todo: Automatically generate a LaTeX BNF description from this.
 
 [1] http://pyparsing.wikispaces.com/
@@ -21,7 +29,551 @@ The grammar is described in [3].
 
 from __future__ import unicode_literals
 
+import collections
+import cPickle as pickle
+import re
+import sys
+import threading
+import time
+
 from pyparsing import *
+from pyparsing import _ParseResultsWithOffset
+
+from mutalyzer.config import settings
+from mutalyzer import stats
+
+
+class PackratCache(dict):
+    """
+    Bounded replacement for the packrat cache of pyparsing. All entries are
+    evicted at once when the cache is full, which is cheaper than tracking
+    the order of the entries.
+
+    Pyparsing checks for an entry before getting it, so every get is a hit
+    and every set is a miss.
+    """
+    def __init__(self, max_size=None):
+        """
+        @kwarg max_size: Maximum number of entries. If None, the number of
+            entries is not bounded.
+        @type max_size: int
+        """
+        dict.__init__(self)
+        self.max_size = max_size
+        self.hits = 0
+        self.evictions = 0
+        self._misses = 0
+    #__init__
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        self._max_size = max_size
+        self._limit = max_size or sys.maxsize
+
+    @property
+    def misses(self):
+        return self._misses + len(self)
+
+    def __getitem__(self, key):
+        self.hits += 1
+        return dict.__getitem__(self, key)
+    #__getitem__
+
+    def __setitem__(self, key, value):
+        if len(self) >= self._limit:
+            self.evictions += len(self)
+            self.clear()
+        dict.__setitem__(self, key, value)
+    #__setitem__
+
+    def clear(self):
+        """
+        Remove all entries, keeping the counters.
+        """
+        self._misses += len(self)
+        dict.clear(self)
+    #clear
+#PackratCache
+
+
+class ParseCache(object):
+    """
+    Least recently used cache of the outcomes of parsing descriptions with
+    the full grammar. Parse trees are kept in pickled form, so every hit
+    gets its own copy.
+
+    The cache is safe to use from multiple threads.
+    """
+    def __init__(self, max_size=None):
+        """
+        @kwarg max_size: Maximum number of cached descriptions. If None, the
+            PARSE_CACHE_SIZE configuration setting is used.
+        @type max_size: int
+        """
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    #__init__
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return settings.PARSE_CACHE_SIZE
+        return self._max_size
+
+    def get(self, description):
+        """
+        Get the cached outcome of parsing a description.
+
+        @arg description: The parsed string.
+        @type description: unicode
+
+        @return: Tuple of the parse tree and the parse error (message and
+            position), one of which is None, or None if the description is
+            not in the cache.
+        @rtype: tuple(pyparsing.ParseResults, tuple(unicode, int))
+        """
+        with self._lock:
+            entry = self._entries.pop(description, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[description] = entry
+            self.hits += 1
+
+        data, error = entry
+        if data is None:
+            return None, error
+        return pickle.loads(data), None
+    #get
+
+    def put(self, description, parse_tree, error=None):
+        """
+        Store the outcome of parsing a description. Least recently used
+        descriptions are evicted until the cache fits within its size limit.
+
+        @arg description: The parsed string.
+        @type description: unicode
+        @arg parse_tree: The parse tree, or None in case of a parse error.
+        @type parse_tree: pyparsing.ParseResults
+        @kwarg error: The parse error message and the position in the string
+            where it occurred.
+        @type error: tuple(unicode, int)
+        """
+        max_size = self.max_size
+        if not max_size:
+            return
+
+        # Pickle protocol 2 does not work for ParseResults, since it returns
+        # an empty string for any unknown attribute.
+        if parse_tree is not None:
+            parse_tree = pickle.dumps(parse_tree, 1)
+
+        with self._lock:
+            self._entries.pop(description, None)
+            self._entries[description] = parse_tree, error
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    #put
+
+    def clear(self):
+        """
+        Remove all descriptions from the cache and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+    #clear
+
+    def statistics(self):
+        """
+        Get cache statistics.
+
+        @return: Dictionary with the number of cached descriptions, the
+            maximum number, and the number of hits, misses, and evictions.
+        @rtype: dict
+        """
+        with self._lock:
+            return {'descriptions': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+    #statistics
+#ParseCache
+
+
+#: Packrat cache shared by all parsers in this process.
+packrat_cache = PackratCache()
+
+ParserElement._exprArgCache = packrat_cache
+ParserElement.enablePackrat()
+
+#: Cache of parse outcomes shared by all parsers in this process.
+parse_cache = ParseCache()
+
+
+def clear_parse_cache(value=None):
+    """
+    Remove all descriptions from the cache of parse outcomes.
+    """
+    parse_cache.clear()
+
+
+settings.on_update(clear_parse_cache, 'PARSE_CACHE_SIZE')
+
+_lock = threading.Lock()
+_common_lock = threading.Lock()
+_common_parses = 0
+_parses = 0
+_errors = 0
+_parse_time = 0.0
+_wait_time = 0.0
+
+#: Minimum number of seconds between publishing the parser statistics of this
+#: process (see L{publish_statistics}).
+PUBLISH_INTERVAL = 10
+
+_publish_lock = threading.Lock()
+_published = {}
+_published_at = 0.0
+
+
+def parse_string(element, string, parse_all=False):
+    """
+    Parse a string with a grammar rule. Parsers must not be used directly,
+    since the packrat cache is shared by all threads.
+
+    If the STAGE_TIMINGS setting is enabled, the parse latency is added to
+    the 'grammar/parse' histogram and the time spent waiting for other
+    threads to the 'grammar/wait' histogram (see stats.get_histogram).
+
+    @arg element: Grammar rule, e.g., Grammar.Var.
+    @type element: pyparsing.ParserElement
+    @arg string: The input string that needs to be parsed.
+    @type string: unicode
+    @kwarg parse_all: Whether the entire string must match the rule.
+    @type parse_all: bool
+
+    @return: The parse tree containing the parse results.
+    @rtype: pyparsing.ParseResults
+
+    @raise ParseException: The string could not be parsed.
+    """
+    global _parses, _errors, _parse_time, _wait_time
+
+    requested = time.time()
+    try:
+        with _lock:
+            started = time.time()
+            try:
+                packrat_cache.max_size = settings.PACKRAT_CACHE_SIZE
+                return element.parseString(string, parseAll=parse_all)
+            except ParseBaseException:
+                _errors += 1
+                raise
+            finally:
+                # Don't keep the entries for this string around until the
+                # next parse.
+                packrat_cache.clear()
+                finished = time.time()
+                _parses += 1
+                _parse_time += finished - started
+                _wait_time += started - requested
+    finally:
+        if settings.STAGE_TIMINGS:
+            stats.observe_latencies([('grammar/parse', finished - started),
+                                     ('grammar/wait', started - requested)])
+#parse_string
+
+
+def statistics():
+    """
+    Get parser statistics of this process.
+
+    @return: Dictionary with the number of descriptions parsed without using
+        the full grammar (see L{parse_common}), the number of parses and
+        parse errors using the full grammar, the total time spent parsing and
+        waiting for other threads (in seconds), the maximum packrat cache
+        size, and the number of packrat cache hits, misses, and evictions.
+        Statistics of the cache of parse outcomes are available from
+        L{parse_cache}.
+    @rtype: dict
+    """
+    with _common_lock:
+        common_parses = _common_parses
+    with _lock:
+        return {'common_parses': common_parses,
+                'parses': _parses,
+                'errors': _errors,
+                'parse_time': _parse_time,
+                'wait_time': _wait_time,
+                'max_cache_size': packrat_cache.max_size,
+                'hits': packrat_cache.hits,
+                'misses': packrat_cache.misses,
+                'evictions': packrat_cache.evictions}
+#statistics
+
+
+def _counters():
+    """
+    Get the parser counters of this process, as published by
+    L{publish_statistics}.
+    """
+    counters = statistics()
+    cache_counters = parse_cache.statistics()
+    return {'common-parses': counters['common_parses'],
+            'parses': counters['parses'],
+            'errors': counters['errors'],
+            'packrat-hits': counters['hits'],
+            'packrat-misses': counters['misses'],
+            'packrat-evictions': counters['evictions'],
+            'parse-cache-hits': cache_counters['hits'],
+            'parse-cache-misses': cache_counters['misses'],
+            'parse-cache-evictions': cache_counters['evictions']}
+#_counters
+
+
+def publish_statistics(force=False):
+    """
+    Add the parser counters of this process to the 'grammar/...' counters in
+    Redis, so they can be combined over all processes (see
+    L{published_statistics}). Only what changed since the previous call is
+    added, and nothing is done if that was less than L{PUBLISH_INTERVAL}
+    seconds ago.
+
+    @kwarg force: Publish regardless of when we last published.
+    @type force: bool
+    """
+    global _published_at
+
+    if not force and time.time() - _published_at < PUBLISH_INTERVAL:
+        return
+
+    # Another thread is already publishing.
+    if not _publish_lock.acquire(False):
+        return
+
+    try:
+        _published_at = time.time()
+        amounts = {}
+        for name, value in _counters().items():
+            amount = value - _published.get(name, 0)
+            if amount < 0:
+                # The counter was reset since we last published.
+                amount = value
+            if amount:
+                amounts['grammar/%s' % name] = amount
+            _published[name] = value
+        if amounts:
+            stats.increment_counters(amounts)
+    finally:
+        _publish_lock.release()
+#publish_statistics
+
+
+def published_statistics():
+    """
+    Get parser statistics combined over all Mutalyzer processes sharing the
+    same Redis server (see L{publish_statistics}).
+
+    @return: Dictionary with the number of descriptions parsed without using
+        the full grammar, the number of parses and parse errors using the
+        full grammar, the number of packrat cache hits, misses, and
+        evictions, and the number of hits, misses, and evictions of the cache
+        of parse outcomes. Keys are the counter names without the 'grammar/'
+        prefix.
+    @rtype: dict
+    """
+    return {name: stats.get_total('grammar/%s' % name)
+            for name in _counters()}
+#published_statistics
+
+
+# Shapes of descriptions recognised by parse_common. Together they form a
+# subset of the SingleVar rule, the first alternative of the top-level Var
+# rule, so the full grammar would produce the same parse tree for them.
+_NT = 'acgturykmswbdhvnACGTURYKMSWBDHVN'
+_PT_LOC = r'([-*])?([0-9]+)(?:([-+])([0-9]+))?'
+_COMMON_PATTERN = re.compile(r"""
+    (?!LRG_|(?:GI|gi)[0-9])
+    ([A-Za-z_]+[0-9]+)                      # RefSeqAcc
+    (?:\.([0-9]+))?                         # Version
+    (?:\(
+        (?:([A-Za-z0-9-]+)                  # GeneSymbol
+           (?:_v([0-9]+)|_i([0-9]+))?       # TransVar or ProtIso
+          |(?!LRG_)([A-Za-z_]+[0-9]+)\.([0-9]+)) # AccNoTransVar
+    \))?
+    :([cgmnr])\.                            # RefType
+    (%(loc)s(?:_%(loc)s)?                   # StartLoc and EndLoc
+     (?:([%(nt)s])>([%(nt)s])               # Subst
+       |del([%(nt)s]+|[0-9]+)?ins([%(nt)s]+) # Indel
+       |(del|dup)([%(nt)s]+|[0-9]+)?        # Del or Dup
+       |ins([%(nt)s]+)))                    # Ins
+    \Z""" % {'loc': _PT_LOC, 'nt': _NT}, re.VERBOSE)
+
+
+def _parse_results(tokens, names=(), name=None):
+    """
+    Create a parse tree node the way pyparsing does.
+
+    @arg tokens: Tokens of the node.
+    @type tokens: list
+    @kwarg names: Named results as (name, value, offset) tuples, where
+        offset is the position of the value in the tokens.
+    @type names: list(tuple)
+    @kwarg name: Results name of the node itself.
+    @type name: unicode
+
+    @return: The parse tree node.
+    @rtype: pyparsing.ParseResults
+    """
+    results = ParseResults(tokens)
+    results._ParseResults__name = name
+    for key, value, offset in names:
+        results[key] = _ParseResultsWithOffset(value, offset)
+    return results
+#_parse_results
+
+
+def _parse_location(sign, main, offset_sign, offset, name):
+    """
+    Create the parse tree node for a point location as in the Loc rule.
+
+    @return: The parse tree node.
+    @rtype: pyparsing.ParseResults
+    """
+    tokens = []
+    names = []
+    if sign:
+        names.append(('MainSgn', sign, 0))
+        tokens.append(sign)
+    names.append(('Main', main, len(tokens)))
+    tokens.append(main)
+    if offset_sign:
+        names.append(('OffSgn', offset_sign, len(tokens)))
+        names.append(('Offset', offset, len(tokens) + 1))
+        tokens.extend([offset_sign, offset])
+    point = _parse_results(tokens, names, 'MainSgn')
+    return _parse_results([point], [('PtLoc', point, 0)], name)
+#_parse_location
+
+
+def parse_common(description):
+    """
+    Parse a description of a common shape without using the full grammar.
+
+    Supported are substitutions, deletions, duplications, insertions, and
+    deletion-insertions of (unknown) nucleotides, described at one position
+    or range (possibly with offsets) on a versioned or unversioned reference,
+    which may have a gene symbol or transcript accession number as selector.
+
+    @arg description: The input string that needs to be parsed.
+    @type description: unicode
+
+    @return: The parse tree containing the parse results, exactly as the
+        full grammar would produce it, or None if the description is not of
+        a supported shape.
+    @rtype: pyparsing.ParseResults
+    """
+    match = _COMMON_PATTERN.match(description)
+    if not match:
+        return None
+
+    (accession, version, gene, trans_var, prot_iso, transcript,
+     transcript_version, ref_type, original) = match.group(*range(1, 10))
+    start = match.group(*range(10, 14))
+    end = match.group(*range(14, 18))
+    (subst_arg1, subst_arg2, indel_arg1, indel_sequence, mutation_type,
+     arg1, ins_sequence) = match.group(*range(18, 25))
+
+    tokens = []
+    names = []
+    if end[1]:
+        tokens.append(_parse_location(*start, name='StartLoc'))
+        tokens.append(_parse_location(*end, name='EndLoc'))
+        names.append(('StartLoc', tokens[0], 0))
+        names.append(('EndLoc', tokens[1], 1))
+    elif ins_sequence:
+        # Insertions are only allowed between two positions.
+        return None
+    else:
+        tokens.append(_parse_location(*start, name='StartLoc'))
+        names.append(('StartLoc', tokens[0], 0))
+
+    if subst_arg1:
+        if end[1]:
+            return None
+        names.append(('Arg1', subst_arg1, 1))
+        names.append(('MutationType', 'subst', 2))
+        names.append(('Arg2', subst_arg2, 3))
+        tokens.extend([subst_arg1, 'subst', subst_arg2])
+    elif mutation_type:
+        names.append(('MutationType', mutation_type, len(tokens)))
+        tokens.append(mutation_type)
+        if arg1:
+            names.append(('Arg1', arg1, len(tokens)))
+            tokens.append(arg1)
+    else:
+        if indel_sequence:
+            tokens.append('del')
+            if indel_arg1:
+                names.append(('Arg1', indel_arg1, len(tokens)))
+                tokens.append(indel_arg1)
+            mutation_type = 'delins'
+            sequence = indel_sequence
+        else:
+            mutation_type = 'ins'
+            sequence = ins_sequence
+        names.append(('MutationType', mutation_type, len(tokens)))
+        tokens.append(mutation_type)
+        sequence = _parse_results([sequence], [('Sequence', sequence, 0)],
+                                  'Seq')
+        names.append(('Seq', sequence, len(tokens)))
+        tokens.append(sequence)
+
+    raw_var = _parse_results(tokens, names, 'RawVar')
+
+    tokens = [accession]
+    names = [('RefSeqAcc', accession, 0)]
+    if version:
+        names.append(('Version', version, 1))
+        tokens.append(version)
+    if gene:
+        gene_tokens = [gene]
+        gene_names = [('GeneSymbol', gene, 0)]
+        if trans_var:
+            gene_names.append(('TransVar', trans_var, 1))
+            gene_tokens.append(trans_var)
+        elif prot_iso:
+            gene_names.append(('ProtIso', prot_iso, 1))
+            gene_tokens.append(prot_iso)
+        gene = _parse_results(gene_tokens, gene_names, 'Gene')
+        names.append(('Gene', gene, len(tokens)))
+        tokens.append(gene)
+    elif transcript:
+        transcript = _parse_results([transcript, transcript_version], (),
+                                    'AccNoTransVar')
+        names.append(('AccNoTransVar', transcript, len(tokens)))
+        tokens.extend(transcript)
+    names.append(('RefType', ref_type, len(tokens)))
+    tokens.append(ref_type)
+    # The full grammar keeps the original text of the raw variant as token.
+    names.append(('RawVar', raw_var, len(tokens)))
+    tokens.append(original)
+
+    return _parse_results(tokens, names)
+#parse_common
 
 
 class Grammar():
@@ -464,14 +1016,13 @@ class Grammar():
 
     def __init__(self, output):
         """
-        Initialise the class and enable packrat parsing. Packrat speeds up
-        parsing considerably.
+        Initialise the class. The grammar rules are shared by all instances,
+        so this is cheap.
 
         @arg output: The output object.
         @type output: mutalyzer.output.Output
         """
         self._output = output
-        ParserElement.enablePackrat()
     #__init__
 
     def parse(self, variant):
@@ -480,6 +1031,10 @@ class Grammar():
         successful. Otherwise print the parse error and the position in
         the input where the error occurred (and return None).
 
+        Descriptions of a common shape are parsed without using the full
+        grammar (see L{parse_common}). Outcomes of parsing other descriptions
+        are cached (see L{parse_cache}).
+
         @arg variant: The input string that needs to be parsed.
         @type variant: unicode
 
@@ -490,18 +1045,41 @@ class Grammar():
         @todo: Use information in ParseException as described here:
             http://pyparsing.wikispaces.com/HowToUsePyparsing
         """
-        try:
-            return self.Var.parseString(variant, parseAll=True)
-            # Todo: check .dump()
-        except ParseException as err:
-            #print err.line
-            #print " "*(err.column-1) + "^"
-            #print err
+        global _common_parses
+
+        publish_statistics()
+
+        parsed = parse_common(variant)
+        if parsed is not None:
+            with _common_lock:
+                _common_parses += 1
+            return parsed
+
+        cached = parse_cache.get(variant)
+        if cached is not None:
+            parsed, error = cached
+        else:
+            try:
+                parsed, error = parse_string(self.Var, variant,
+                                             parse_all=True), None
+                # Todo: check .dump()
+            except ParseException as err:
+                #print err.line
+                #print " "*(err.column-1) + "^"
+                #print err
+                parsed = None
+                error = (unicode(err),
+                         int(unicode(err).split(':')[-1][:-1]) - 1)
+            parse_cache.put(variant, parsed, error)
+
+        if error:
             # Log parse error and the position where it occurred.
-            self._output.addMessage(__file__, 4, 'EPARSE', unicode(err))
-            pos = int(unicode(err).split(':')[-1][:-1]) - 1
+            message, pos = error
+            self._output.addMessage(__file__, 4, 'EPARSE', message)
             self._output.addOutput('parseError', variant)
             self._output.addOutput('parseError', pos * ' ' + '^')
             return None
+
+        return parsed
     #parse
 #Grammar
@@ -10,7 +10,7 @@ from the Spyne model classes.
 
 from __future__ import unicode_literals
 
-from spyne.model.primitive import Integer, Boolean, DateTime, Unicode
+from spyne.model.primitive import Integer, Boolean, DateTime, Double, Unicode
 from spyne.model.binary import ByteArray
 from spyne.model.complex import ComplexModel, Array
 
@@ -111,6 +111,17 @@ class RawVariant(ComplexModel):
 #RawVariant
 
 
+class StageTiming(ComplexModel):
+    """
+    Used in MutalyzerOutput data type.
+    """
+    __namespace__ = SOAP_NAMESPACE
+
+    stage = Mandatory.Unicode
+    seconds = Double
+#StageTiming
+
+
 class RawVar(ComplexModel):
     """
     Used in MutalyzerOutput data type.
@@ -289,6 +300,8 @@ class MutalyzerOutput(ComplexModel):
     messages = Array(SoapMessage)
 
     varDetails = VarDetails
+
+    timings = Array(StageTiming)
 #MutalyzerOutput
 
 
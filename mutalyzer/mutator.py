@@ -3,20 +3,28 @@ Module for mutating a string.
 
 Mutations are described in the original coordinates. These coordinates are
 transfered to the mutated coordinates with the aid of an internal shift
-list, which keeps track of the sizes of changes. Using the original
+list, which keeps track of the sizes of changes (as cumulative shifts over
+sorted positions, so the shift at any position can be found by bisection).
+Using the original
 coordinates greatly simplifies combined mutations in a variant. A
 visualisation of each raw variant within a combined variant is made and
-effects on restriction sites are also analysed.
+effects on restriction sites are also analysed (the latter only when the
+output is asked for).
 
-The original as well as the mutated string are stored here.
+The original as well as the mutated string are stored here. The mutated
+string is a piece table over the original string and the inserted
+sequences, so applying a mutation does not copy the sequence.
 """
 
 
 from __future__ import unicode_literals
 
-from collections import defaultdict
+import bisect
+import collections
+import threading
 
 from Bio import Restriction
+from Bio.Seq import Seq
 
 from mutalyzer import util
 
@@ -31,14 +39,253 @@ VIS_MAX_LENGTH = 25
 # (because it exceeds VIS_MAX_LENGTH).
 VIS_CLIP_FLANK_LENGTH = 6
 
+# Number of sequences for which the restriction site counts are remembered.
+RESTRICTION_CACHE_SIZE = 1000
+
+# Commercially available restriction enzymes with their compiled recognition
+# site patterns (both strands), created on first use.
+_restriction_enzymes = None
+
+# Restriction site counts per sequence, least recently used first.
+_restriction_counts = collections.OrderedDict()
+_restriction_counts_lock = threading.Lock()
+
+
+def _get_restriction_enzymes():
+    """
+    Return the commercially available restriction enzymes.
+
+    @return: Enzymes with their compiled recognition site patterns.
+    @rtype: list(tuple(Bio.Restriction.RestrictionType, regex))
+    """
+    global _restriction_enzymes
+    if _restriction_enzymes is None:
+        batch = Restriction.RestrictionBatch([], ['N'])
+        _restriction_enzymes = [(enzyme, enzyme.compsite)
+                                for enzyme in batch]
+    return _restriction_enzymes
+#_get_restriction_enzymes
+
+
+def restriction_count(sequence):
+    """
+    Return the count per restriction enzyme that can bind in a certain
+    sequence.
+
+    Only the enzymes with a recognition site in the sequence are analysed
+    with Bio.Restriction, the rest is skipped after one regular expression
+    search. Results are remembered for the last RESTRICTION_CACHE_SIZE
+    sequences. This function is safe to call from multiple threads.
+
+    @arg sequence: The sequence to be analysed.
+    @type sequence: unicode
+
+    @return: A mapping of restriction enzymes to counts (do not modify).
+    @rtype: dict
+    """
+    sequence = unicode(sequence).upper()
+
+    # Bio.Restriction keeps the searched sequence in a class attribute of
+    # the enzyme, so searching is not thread-safe either.
+    with _restriction_counts_lock:
+        counts = _restriction_counts.pop(sequence, None)
+        if counts is None:
+            counts = {}
+            formatted = None
+            for enzyme, site in _get_restriction_enzymes():
+                if not site.search(sequence):
+                    continue
+                if formatted is None:
+                    formatted = Restriction.FormattedSeq(Seq(sequence))
+                count = len(enzyme.search(formatted))
+                if count:
+                    counts[unicode(enzyme)] = count
+            while len(_restriction_counts) >= RESTRICTION_CACHE_SIZE > 0:
+                _restriction_counts.popitem(last=False)
+
+        if RESTRICTION_CACHE_SIZE > 0:
+            _restriction_counts[sequence] = counts
+    return counts
+#restriction_count
+
+
+class MutatedSequence(object):
+    """
+    Read-only sequence consisting of parts of an original sequence and
+    inserted sequences (a piece table).
+
+    Editing the sequence with delins() gives a new MutatedSequence and only
+    copies the piece table, not the sequence. Sequence data is only copied
+    when it is read: indexing gives a single character and slicing gives a
+    Bio.Seq.Seq (if the original is one) of only the requested region.
+    """
+    def __init__(self, original):
+        """
+        Initialise the sequence as the original sequence.
+
+        @arg original: The original sequence.
+        @type original: Bio.Seq.Seq or unicode
+        """
+        self.original = original
+
+        buffer = getattr(original, '_data', original)
+        self._length = len(buffer)
+
+        # Pieces of the sequence as (buffer, start, stop) tuples, and the
+        # position in the sequence of the start of each piece.
+        self._pieces = [(buffer, 0, self._length)] if self._length else []
+        self._offsets = [0] if self._length else []
+    #__init__
+
+    @property
+    def alphabet(self):
+        return self.original.alphabet
+    #alphabet
+
+    def _wrap(self, data):
+        """
+        Convert sequence data to the type of the original sequence.
+        """
+        if isinstance(self.original, Seq):
+            return Seq(data, self.original.alphabet)
+        return data
+    #_wrap
+
+    def _slice(self, start, stop):
+        """
+        Pieces for the region from {start} to {stop} (interbase positions).
+
+        @arg start: Start of the region.
+        @type start: int
+        @arg stop: End of the region.
+        @type stop: int
+
+        @return: Pieces as (buffer, start, stop) tuples.
+        @rtype: list(tuple(unicode, int, int))
+        """
+        pieces = []
+        if start >= stop:
+            return pieces
+
+        i = max(bisect.bisect_right(self._offsets, start) - 1, 0)
+        while i < len(self._pieces) and self._offsets[i] < stop:
+            buffer, piece_start, piece_stop = self._pieces[i]
+            offset = self._offsets[i]
+            pieces.append((buffer,
+                           piece_start + max(start - offset, 0),
+                           min(piece_stop, piece_start + stop - offset)))
+            i += 1
+        return pieces
+    #_slice
+
+    def delins(self, start, stop, insertion):
+        """
+        Replace a region with a new sequence.
+
+        This is equivalent to {sequence[:start] + insertion +
+        sequence[stop:]}.
+
+        @arg start: Start of the replaced region (interbase position).
+        @type start: int
+        @arg stop: End of the replaced region (interbase position).
+        @type stop: int
+        @arg insertion: Inserted sequence.
+        @type insertion: unicode
+
+        @return: The edited sequence.
+        @rtype: MutatedSequence
+        """
+        insertion = unicode(insertion)
+        start = min(max(start, 0), self._length)
+        stop = min(max(stop, 0), self._length)
+
+        # Whole pieces are copied by slicing the piece table, only the pieces
+        # containing {start} and {stop} are split. If variants are applied
+        # from left to right, there are only a few pieces after {stop}.
+        i = bisect.bisect_right(self._offsets, start)
+        if start == self._length or self._offsets[i - 1] == start:
+            i -= start < self._length
+            pieces = self._pieces[:i]
+            offsets = self._offsets[:i]
+        else:
+            buffer, piece_start, _ = self._pieces[i - 1]
+            offset = self._offsets[i - 1]
+            pieces = self._pieces[:i - 1]
+            offsets = self._offsets[:i - 1]
+            pieces.append((buffer, piece_start, piece_start + start - offset))
+            offsets.append(offset)
+
+        if insertion:
+            pieces.append((insertion, 0, len(insertion)))
+            offsets.append(start)
+
+        j = bisect.bisect_right(self._offsets, stop)
+        shift = start + len(insertion) - stop
+        if stop < self._length:
+            buffer, piece_start, piece_stop = self._pieces[j - 1]
+            offset = self._offsets[j - 1]
+            if stop > offset:
+                pieces.append((buffer, piece_start + stop - offset,
+                               piece_stop))
+                offsets.append(stop + shift)
+            else:
+                j -= 1
+        pieces.extend(self._pieces[j:])
+        offsets.extend(offset + shift for offset in self._offsets[j:])
+
+        sequence = MutatedSequence.__new__(MutatedSequence)
+        sequence.original = self.original
+        sequence._pieces = pieces
+        sequence._offsets = offsets
+        sequence._length = self._length + shift
+        return sequence
+    #delins
+
+    def __len__(self):
+        return self._length
+    #__len__
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return self._wrap(unicode(self))[index]
+            return self._wrap(''.join(buffer[piece_start:piece_stop]
+                                      for buffer, piece_start, piece_stop
+                                      in self._slice(start, stop)))
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('sequence index out of range')
+        i = bisect.bisect_right(self._offsets, index) - 1
+        buffer, start, _ = self._pieces[i]
+        return buffer[start + index - self._offsets[i]]
+    #__getitem__
+
+    def __unicode__(self):
+        return ''.join(buffer[start:stop]
+                       for buffer, start, stop in self._pieces)
+    #__unicode__
+
+    def __str__(self):
+        return unicode(self).encode('ascii')
+    #__str__
+
+    def __repr__(self):
+        return 'MutatedSequence(%r, %i pieces)' % (self.original,
+                                                   len(self._pieces))
+    #__repr__
+#MutatedSequence
+
 
 class Mutator():
     """
     Mutate a string and register all shift points. For each mutation a
     visualisation is made (on genomic level) and the addition or deletion
     of restriction sites is detected. Output for each raw variant is stored
-    in the output object as 'visualisation', 'deletedRestrictionSites' and
-    'addedRestrictionSites' respectively.
+    in the output object as 'visualisation' and 'restrictionSites'
+    respectively, the latter is only computed when it is asked for.
     """
     def __init__(self, orig, output):
         """
@@ -49,32 +296,35 @@ class Mutator():
         @arg output: The output object.
         @type output: mutalyzer.Output.Output
         """
-        self._shifts = defaultdict(int)
+        # Sorted positions in the original string where the shift changes,
+        # and the total shift from each of these positions on.
+        self._shift_positions = []
+        self._shift_totals = []
         self._removed_sites = set()
-        self._restriction_batch = Restriction.RestrictionBatch([], ['N'])
+        # Sequences around each raw variant that are not yet analysed for
+        # restriction sites, as (original, mutated) pairs.
+        self._restriction_windows = []
 
         self._output = output
         self.orig = orig
 
-        # Note that we don't need to create a copy here, since mutation
-        # operations are not in place (`self._mutate`).
-        self.mutated = orig
+        self.mutated = MutatedSequence(orig)
     #__init__
 
-    def _restriction_count(self, sequence):
+    def _add_restriction_sites(self):
         """
-        Return the count per restriction enzyme that can bind in a certain
-        sequence.
-
-        @arg sequence: The sequence to be analysed
-        @type sequence: str
-
-        @return: A mapping of restriction enzymes to counts.
-        @rtype: dict
+        Do the restriction site analysis on the raw variants visualised so
+        far and add the result to the 'restrictionSites' output.
         """
-        analysis = Restriction.Analysis(self._restriction_batch, sequence)
-        return dict((unicode(k), len(v)) for k, v in analysis.with_sites().items())
-    #_restriction_count
+        windows, self._restriction_windows = self._restriction_windows, []
+        with self._output.timer('restriction-sites'):
+            for original, mutated in windows:
+                counts1 = restriction_count(original)
+                counts2 = restriction_count(mutated)
+                self._output.addOutput('restrictionSites',
+                                       [self._counts_diff(counts2, counts1),
+                                        self._counts_diff(counts1, counts2)])
+    #_add_restriction_sites
 
     def _counts_diff(self, counts1, counts2):
         """
@@ -138,12 +388,15 @@ class Mutator():
 
         # Todo: This part is for restriction site analysis. It doesn't really
         #     belong in this method, but since it uses many variables computed
-        #     for the visualisation, we leave it here for the moment.
-        counts1 = self._restriction_count(loflank + delPart + roflank)
-        counts2 = self._restriction_count(lmflank + ins + rmflank)
-        self._output.addOutput('restrictionSites',
-                               [self._counts_diff(counts2, counts1),
-                                self._counts_diff(counts1, counts2)])
+        #     for the visualisation, we leave it here for the moment. The
+        #     analysis itself is only done if the output is used.
+        if not self._restriction_windows:
+            self._output.addDeferredOutput(['restrictionSites'],
+                                           self._add_restriction_sites,
+                                           messages=False)
+        self._restriction_windows.append(
+            (unicode(loflank + delPart + roflank),
+             unicode(lmflank + ins + rmflank)))
 
         return visualisation
     #_visualise
@@ -157,7 +410,19 @@ class Mutator():
         @arg shift: Shift size.
         @type shift: int
         """
-        self._shifts[position] += shift
+        if not shift:
+            return
+
+        positions, totals = self._shift_positions, self._shift_totals
+        i = bisect.bisect_left(positions, position)
+        if i == len(positions) or positions[i] != position:
+            positions.insert(i, position)
+            totals.insert(i, totals[i - 1] if i else 0)
+
+        # Variants are usually applied from left to right, in which case this
+        # only updates the last entry.
+        for j in range(i, len(totals)):
+            totals[j] += shift
     #_add_shift
 
     def _shift_minus_at(self, position):
@@ -172,7 +437,11 @@ class Mutator():
             given position, False otherwise.
         @rtype: bool
         """
-        return self._shifts[position] < 0
+        positions, totals = self._shift_positions, self._shift_totals
+        i = bisect.bisect_left(positions, position)
+        if i == len(positions) or positions[i] != position:
+            return False
+        return totals[i] < (totals[i - 1] if i else 0)
     #_shift_minus_at
 
     def shift_at(self, position):
@@ -185,7 +454,8 @@ class Mutator():
         @return: Shift for the given position.
         @rtype: int
         """
-        return sum(s for p, s in self._shifts.items() if p <= position)
+        i = bisect.bisect_right(self._shift_positions, position)
+        return self._shift_totals[i - 1] if i else 0
     #shift_at
 
     def shift(self, position):
@@ -341,10 +611,14 @@ class Mutator():
         @arg ins: Inserted sequence.
         @type ins: unicode
         """
+        if not isinstance(self.mutated, MutatedSequence):
+            # The mutated sequence was replaced.
+            self.mutated = MutatedSequence(self.mutated)
+
         correct = 1 if pos1 == pos2 else 0
-        self.mutated = (self.mutated[:self.shift(pos1 + 1) - 1] +
-                        ins +
-                        self.mutated[self.shift(pos2 + correct) - correct:])
+        self.mutated = self.mutated.delins(self.shift(pos1 + 1) - 1,
+                                           self.shift(pos2 + correct) - correct,
+                                           ins)
 
         self._add_shift(pos2 + 1, pos1 - pos2 + len(ins))
     #_mutate
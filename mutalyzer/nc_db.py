@@ -2,13 +2,19 @@ from datetime import datetime
 
 import mmap
 import os
+from StringIO import StringIO
+from Bio import SeqIO
 from Bio.Seq import Seq
+from Bio.SeqFeature import (AfterPosition, BeforePosition, CompoundLocation,
+                            ExactPosition, FeatureLocation, SeqFeature)
+from Bio.SeqRecord import SeqRecord
 from Bio.Alphabet import generic_dna
 from mutalyzer.GenRecord import PList, Locus, Gene, Record
 from mutalyzer.dbgb.models import Transcript, Reference
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
 from mutalyzer.config import settings
+from mutalyzer.db.models import Chromosome
 
 
 def get_chromosome_ids(transcript_id):
@@ -149,6 +155,211 @@ def get_nc_record(record_id, parsed_description, output):
     return record
 
 
+def get_slice_genbank(record_id, start, stop, orientation):
+    """
+    Create a GenBank file for a slice of a chromosome from the gbparser
+    database and the local sequence files, mimicking the GenBank files
+    produced by the NCBI for sliced EFetch requests.
+
+    Features that are only partly in the slice are truncated and get fuzzy
+    positions at the slice boundaries, just like in the NCBI files.
+
+    :param record_id: Accession number with version of the chromosome.
+    :param start: Start position of the slice (one-based, inclusive, in
+      reference orientation).
+    :param stop: End position of the slice (one-based, inclusive, in
+      reference orientation).
+    :param orientation: Orientation of the slice (1 for forward, 2 for
+      reverse complement).
+    :return: The GenBank file contents (UTF-8 encoded), or None if the
+      chromosome or its sequence is not available locally.
+    """
+    if not (hasattr(settings, 'SEQ_PATH') and
+            os.path.isdir(settings.SEQ_PATH)):
+        return None
+
+    accession, version = get_accession_version(record_id)
+    if version is None:
+        return None
+
+    reference = _get_reference(accession, version)
+    if reference is None or stop > reference.length:
+        return None
+
+    seq_path = settings.SEQ_PATH + reference.checksum_sequence + '.sequence'
+    try:
+        sequence = Seq(_get_sequence_mmap(seq_path, start, stop), generic_dna)
+    except IOError:
+        return None
+    if orientation == 2:
+        sequence = sequence.reverse_complement()
+
+    def location(positions, strand):
+        return _slice_location(positions, strand, start, stop, orientation)
+
+    source = SeqFeature(FeatureLocation(0, stop - start + 1, strand=1),
+                        type='source')
+    source.qualifiers['organism'] = ['Homo sapiens']
+    source.qualifiers['mol_type'] = ['genomic DNA']
+    chromosome = Chromosome.query.filter_by(accession=record_id).first()
+    if chromosome is not None and chromosome.organelle == 'mitochondrion':
+        source.qualifiers['organelle'] = ['mitochondrion']
+
+    db_transcripts = Transcript.query.\
+        filter_by(reference_id=reference.id).\
+        filter(Transcript.transcript_start <= stop,
+               Transcript.transcript_stop >= start).all()
+
+    # Gene features cover all transcripts of the gene, also those outside
+    # the slice.
+    genes = {}
+    for db_transcript in db_transcripts:
+        if db_transcript.gene not in genes:
+            gene_transcripts = Transcript.query.\
+                filter_by(reference_id=reference.id,
+                          gene=db_transcript.gene).all()
+            genes[db_transcript.gene] = _boundaries(gene_transcripts)
+
+    features = []
+    for db_transcript in db_transcripts:
+        strand = -1 if db_transcript.strand == '-' else 1
+        qualifiers = {'gene': [db_transcript.gene]}
+        if db_transcript.locus_tag:
+            qualifiers['locus_tag'] = [db_transcript.locus_tag]
+
+        if db_transcript.exons_start and db_transcript.exons_stop:
+            exons = []
+            for exon_start, exon_stop in zip(
+                    db_transcript.exons_start.split(','),
+                    db_transcript.exons_stop.split(',')):
+                exons.extend([int(exon_start), int(exon_stop)])
+            exons.sort()
+        else:
+            exons = [db_transcript.transcript_start,
+                     db_transcript.transcript_stop]
+
+        rna = SeqFeature(location(exons, strand),
+                         type=db_transcript.feature_type or 'mRNA')
+        rna.qualifiers.update(qualifiers)
+        rna.qualifiers['product'] = [db_transcript.transcript_product or '']
+        rna.qualifiers['transcript_id'] = ['%s.%s' % (
+            db_transcript.transcript_accession,
+            db_transcript.transcript_version)]
+        features.append(rna)
+
+        if db_transcript.protein_accession and db_transcript.protein_version:
+            cds = SeqFeature(location(cds_position_list(
+                exons, [db_transcript.cds_start, db_transcript.cds_stop]),
+                strand), type='CDS')
+            cds.qualifiers.update(qualifiers)
+            cds.qualifiers['product'] = [db_transcript.protein_product or '']
+            cds.qualifiers['protein_id'] = ['%s.%s' % (
+                db_transcript.protein_accession,
+                db_transcript.protein_version)]
+            if db_transcript.codon_start:
+                cds.qualifiers['codon_start'] = [db_transcript.codon_start]
+            if reference.transl_table not in (None, '', '1'):
+                cds.qualifiers['transl_table'] = [reference.transl_table]
+            features.append(cds)
+
+    for name, (gene_start, gene_stop) in genes.items():
+        strand = -1 if any(t.strand == '-' for t in db_transcripts
+                           if t.gene == name) else 1
+        gene = SeqFeature(location([gene_start, gene_stop], strand),
+                          type='gene')
+        gene.qualifiers['gene'] = [name]
+        features.append(gene)
+
+    # Order features by position, with genes before their transcripts and
+    # transcripts before their CDS.
+    features = [feature for feature in features
+                if feature.location is not None]
+    order = {'gene': 0, 'CDS': 2}
+    features.sort(key=lambda f: (int(f.location.start), order.get(f.type, 1)))
+
+    if orientation == 2:
+        region = 'complement(%d..%d)' % (start, stop)
+    else:
+        region = '%d..%d' % (start, stop)
+
+    record = SeqRecord(
+        sequence, id='%s.%s' % (accession, version), name=accession,
+        description='Homo sapiens chromosome, %s slice' % record_id,
+        features=[source] + features)
+    record.annotations['organism'] = 'Homo sapiens'
+    record.annotations['source'] = 'Homo sapiens (human)'
+    record.annotations['data_file_division'] = 'PRI'
+    if reference.date_annotation:
+        record.annotations['date'] = reference.date_annotation
+
+    handle = StringIO()
+    SeqIO.write(record, handle, 'genbank')
+    # BioPython only writes the first accession, so we add the region to the
+    # ACCESSION line ourselves.
+    data = handle.getvalue().replace(
+        'ACCESSION   %s\n' % accession,
+        'ACCESSION   %s REGION: %s\n' % (accession, region), 1)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return data
+
+
+def _slice_location(positions, strand, start, stop, orientation):
+    """
+    Convert chromosomal positions of a feature to a location on a slice of
+    the chromosome.
+
+    :param positions: Sorted list of start and stop positions of the feature
+      parts (one-based, inclusive, in chromosomal orientation).
+    :param strand: Strand of the feature on the chromosome (1 or -1).
+    :param start: Start position of the slice on the chromosome.
+    :param stop: End position of the slice on the chromosome.
+    :param orientation: Orientation of the slice (1 for forward, 2 for
+      reverse complement).
+    :return: A BioPython location, or None if the feature is not in the
+      slice.
+    """
+    parts = []
+    for part_start, part_stop in zip(positions[::2], positions[1::2]):
+        if part_stop >= start and part_start <= stop:
+            parts.append([max(part_start, start), min(part_stop, stop)])
+    if not parts:
+        return None
+
+    # Truncated features get fuzzy positions at the slice boundaries.
+    truncated_start = positions[0] < start
+    truncated_stop = positions[-1] > stop
+
+    if orientation == 2:
+        parts = [[stop - part_stop + 1, stop - part_start + 1]
+                 for part_start, part_stop in reversed(parts)]
+        truncated_start, truncated_stop = truncated_stop, truncated_start
+        strand = -strand
+    else:
+        parts = [[part_start - start + 1, part_stop - start + 1]
+                 for part_start, part_stop in parts]
+
+    locations = []
+    for i, (part_start, part_stop) in enumerate(parts):
+        if i == 0 and truncated_start:
+            begin = BeforePosition(part_start - 1)
+        else:
+            begin = ExactPosition(part_start - 1)
+        if i == len(parts) - 1 and truncated_stop:
+            end = AfterPosition(part_stop)
+        else:
+            end = ExactPosition(part_stop)
+        locations.append(FeatureLocation(begin, end, strand=strand))
+
+    if len(locations) == 1:
+        return locations[0]
+
+    # Parts of compound locations are in biological order.
+    if strand == -1:
+        locations.reverse()
+    return CompoundLocation(locations)
+
+
 def cds_position_list(mrna_position_list, cds_location):
     """
     Construct a list of coordinates that contains CDS start and stop and
@@ -208,6 +419,7 @@ def _record_with_genes_only(reference):
         gene.transcriptList.append(my_transcript)
         genes.append(gene)
     record.geneList = genes
+    record.index()
     record.seq = Seq('', generic_dna)
     return record
 
@@ -318,6 +530,7 @@ def _get_mutalyzer_record(reference, db_transcripts):
         gene_dict[gene.name] = gene
 
     record.geneList = list(gene_dict.values())
+    record.index()
 
     # Get the sequence.
     seq_path = settings.SEQ_PATH + reference.checksum_sequence + '.sequence'
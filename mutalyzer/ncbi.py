@@ -9,6 +9,7 @@ from xml.parsers import expat
 
 from Bio import Entrez
 
+from . import entrez
 from .config import settings
 from .redisclient import client as redis
 
@@ -76,10 +77,6 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
     # At the moment (2016-06-01) only GIs are returned by the calls we use
     # below, so we cannot move to `accession.version` here. This is fine for
     # now, but should be reconsidered at some point.
-    Entrez.email = settings.EMAIL
-    if hasattr(settings, 'ENTREZ_API_KEY'):
-        Entrez.api_key = settings.ENTREZ_API_KEY
-
     # If we are currently strictly matching on version, we can try again if
     # no result is found. Otherwise, we just report failure.
     def fail_or_retry():
@@ -96,7 +93,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Find source record.
     try:
-        handle = Entrez.esearch(db=source_db, term=source)
+        handle = entrez.esearch(db=source_db, term=source)
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         return fail_or_retry()
@@ -116,7 +113,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Find link from source record to target record.
     try:
-        handle = Entrez.elink(dbfrom=source_db, db=target_db, id=source_gi)
+        handle = entrez.elink(dbfrom=source_db, db=target_db, id=source_gi)
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         return fail_or_retry()
@@ -141,7 +138,7 @@ def _get_link_from_ncbi(source_db, target_db, match_link_name,
 
     # Get target record.
     try:
-        handle = Entrez.efetch(
+        handle = entrez.efetch(
             db=target_db, id=target_gi, rettype='acc', retmode='text')
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
@@ -344,12 +341,8 @@ def _get_snp_from_ncbi(rsid):
     :param rsid: The rs# of the dbSNP record (e.g., `rs9919552`).
     :return: response_text(str)
     """
-    Entrez.email = settings.EMAIL
-    if hasattr(settings, 'ENTREZ_API_KEY'):
-        Entrez.api_key = settings.ENTREZ_API_KEY
-
     try:
-        response = Entrez.efetch(db='snp', id=rsid[2:], retmode='xml')
+        response = entrez.efetch(db='snp', id=rsid[2:], retmode='xml')
     except (IOError, httplib.HTTPException):
         # TODO: Log error.
         raise ServiceError()
@@ -20,14 +20,19 @@ Message levels:
 Public classes:
   - Message ; Container class for message variables.
   - Output  ; Output interface for errors, warnings and logging.
+
+If the STAGE_TIMINGS setting is enabled, the output object also keeps the
+durations of the stages of the processing (see Output.timer).
 """
 
 
 from __future__ import unicode_literals
 
+import collections
 import io
 import time
 
+from mutalyzer import stats
 from mutalyzer import util
 from mutalyzer.config import settings
 
@@ -43,6 +48,8 @@ class Output() :
         - _loghandle  ; The handle of the log file.
         - _errors     ; The number of errors that have been processed.
         - _warnings   ; The number of warnings that have been processed.
+        - _deferred   ; Functions adding output on demand.
+        - _timings    ; Durations of stages.
 
     Special methods:
         - __init__(instance) ; Initialise the class with the calling
@@ -54,7 +61,11 @@ class Output() :
         - getMessages()           ; Print all messages that exceed the
                                     configured output level.
         - addOutput(name, data)   ; Add output to the output dictionary.
+        - addDeferredOutput(names, function) ; Add output to the output
+                                               dictionary on demand.
         - getOutput(name)         ; Retrieve data from the output dictionary.
+        - timer(stage)            ; Measure the duration of a stage.
+        - getTimings()            ; Retrieve the durations of all stages.
         - Summary()               ; Print a summary of the number of errors
                                     and warnings.
     """
@@ -72,6 +83,8 @@ class Output() :
                              defined in the configuration file.
             - _errors     ; Initialised to 0.
             - _warnings   ; Initialised to 0.
+            - _deferred   ; Initialised to an empty list.
+            - _timings    ; Initialised to an empty ordered dictionary.
 
         @arg instance: The filename of the module that created this object
         @type instance: unicode
@@ -83,8 +96,33 @@ class Output() :
                                   encoding='utf-8')
         self._errors = 0
         self._warnings = 0
+        self._deferred = []
+        self._timings = collections.OrderedDict()
     #__init__
 
+    def _resolve(self, name=None):
+        """
+        Call the deferred functions adding output with the specified name, or
+        all deferred functions that may add messages if no name is given.
+
+        Private variables (altered):
+            - _deferred ; The called functions are removed.
+
+        @kwarg name: Name of a node in the output dictionary
+        @type name: unicode
+        """
+        while True:
+            for i, (names, function, messages) in enumerate(self._deferred):
+                if (messages if name is None else name in names):
+                    # Remove it first, the function may retrieve output
+                    # itself.
+                    del self._deferred[i]
+                    function()
+                    break
+            else:
+                return
+    #_resolve
+
     def addMessage(self, filename, level, code, description) :
         """
         Add a message to the message list.
@@ -139,6 +177,7 @@ class Output() :
         @return: A list of messages
         @rtype: list
         """
+        self._resolve()
         return filter(lambda m: m.level >= settings.OUTPUT_LEVEL,
                       self._messages)
     #getMessages
@@ -156,6 +195,7 @@ class Output() :
         @return: A filtered list
         @rtype: list
         """
+        self._resolve()
         return filter(lambda m: m.code == errorcode, self._messages)
     #getMessagesWithErrorCode
 
@@ -173,6 +213,7 @@ class Output() :
         @return: list of Messages
         @rtype: list
         """
+        self._resolve()
         ret = []
         lastorigin = ""
         for i in self._messages:
@@ -208,6 +249,29 @@ class Output() :
             self._outputData[name] = [data]
     #addOutput
 
+    def addDeferredOutput(self, names, function, messages=True) :
+        """
+        Register a function that adds output to the output dictionary, to be
+        called only when this output is needed.
+
+        The function is called the first time output with one of the
+        specified names is retrieved. If it may also add messages, it is
+        called as well when messages or the summary are retrieved.
+
+        Private variables (altered):
+            - _deferred ; The function is added.
+
+        @arg names: Names of the nodes in the output dictionary the function
+            adds data to
+        @type names: list(unicode)
+        @arg function: Function to call without arguments
+        @type function: callable
+        @kwarg messages: Whether the function may add messages
+        @type messages: bool
+        """
+        self._deferred.append((frozenset(names), function, messages))
+    #addDeferredOutput
+
     def getOutput(self, name) :
         """
         Return a list of data from the output dictionary.
@@ -221,6 +285,7 @@ class Output() :
         @return: output dictionary
         @rtype: dictionary
         """
+        self._resolve(name)
         if self._outputData.has_key(name) :
             return self._outputData[name]
         return []
@@ -243,12 +308,66 @@ class Output() :
         @return: The requested element or None
         @rtype: any type
         """
+        self._resolve(name)
         if self._outputData.has_key(name) :
             if 0 <= index < len(self._outputData[name]) :
                 return self._outputData[name][index]
         return default
     #getIndexedOutput
 
+    def timer(self, stage) :
+        """
+        Measure the duration of a stage, to be used as context manager:
+
+            with output.timer('parse'):
+                ...
+
+        Durations of the same stage are added up. Stages may be nested, e.g.,
+        'check-record' is part of 'process-variant'. Nothing is measured
+        unless the STAGE_TIMINGS setting is enabled.
+
+        @arg stage: Name of the stage.
+        @type stage: unicode
+
+        @return: Context manager.
+        @rtype: object
+        """
+        if not settings.STAGE_TIMINGS :
+            return _NO_TIMER
+        return _Timer(self, stage)
+    #timer
+
+    def addTiming(self, stage, seconds) :
+        """
+        Add the duration of a stage. It is also added to the latency
+        histogram of the stage (see stats.get_histogram).
+
+        Private variables (altered):
+            - _timings ; The durations of stages.
+
+        @arg stage: Name of the stage.
+        @type stage: unicode
+        @arg seconds: Duration (in seconds).
+        @type seconds: float
+        """
+        self._timings[stage] = self._timings.get(stage, 0) + seconds
+        stats.observe_latency('stage/%s' % stage, seconds)
+    #addTiming
+
+    def getTimings(self) :
+        """
+        Return the durations of all stages measured so far, in the order in
+        which they were first measured.
+
+        Private variables:
+            - _timings ; The durations of stages.
+
+        @return: List of tuples (stage, seconds).
+        @rtype: list
+        """
+        return self._timings.items()
+    #getTimings
+
     def Summary(self) :
         """
         Print a summary of the number of errors and warnings.
@@ -264,6 +383,7 @@ class Output() :
                 - Summary
         @rtype: integer, integer, unicode
         """
+        self._resolve()
         e_s = 's'
         w_s = 's'
         if self._errors == 1 :
@@ -276,6 +396,40 @@ class Output() :
     #Summary
 #Output
 
+class _Timer(object) :
+    """
+    Context manager adding its duration to an output object.
+    """
+    def __init__(self, output, stage) :
+        self._output = output
+        self._stage = stage
+        self._start = None
+
+    def __enter__(self) :
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info) :
+        self._output.addTiming(self._stage, time.time() - self._start)
+        return False
+#_Timer
+
+
+class _NoTimer(object) :
+    """
+    Context manager that does nothing, used if stage timings are disabled.
+    """
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc_info) :
+        return False
+#_NoTimer
+
+
+_NO_TIMER = _NoTimer()
+
+
 class Message() :
     """
     Container class for message variables.
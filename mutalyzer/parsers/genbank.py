@@ -6,16 +6,19 @@ mutalyzer GenRecord. Record populated with data from a GenBank file.
 
 from __future__ import unicode_literals
 
+import bisect
 import codecs
 import re
-import bz2
+from collections import Counter
 from itertools import izip_longest
 
 from Bio import SeqIO
 from Bio.Alphabet import ProteinAlphabet
 
+from .. import compression
 from .. import ncbi
 from ..GenRecord import PList, Locus, Gene, Record
+from . import genbank_fast
 
 
 # Regular expression used to find version number in locus tag
@@ -281,24 +284,53 @@ class GBparser():
         @type tagName: unicode
         """
 
-        tags = []
-        for i in locusList : # Gather all the tags.
-            tags.append(getattr(i, tagName))
-
-        badTags = []
-        for i in locusList : # Collect the tags that can not be used.
-            myTag = getattr(i, tagName)
-            numberOfTags = tags.count(myTag)
-            if numberOfTags > 1 :
-                badTags.append(myTag)
-        #for
+        # Count all the tags.
+        counts = Counter(getattr(i, tagName) for i in locusList)
 
         for i in locusList : # Remove unusable tags.
-            if getattr(i, tagName) in badTags :
+            if counts[getattr(i, tagName)] > 1 :
                 setattr(i, tagName, None)
         #for
     #__checkTags
 
+    def __mrnaPositions(self, mrna):
+        """
+        The positions of an mRNA locus used for matching it to a CDS.
+
+        @arg mrna: An mRNA locus
+        @type mrna: object
+
+        @return: List of splice sites (or just the start and end)
+        @rtype: list
+        """
+        mrnaList = mrna.positionList
+        if not mrnaList :
+            mrnaList = mrna.location
+        if not mrnaList :
+            # If the mRNA doesn't have exact positions (e.g., it's annotated
+            # at `join(<1..11,214..548,851..4143)`), we still want to use the
+            # part that is in this reference for matching.
+            mrnaList = self.__location2posList(mrna.original_location,
+                                               require_exact=False)
+        return mrnaList
+    #__mrnaPositions
+
+    def __cdsPositions(self, cds):
+        """
+        The positions of a CDS locus used for matching it to an mRNA.
+
+        @arg cds: A CDS locus
+        @type cds: object
+
+        @return: CDS list (including internal splice sites)
+        @rtype: list
+        """
+        cdsList = cds.positionList
+        if not cdsList :
+            cdsList = cds.location
+        return cdsList
+    #__cdsPositions
+
     def __matchByRange(self, mrna, cds):
         """
         Match the mRNA list to the CDS list.
@@ -319,19 +351,8 @@ class GBparser():
         if not cds or not mrna :
             return 0          # No information -> Don't know.
 
-        mrnaList = mrna.positionList
-        if not mrnaList :
-            mrnaList = mrna.location
-        if not mrnaList :
-            # If the mRNA doesn't have exact positions (e.g., it's annotated
-            # at `join(<1..11,214..548,851..4143)`), we still want to use the
-            # part that is in this reference for matching.
-            mrnaList = self.__location2posList(mrna.original_location,
-                                               require_exact=False)
-
-        cdsList = cds.positionList
-        if not cdsList :
-            cdsList = cds.location
+        mrnaList = self.__mrnaPositions(mrna)
+        cdsList = self.__cdsPositions(cds)
 
         if not cdsList or not mrnaList :
             return 0          # No information -> Don't know.
@@ -407,62 +428,100 @@ class GBparser():
         self.__checkTags(rnaList, "productTag")
         self.__checkTags(cdsList, "productTag")
 
+        # After pruning, the tags of the CDS loci are unique, so we can look
+        # them up directly.
+        cdsByTag = {}
+        for tagName in "proteinLink", "locus_tag", "productTag" :
+            cdsByTag[tagName] = dict((getattr(j, tagName), j)
+                                     for j in cdsList if getattr(j, tagName))
+
         for i in rnaList :
             i.link = None
             i.linkMethod = None
-            # Try first to link via the proteinLink tag.
-            for j in cdsList :
-                if self.link_via_attribute(i, j, 'proteinLink', 'protein'):
+            # Try first to link via the proteinLink tag, next via the locus
+            # tag and finally via the productTag.
+            for tagName, method in (("proteinLink", "protein"),
+                                    ("locus_tag", "locus"),
+                                    ("productTag", "product")) :
+                j = cdsByTag[tagName].get(getattr(i, tagName))
+                if j and self.link_via_attribute(i, j, tagName, method):
                     break
-            if not i.link:
-                # Try to link next via the locus tag.
-                for j in cdsList:
-                    if self.link_via_attribute(i, j, 'locus_tag', 'locus'):
-                        break
-            if not i.link:
-                # Try finally to link via the productTag.
-                for j in cdsList:
-                    if self.link_via_attribute(i, j, 'productTag', 'product'):
-                        break
+            #for
+        #for
+
+        # Only CDS loci within the range of an mRNA can be matched to it, so
+        # we index them on their start positions.
+        cdsRanges = []
+        for j in cdsList :
+            cdsPositions = self.__cdsPositions(j)
+            if cdsPositions :
+                cdsRanges.append((cdsPositions[0], cdsPositions[-1], j))
+        cdsRanges.sort(key=lambda r: r[:2])
+        cdsStarts = [r[0] for r in cdsRanges]
 
         # Now look if there is only one possibility left.
         # One *could* also do exhaustion per matched range...
         for i in rnaList :
             if not i.link :
+                mrnaPositions = self.__mrnaPositions(i)
+                if not mrnaPositions :
+                    continue
+                first = bisect.bisect_left(cdsStarts, mrnaPositions[0])
+                last = bisect.bisect_right(cdsStarts, mrnaPositions[-1])
+
                 leftOverCount = 0
-                leftOverTranscript = None
                 leftOverProtein = None
-                for j in cdsList :
-                    if self.__matchByRange(i, j) > 0 and not j.linked :
+                for _, end, j in cdsRanges[first:last] :
+                    if end <= mrnaPositions[-1] and not j.linked and \
+                       self.__matchByRange(i, j) > 0 :
                         leftOverCount += 1
-                        leftOverTranscript = i
                         leftOverProtein = j
+                        if leftOverCount > 1 :
+                            break
                     #if
                 #for
                 if leftOverCount == 1 :
-                    leftOverTranscript.link = leftOverProtein
-                    leftOverTranscript.linkMethod = "exhaustion"
+                    i.link = leftOverProtein
+                    i.linkMethod = "exhaustion"
                     leftOverProtein.linked = True
                 #if
             #if
         #for
     #link
 
-    def create_record(self, filename):
+    def create_record(self, filename, fast=True):
         """
         Create a GenRecord.Record from a GenBank file
 
+        By default, the file is read with a fast reader for the parts of the
+        GenBank format we use (see :mod:`mutalyzer.parsers.genbank_fast`).
+        Files this reader does not support are read with BioPython.
+
         @arg filename: The full path to the compressed GenBank file
         @type filename: unicode
+        @arg fast: Use the fast reader if possible, otherwise always read the
+            file with BioPython (e.g., to validate it).
+        @type fast: bool
 
         @return: A GenRecord.Record instance
         @rtype: object (record)
         """
-        # first create an intermediate genbank record with BioPython
-        file_handle = bz2.BZ2File(filename, "r")
-        file_handle = codecs.getreader('utf-8')(file_handle)
-        biorecord = SeqIO.read(file_handle, "genbank")
-        file_handle.close()
+        biorecord = None
+        if fast:
+            file_handle = compression.open_file(filename)
+            try:
+                biorecord = genbank_fast.read(file_handle.read())
+            except genbank_fast.UnsupportedRecord:
+                pass
+            finally:
+                file_handle.close()
+
+        if biorecord is None:
+            # first create an intermediate genbank record with BioPython
+            file_handle = compression.open_file(filename)
+            file_handle = codecs.getreader('utf-8')(file_handle)
+            biorecord = SeqIO.read(file_handle, "genbank")
+            file_handle.close()
 
         record = Record()
         record.seq = biorecord.seq
@@ -684,6 +743,7 @@ class GBparser():
         # Discard genes for which we haven't constructed any transcripts.
         record.geneList = [gene for gene in record.geneList
                            if gene.transcriptList]
+        record.index()
         return record
     #create_record
 #GBparser
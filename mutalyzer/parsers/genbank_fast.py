@@ -0,0 +1,310 @@
+"""
+Fast reader for the subset of the GenBank flat file format used by the
+GenBank parser.
+
+Only the LOCUS, ACCESSION, VERSION and ORGANISM header lines are read, and
+only the source, gene, RNA, CDS and exon features are parsed. Of their
+qualifiers, only the values of those in `QUALIFIERS` are kept. The sequence is
+kept as raw bytes and only converted when it is accessed.
+
+The result mimics the parts of a BioPython `SeqRecord` the GenBank parser
+uses. Feature locations are BioPython location objects equal to what
+BioPython would give us.
+
+Files using features of the format that are not supported here (e.g.,
+protein records, remote locations, or records without sequence) are
+rejected with :class:`UnsupportedRecord` and should be read with BioPython
+instead.
+"""
+
+
+from __future__ import unicode_literals
+
+from itertools import islice
+import re
+
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+from Bio.SeqFeature import (AfterPosition, BeforePosition, CompoundLocation,
+                            ExactPosition, FeatureLocation)
+
+
+#: Feature types that are parsed, all others are skipped.
+FEATURE_TYPES = frozenset(['source', 'gene', 'mRNA', 'misc_RNA', 'ncRNA',
+                           'rRNA', 'tRNA', 'tmRNA', 'CDS', 'exon'])
+
+#: Qualifiers for which the values are kept. Other qualifiers are present
+#: in the qualifiers dictionary with an empty list of values.
+QUALIFIERS = frozenset(['gene', 'locus_tag', 'transcript_id', 'protein_id',
+                        'product', 'transl_table', 'mol_type', 'organelle'])
+
+HEADER_INDENT = 12
+HEADER_SPACER = ' ' * HEADER_INDENT
+QUALIFIER_INDENT = 21
+QUALIFIER_SPACER = ' ' * QUALIFIER_INDENT
+
+# Simple location or one part of a join, e.g. `123..456`, `<1..>99`, `5`.
+LOCATION_PART = re.compile(r'^([<>]?)(\d+)(?:\.\.([<>]?)(\d+))?$')
+
+POSITIONS = {'': ExactPosition, '<': BeforePosition, '>': AfterPosition}
+
+# Characters to remove from the lines of the sequence section.
+SEQUENCE_JUNK = b'0123456789 \t\r\n'
+
+
+class UnsupportedRecord(Exception):
+    """
+    Raised when a file cannot be read by this reader.
+    """
+    pass
+
+
+class Feature(object):
+    """
+    A feature from the feature table, similar to a BioPython `SeqFeature`.
+    """
+    def __init__(self, type, location, qualifiers):
+        self.type = type
+        self.location = location
+        self.qualifiers = qualifiers
+        self.ref = None
+
+    @property
+    def strand(self):
+        return self.location.strand
+
+
+class GenBankRecord(object):
+    """
+    A GenBank record, similar to a BioPython `SeqRecord`.
+
+    The sequence is converted from the raw sequence section on first access.
+    """
+    def __init__(self, id, annotations, features, origin):
+        self.id = id
+        self.annotations = annotations
+        self.features = features
+        self._origin = origin
+        self._seq = None
+
+    @property
+    def seq(self):
+        if self._seq is None:
+            self._seq = Seq(
+                self._origin.translate(None, SEQUENCE_JUNK).upper(),
+                IUPAC.ambiguous_dna)
+            self._origin = None
+        return self._seq
+
+
+def _position(fuzziness, value, offset=0):
+    return POSITIONS[fuzziness](int(value) + offset)
+
+
+def _location_part(part, strand):
+    """
+    Parse a simple location.
+    """
+    match = LOCATION_PART.match(part)
+    if not match:
+        raise UnsupportedRecord('Unsupported location: %s' % part)
+
+    start_fuzziness, start, end_fuzziness, end = match.groups()
+    if end is None:
+        # Single base location, e.g. `123`.
+        end_fuzziness, end = start_fuzziness, start
+    if int(start) > int(end):
+        # Features spanning the origin are fixed by BioPython.
+        raise UnsupportedRecord('Unsupported location: %s' % part)
+
+    return FeatureLocation(_position(start_fuzziness, start, -1),
+                           _position(end_fuzziness, end), strand)
+
+
+def _location(location):
+    """
+    Parse a feature location into a BioPython location object.
+    """
+    strand = 1
+    if location.startswith('complement(') and location.endswith(')'):
+        location = location[11:-1]
+        strand = -1
+
+    if location.startswith('join(') and location.endswith(')'):
+        parts = [_location_part(part, strand)
+                 for part in location[5:-1].split(',')]
+        if len(parts) < 2:
+            raise UnsupportedRecord('Unsupported location: %s' % location)
+        if strand == -1:
+            # Parts of complement(join(...)) are in reverse order.
+            parts.reverse()
+        return CompoundLocation(parts, operator='join')
+
+    return _location_part(location, strand)
+
+
+def _feature(type, lines):
+    """
+    Parse a feature from its lines (without indentation).
+
+    This follows `Bio.GenBank.Scanner.InsdcScanner.parse_feature` and
+    `Bio.GenBank._FeatureConsumer.feature_qualifier`.
+    """
+    lines = iter([line for line in lines if line])
+
+    try:
+        location = next(lines)
+        while location.endswith(','):
+            location += next(lines)
+    except StopIteration:
+        raise UnsupportedRecord('Missing location for %s feature' % type)
+    if location.count('(') != location.count(')'):
+        raise UnsupportedRecord('Unsupported location: %s' % location)
+
+    qualifiers = {}
+    for line in lines:
+        if not line.startswith('/'):
+            # Continuation of an unquoted value.
+            raise UnsupportedRecord('Unsupported qualifier: %s' % line)
+
+        key, equals, value = line[1:].partition('=')
+        if value.startswith('"') and value != '"':
+            values = [value]
+            try:
+                while values[-1][-1] != '"':
+                    values.append(next(lines))
+            except StopIteration:
+                raise UnsupportedRecord('Unterminated qualifier: %s' % key)
+            value = ' '.join(values)
+
+        if key not in qualifiers:
+            qualifiers[key] = []
+        if key not in QUALIFIERS:
+            continue
+
+        if not equals:
+            # Qualifier without value, e.g. `/pseudo`.
+            if not qualifiers[key]:
+                qualifiers[key].append('')
+            continue
+
+        value = value[1:] if value.startswith('"') else value
+        value = value[:-1] if value.endswith('"') else value
+        qualifiers[key].append(value.replace('""', '"'))
+
+    return Feature(type, _location(location), qualifiers)
+
+
+def _features(lines):
+    """
+    Parse the feature table.
+    """
+    features = []
+    type = None
+    feature_lines = []
+
+    for line in lines:
+        line = line.rstrip()
+        if line and not line.startswith(' '):
+            # End of the feature table (e.g., BASE COUNT).
+            break
+        if line.startswith(QUALIFIER_SPACER) or not line:
+            if type is not None:
+                feature_lines.append(line[QUALIFIER_INDENT:].strip())
+            continue
+
+        if type is not None:
+            features.append(_feature(type, feature_lines))
+
+        if len(line) <= QUALIFIER_INDENT or line[QUALIFIER_INDENT] == ' ':
+            raise UnsupportedRecord('Unsupported feature line: %s' % line)
+
+        type = line[:QUALIFIER_INDENT].strip()
+        if type in FEATURE_TYPES:
+            feature_lines = [line[QUALIFIER_INDENT:].strip()]
+        else:
+            type = None
+
+    if type is not None:
+        features.append(_feature(type, feature_lines))
+
+    return features
+
+
+def read(data):
+    """
+    Read a GenBank record.
+
+    :arg bytes data: Content of the GenBank file (UTF-8 encoded).
+
+    :returns: The record.
+    :rtype: GenBankRecord
+
+    :raises UnsupportedRecord: If the file uses parts of the format that are
+      not supported.
+    """
+    origin = data.find(b'\nORIGIN')
+    end = data.find(b'\n//', origin)
+    if origin < 0 or end < 0:
+        raise UnsupportedRecord('No sequence')
+
+    # Only the header and feature table are decoded, the sequence is kept as
+    # it is.
+    lines = data[:origin].decode('utf-8').split('\n')
+    sequence = data[data.find(b'\n', origin + 1):end]
+    if not re.search(b'[A-Za-z]', sequence):
+        raise UnsupportedRecord('No sequence')
+
+    locus = lines[0].split()
+    if (len(locus) < 5 or locus[0] != 'LOCUS' or locus[3] != 'bp' or
+            not ('DNA' in locus[4].upper() or 'MRNA' in locus[4].upper())):
+        raise UnsupportedRecord('Unsupported sequence type')
+
+    accessions = []
+    version = None
+    annotations = {}
+
+    for i, line in enumerate(lines):
+        if line.startswith('FEATURES'):
+            break
+        if line.startswith(HEADER_SPACER):
+            continue
+
+        keyword = line[:HEADER_INDENT].strip()
+        content = line[HEADER_INDENT:].strip()
+
+        if keyword == 'ACCESSION':
+            for continuation in islice(lines, i + 1, None):
+                if not continuation.startswith(HEADER_SPACER):
+                    break
+                content += ' ' + continuation.strip()
+            accessions = content.split()
+        elif keyword == 'VERSION':
+            version = content.split()[0] if content else None
+        elif keyword == 'ORGANISM':
+            # Long organism names may be wrapped, the lineage is recognised
+            # by the presence of semicolons.
+            for continuation in islice(lines, i + 1, None):
+                if (not continuation.startswith(HEADER_SPACER) or
+                        ';' in continuation):
+                    break
+                if continuation.strip() != '.':
+                    content += ' ' + continuation.strip()
+            annotations['organism'] = content
+    else:
+        raise UnsupportedRecord('No feature table')
+
+    if not accessions:
+        raise UnsupportedRecord('No accession')
+    annotations['accessions'] = accessions
+
+    id = accessions[0]
+    if version is not None:
+        accession, _, suffix = version.partition('.')
+        if accession == id and suffix.isdigit():
+            id = version
+        else:
+            raise UnsupportedRecord('Unsupported version: %s' % version)
+
+    features = _features(islice(lines, i + 1, None))
+    return GenBankRecord(id, annotations, features, sequence)
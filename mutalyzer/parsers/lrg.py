@@ -16,46 +16,45 @@ More information on LRG files:
     http://ftp.ebi.ac.uk/pub/databases/lrgex/LRG.rnc
     http://ftp.ebi.ac.uk/pub/databases/lrgex/docs/LRG.pdf
 
-This module is based on the result of the minidom xml parser.
-
-NOTE: A strong alternative to the minidom parser would be lxml, which is
-already employed by Mutalyzer in other circumstances.
+The file is parsed incrementally in a single pass (with the `iterparse`
+interface of lxml) and parts of the document we are done with are discarded
+immediately, so we never build a tree of the entire file.
 """
 
 
 from __future__ import unicode_literals
 
-import xml.dom.minidom
+import io
+
 from Bio.Seq import Seq
 from Bio.Alphabet import IUPAC
+from lxml import etree
 
 from mutalyzer import GenRecord
 
 
-def _get_content(data, refname):
+def _text(element):
     """
-    Return string-content of an XML textnode.
+    Return the text content of an XML element.
 
-    @arg data:     a minidom object
-    @type data:    object
-    @arg refname:  the name of a member of the minidom object
-    @type refname: unicode
+    @arg element: an lxml element or None
+    @type element: object
 
-    @return: The content of the textnode or an emtpy string
-    @rtype: string
+    @return: The text content of the element or an empty string
+    @rtype: unicode
     """
-    temp = data.getElementsByTagName(refname)
-    if temp:
-        return temp[0].lastChild.data
-    return ""
-#_get_content
+    if element is None or element.text is None:
+        return ""
+    # For ASCII content, lxml gives us byte strings.
+    return unicode(element.text)
+#_text
 
 
 def _attr2dict(attr):
     """
     Create a dictionary from the attributes of an XML node
 
-    @arg attr: a minidom node
+    @arg attr: the attributes of an lxml element
     @type attr: object
 
     @return: A dictionary with pairing of node-attribute names and values.
@@ -64,9 +63,10 @@ def _attr2dict(attr):
     """
     ret = {}
     for key, value in attr.items():
+        value = unicode(value)
         if value.isdigit():
             value = int(value)
-        ret[key] = value
+        ret[unicode(key)] = value
     return ret
 #_attr2dict
 
@@ -79,9 +79,8 @@ def _get_coordinates(data, system=None):
     defined.
     """
     result = None
-    coordinates = data.getElementsByTagName('coordinates')
-    for coordinate in coordinates:
-        attributes = _attr2dict(coordinate.attributes)
+    for coordinate in data.iter('coordinates'):
+        attributes = _attr2dict(coordinate.attrib)
         if result and system and attributes.get('coord_system') != system:
             continue
         result = attributes
@@ -89,9 +88,10 @@ def _get_coordinates(data, system=None):
 #_get_coordinates
 
 
-def _get_gene_name(section):
+def _get_gene_name(annotation_set):
     """
-    Extract the gene name from the LRG record updatable section.
+    Extract the gene name from an annotation set in the LRG record updatable
+    section.
 
     NOTE: It is necessary to use the updatable section since there is no
     other way to identify the main gene directly from the LRG file.
@@ -99,98 +99,94 @@ def _get_gene_name(section):
     Another way would be to make use of the special file with genes to LRG:
     http://ftp.ebi.ac.uk/pub/databases/lrgex/list_LRGs_transcripts_GRCh38.txt
 
-    :param section: (updatable) section of the LRG file
-    :return: gene name present under the lrg annotation set
+    :param annotation_set: annotation set of the updatable section
+    :return: gene name present under the lrg annotation set, or None for
+      other annotation sets
     """
-    gene_name = ""
-    annotation_nodes = section.getElementsByTagName("annotation_set")
-    for anno in annotation_nodes:
-        if anno.getAttribute("type") == "lrg":
-            gene_name = _get_content(anno, "lrg_locus")
-    return gene_name
+    if annotation_set.get("type") == "lrg":
+        return _text(next(annotation_set.iter("lrg_locus"), None))
+    return None
 #_get_gene_name
 
 
-def _get_transcripts(section):
+def _get_transcript(tdata, lrg_id):
     """
-    Extracts the transcripts present in the (fixed) section of the LRG file.
+    Extracts a transcript from the (fixed) section of the LRG file.
 
-    :param section: (fixed) section of the LRG file
-    :return: list of transcripts (GenRecord.Locus)
+    :param tdata: transcript element of the (fixed) section of the LRG file
+    :param lrg_id: identifier of the LRG (used as coordinate system)
+    :return: the transcript (GenRecord.Locus)
     """
-    lrg_id = _get_content(section, 'id')
-
-    transcripts = []
-    for tdata in section.getElementsByTagName("transcript"):
-        # iterate over the transcripts in the fixed section.
-        # get the transcript from the updatable section and combine results
-        transcript_name = tdata.getAttribute("name")[1:]
-        transcription = GenRecord.Locus(transcript_name)
-
-        coordinates = tdata.getElementsByTagName('coordinates')[0]
-
-        # Set the locusTag, linkMethod (used in the output) and the location
-        # LRG file transcripts can (for now) always be linked via the locustag
-        transcription.locusTag = transcript_name and "t" + transcript_name
-        transcription.linkMethod = "Locus Tag"
-        transcription.location = [int(coordinates.getAttribute("start")),
-                                  int(coordinates.getAttribute("end"))]
-
-        # Get the transcript exons and store them in a position list.
-        exonPList = GenRecord.PList()
-        for exon in tdata.getElementsByTagName("exon"):
-            coordinates = _get_coordinates(exon, lrg_id)
-            exonPList.positionList.extend([int(coordinates["start"]),
-                                           int(coordinates["end"])])
-        exonPList.positionList.sort()
-
-        # Get the CDS of the transcript and store them in a position list.
-        # NOTE: up until now all CDSlists only consisted of a starting end
-        # ending position, keep the possibility in mind that multiple CDS
-        # regions are given
-        CDSPList = GenRecord.PList()
-        for cds_id, CDS in enumerate(tdata.getElementsByTagName("coding_region")):
-            if cds_id > 0:
-                # Todo: For now, we only support one CDS per transcript and
-                #   ignore all others.
-                #   By the way, I don't think the loop and sorting of CDS
-                #   positions makes any sense here, but I leave it in place
-                #   and just ignore everything except the first iteration.
-                #translationName = CDS.getElementsByTagName("translation")[0].getAttribute("name").encode("utf8")[1:]
-                #print 'Ignoring transcript %s translation %s' % (transcript_name, translationName)
-                continue
-            coordinates = _get_coordinates(CDS, lrg_id)
-            CDSPList.positionList.extend([int(coordinates["start"]),
-                                          int(coordinates["end"])])
+    transcript_name = unicode(tdata.get("name"))[1:]
+    transcription = GenRecord.Locus(transcript_name)
+
+    coordinates = next(tdata.iter('coordinates'))
+
+    # Set the locusTag, linkMethod (used in the output) and the location
+    # LRG file transcripts can (for now) always be linked via the locustag
+    transcription.locusTag = transcript_name and "t" + transcript_name
+    transcription.linkMethod = "Locus Tag"
+    transcription.location = [int(coordinates.get("start")),
+                              int(coordinates.get("end"))]
+
+    # Get the transcript exons and store them in a position list.
+    exonPList = GenRecord.PList()
+    for exon in tdata.iter("exon"):
+        coordinates = _get_coordinates(exon, lrg_id)
+        exonPList.positionList.extend([int(coordinates["start"]),
+                                       int(coordinates["end"])])
+    exonPList.positionList.sort()
+
+    # Get the CDS of the transcript and store them in a position list.
+    # NOTE: up until now all CDSlists only consisted of a starting end
+    # ending position, keep the possibility in mind that multiple CDS
+    # regions are given
+    CDSPList = GenRecord.PList()
+    coding_regions = list(tdata.iter("coding_region"))
+    if coding_regions:
+        # Todo: For now, we only support one CDS per transcript and ignore
+        #   all others.
+        coordinates = _get_coordinates(coding_regions[0], lrg_id)
+        CDSPList.positionList.extend([int(coordinates["start"]),
+                                      int(coordinates["end"])])
         CDSPList.positionList.sort()
 
-        # If there is a CDS position List set the transcriptflag to True
-        if CDSPList.positionList:
-            transcription.molType = 'c'
-            CDSPList.location = [CDSPList.positionList[0],
-                                 CDSPList.positionList[-1]]
-            # If we only got the flanking CDS positions, we clear it and let
-            # GenRecord.checkRecord reconstruct the correct CDS list
-            # from the mRNA list later on
-            if len(CDSPList.positionList) == 2:
-                CDSPList.positionList = []
-            transcription.translate = True
-        else:
-            transcription.molType = 'n'
-
-        # Note: Not all the transcripts contain a coding_region.
-        if tdata.getElementsByTagName('coding_region'):
-            transcription.transcribe = True
-            # Store CDS position lists in the transcription
-            transcription.CDS = CDSPList
-
-        # Store exon position list in the transcription
-        transcription.exon = exonPList
-
-        # Add the transcription to the transcripts list
-        transcripts.append(transcription)
-    return transcripts
-#_get_transcripts
+    # If there is a CDS position List set the transcriptflag to True
+    if CDSPList.positionList:
+        transcription.molType = 'c'
+        CDSPList.location = [CDSPList.positionList[0],
+                             CDSPList.positionList[-1]]
+        # If we only got the flanking CDS positions, we clear it and let
+        # GenRecord.checkRecord reconstruct the correct CDS list
+        # from the mRNA list later on
+        if len(CDSPList.positionList) == 2:
+            CDSPList.positionList = []
+        transcription.translate = True
+    else:
+        transcription.molType = 'n'
+
+    # Note: Not all the transcripts contain a coding_region.
+    if coding_regions:
+        transcription.transcribe = True
+        # Store CDS position lists in the transcription
+        transcription.CDS = CDSPList
+
+    # Store exon position list in the transcription
+    transcription.exon = exonPList
+
+    return transcription
+#_get_transcript
+
+
+def _discard(element):
+    """
+    Free the memory used by an element and its preceding siblings, which we
+    are done with.
+    """
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+#_discard
 
 
 def create_record(data):
@@ -202,28 +198,72 @@ def create_record(data):
 
     @return: GenRecord.Record instance
     @rtype: object
+
+    @raise lxml.etree.XMLSyntaxError: If the data is not well-formed XML.
     """
     # Initiate the GenRecord.Record
     record = GenRecord.Record()
     record._sourcetype = "LRG"
+    record.molType = 'g'
 
-    # Parse the xml data string and extract the fixed and updatable section
-    data = xml.dom.minidom.parseString(data)
-    fixed = data.getElementsByTagName("fixed_annotation")[0]
-    updatable = data.getElementsByTagName("updatable_annotation")[0]
+    organism = None
+    lrg_id = None
+    sequence = None
+    gene_name = ""
+    transcripts = []
+
+    # The section (fixed_annotation or updatable_annotation) we are in.
+    section = None
+
+    # The genomic sequence can be larger than what lxml allows in a text node
+    # by default.
+    for event, element in etree.iterparse(io.BytesIO(data),
+                                          events=('start', 'end'),
+                                          huge_tree=True):
+        tag = element.tag
+
+        if event == 'start':
+            if tag in ('fixed_annotation', 'updatable_annotation'):
+                section = tag
+            continue
+
+        if tag in ('fixed_annotation', 'updatable_annotation'):
+            section = None
+        elif tag == 'organism':
+            if organism is None:
+                organism = _text(element)
+        elif section == 'fixed_annotation':
+            if tag == 'id':
+                if lrg_id is None:
+                    lrg_id = _text(element)
+            elif tag == 'sequence':
+                # The first sequence is the genomic sequence, the others are
+                # the transcript and protein sequences.
+                if sequence is None:
+                    sequence = _text(element)
+                    _discard(element)
+            elif tag == 'transcript':
+                transcripts.append(_get_transcript(element, lrg_id))
+                _discard(element)
+        elif section == 'updatable_annotation':
+            if tag == 'annotation_set':
+                name = _get_gene_name(element)
+                if name is not None:
+                    gene_name = name
+                _discard(element)
 
     # Get the organism
-    record.organism = _get_content(data, 'organism')
+    record.organism = organism or ""
 
     # Get the sequence from the fixed section
-    record.molType = 'g'
-    record.seq = Seq(_get_content(fixed, "sequence"), IUPAC.unambiguous_dna)
+    record.seq = Seq(sequence or "", IUPAC.unambiguous_dna)
 
     # Get the gene name
-    gene = GenRecord.Gene(_get_gene_name(updatable))
+    gene = GenRecord.Gene(gene_name)
     # Add transcripts information from the fixed section to the main gene.
-    gene.transcriptList = _get_transcripts(fixed)
+    gene.transcriptList = transcripts
     record.geneList = [gene]
+    record.index()
 
     return record
 #create_record
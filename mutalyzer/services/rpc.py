@@ -49,6 +49,20 @@ from mutalyzer.models import *
 from mutalyzer.nc_db import get_entire_nc_record
 
 
+def _stage_timings(output):
+    """
+    Create StageTiming objects for the stage durations in `output`, or `None`
+    if no durations were measured.
+    """
+    timings = []
+    for stage, seconds in output.getTimings():
+        timing = StageTiming()
+        timing.stage = stage
+        timing.seconds = seconds
+        timings.append(timing)
+    return timings or None
+
+
 def create_rpc_fault(output):
     """
     Create an RPC Fault exception from the error message in `output` with the
@@ -924,6 +938,11 @@ class MutalyzerService(ServiceBase):
                 - product
                 - linkMethod
             - messages: List of (error) messages.
+            - timings: If the STAGE_TIMINGS setting is enabled, list of
+                durations of the stages of the name checker, each represented
+                by an object with fields:
+                - stage
+                - seconds
         """
         O = Output(__file__)
         O.addMessage(__file__, -1, "INFO",
@@ -999,6 +1018,8 @@ class MutalyzerService(ServiceBase):
             soap_message.message = message.description
             result.messages.append(soap_message)
 
+        result.timings = _stage_timings(O)
+
         return result
     #runMutalyzer
 
@@ -1046,6 +1067,9 @@ class MutalyzerService(ServiceBase):
                 - product
                 - linkMethod
             - messages: List of (error) messages.
+            - timings: If the STAGE_TIMINGS setting is enabled, list of
+                durations of the stages of the name checker (see
+                runMutalyzer).
             If extras is utilized the following fields are included, according
             to their selection:
                 - original: Original sequence.
@@ -1274,6 +1298,8 @@ class MutalyzerService(ServiceBase):
             soap_message.message = message.description
             result.messages.append(soap_message)
 
+        result.timings = _stage_timings(O)
+
         return result
     #runMutalyzerLight
 
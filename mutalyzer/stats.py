@@ -34,18 +34,31 @@ def increment_counter(counter):
     """
     Increment the specified counter.
     """
+    increment_counters({counter: 1})
+
+
+def increment_counters(amounts):
+    """
+    Increment the specified counters by the specified amounts, using one
+    round trip to Redis.
+
+    :arg dict amounts: Mapping of counters to amounts.
+    """
     pipe = redis.pipeline(transaction=False)
-    pipe.incr('counter:%s:total' % counter)
 
-    for label, bucket, expire in INTERVALS:
-        key = 'counter:%s:%s:%s' % (counter, label,
-                                    unicode(time.strftime(bucket)))
-        pipe.incr(key)
+    for counter, amount in amounts.items():
+        pipe.incr('counter:%s:total' % counter, amount)
+
+        for label, bucket, expire in INTERVALS:
+            key = 'counter:%s:%s:%s' % (counter, label,
+                                        unicode(time.strftime(bucket)))
+            pipe.incr(key, amount)
 
-        # It's safe to just keep on expiring the counter, even if it already
-        # had an expiration, since it is bounded by the current day. We don't
-        # really mind at what time of the day the expiration will be exactly.
-        pipe.expire(key, expire)
+            # It's safe to just keep on expiring the counter, even if it
+            # already had an expiration, since it is bounded by the current
+            # day. We don't really mind at what time of the day the
+            # expiration will be exactly.
+            pipe.expire(key, expire)
 
     pipe.execute()
 
@@ -64,3 +77,57 @@ def get_totals():
 
     return {counter.split(':')[1]: int(value)
             for counter, value in zip(counters, pipe.execute())}
+
+
+def get_total(counter):
+    """
+    Get the total for the specified counter.
+    """
+    return int(redis.get('counter:%s:total' % counter) or 0)
+
+
+#: Upper bounds (in seconds) of the buckets in latency histograms. Latencies
+#: above the last bound are counted in bucket `inf`.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+def observe_latency(histogram, seconds):
+    """
+    Add a latency to the specified histogram.
+    """
+    observe_latencies([(histogram, seconds)])
+
+
+def observe_latencies(latencies):
+    """
+    Add latencies to the specified histograms, using one round trip to Redis.
+
+    :arg list latencies: List of `(histogram, seconds)` tuples.
+    """
+    pipe = redis.pipeline(transaction=False)
+
+    for histogram, seconds in latencies:
+        for bound in LATENCY_BUCKETS:
+            if seconds <= bound:
+                bucket = unicode(bound)
+                break
+        else:
+            bucket = 'inf'
+
+        pipe.hincrby('histogram:%s' % histogram, bucket, 1)
+        pipe.hincrbyfloat('histogram:%s' % histogram, 'sum', seconds)
+
+    pipe.execute()
+
+
+def get_histogram(histogram):
+    """
+    Get the bucket counts of the specified histogram.
+
+    Returns a list of `(bound, count)` tuples ordered by bound, and the total
+    of all latencies added to the histogram.
+    """
+    values = redis.hgetall('histogram:%s' % histogram)
+    buckets = [(bound, int(values.get(unicode(bound), 0)))
+               for bound in LATENCY_BUCKETS + ['inf']]
+    return buckets, float(values.get('sum', 0))
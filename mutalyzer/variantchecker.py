@@ -1,7 +1,8 @@
 """
 The HGVS variant nomenclature checker.
 
-Entrypoint is the check_variant() function.
+Entrypoint is the check_variant() function, or check_variants() for many
+variant descriptions at once.
 
 Notes about naming positions:
 * CDS -> use start/stop
@@ -26,6 +27,7 @@ from Bio.Alphabet import DNAAlphabet
 from Bio.Alphabet import ProteinAlphabet
 from Bio.Alphabet import _verify_alphabet
 
+from mutalyzer import cache
 from mutalyzer import util
 from mutalyzer.db.models import Assembly
 from mutalyzer.grammar import Grammar
@@ -1372,13 +1374,80 @@ def _add_static_transcript_info(transcript, output):
     output.addOutput('transcriptReverse', transcript.CM.orientation == -1)
 
 
-def _add_transcript_info(mutator, transcript, output):
+def _reference_sequence(mutator, record, gene, transcript, name):
+    """
+    Get a sequence of a transcript on the reference sequence.
+
+    The sequence is computed on first use and remembered with the record,
+    which keeps it in the record cache (see cache.add_sequences). So it is
+    computed only once per reference sequence (checksum), transcript and
+    translation table.
+
+    @arg mutator: A Mutator instance.
+    @type mutator: mutalyzer.mutator.Mutator
+    @arg record: A GenRecord object.
+    @type record: Modules.GenRecord.GenRecord
+    @arg gene: The gene of the transcript.
+    @type gene: Modules.GenRecord.Gene
+    @arg transcript: A transcript object.
+    @type transcript: Modules.GenRecord.Locus
+    @arg name: Which sequence to get, one of:
+        - mRNA: The mRNA.
+        - CDS: The CDS in the orientation of the transcript.
+        - protein: The translation of the CDS.
+        - cds_protein: The translation of the CDS as a complete coding
+          sequence (None if it is not).
+    @type name: unicode
+
+    @return: The requested sequence.
+    @rtype: unicode (mRNA) or Bio.Seq.Seq
+    """
+    # The cache is only valid for the reference sequence of the record.
+    cached = mutator.orig is record.record.seq
+    key = gene.name, transcript.name, transcript.txTable
+    sequences = cached and record.record.getSequences(key) or {}
+
+    if name in sequences:
+        return sequences[name]
+
+    if name == 'mRNA':
+        sequence = unicode(util.splice(mutator.orig,
+                                       transcript.mRNA.positionList))
+    elif name == 'CDS':
+        sequence = util.splice(mutator.orig, transcript.CDS.positionList)
+        sequence.alphabet = IUPAC.unambiguous_dna
+        if transcript.CM.orientation == -1:
+            sequence = sequence.reverse_complement()
+    elif name == 'protein':
+        sequence = _reference_sequence(
+            mutator, record, gene, transcript, 'CDS').translate(
+                table=transcript.txTable)
+    else:
+        try:
+            sequence = _reference_sequence(
+                mutator, record, gene, transcript, 'CDS').translate(
+                    table=transcript.txTable, cds=True)
+        except CodonTable.TranslationError:
+            sequence = None
+
+    sequences[name] = sequence
+    if cached:
+        record.record.addSequences(key, sequences)
+    return sequence
+#_reference_sequence
+
+
+def _add_transcript_info(mutator, record, gene, transcript, output):
     """
     Add transcript-specific information (including protein prediction) to
     the {output} object.
 
     @arg mutator: A Mutator instance.
     @type mutator: mutalyzer.mutator.Mutator
+    @arg record: A GenRecord object.
+    @type record: Modules.GenRecord.GenRecord
+    @arg gene: The gene of the transcript.
+    @type gene: Modules.GenRecord.Gene
     @arg transcript: A transcript object.
     @type transcript: Modules.GenRecord.Locus
     @arg output: The Output object.
@@ -1392,7 +1461,7 @@ def _add_transcript_info(mutator, transcript, output):
     if transcript.transcribe:
         output.addOutput('myTranscriptDescription', transcript.description or '=')
         output.addOutput('origMRNA',
-            unicode(util.splice(mutator.orig, transcript.mRNA.positionList)))
+            _reference_sequence(mutator, record, gene, transcript, 'mRNA'))
         output.addOutput('mutatedMRNA',
             unicode(util.splice(mutator.mutated,
                         mutator.shift_sites(transcript.mRNA.positionList))))
@@ -1423,8 +1492,8 @@ def _add_transcript_info(mutator, transcript, output):
         # - oldProteinFancyText, newProteinFancyText, altProteinFancyText:
         #     Versions of the protein sequences formatted for plaintext.
 
-        cds_original = util.splice(mutator.orig, transcript.CDS.positionList)
-        cds_original.alphabet = IUPAC.unambiguous_dna
+        cds_original = _reference_sequence(mutator, record, gene, transcript,
+                                           'CDS')
 
         if not _verify_alphabet(cds_original):
             output.addMessage(__file__, 4, 'ENODNA',
@@ -1438,10 +1507,10 @@ def _add_transcript_info(mutator, transcript, output):
         cds_variant.alphabet = IUPAC.unambiguous_dna
 
         if transcript.CM.orientation == -1:
-            cds_original = cds_original.reverse_complement()
             cds_variant = cds_variant.reverse_complement()
 
-        protein_original = cds_original.translate(table=transcript.txTable)
+        protein_original = _reference_sequence(mutator, record, gene,
+                                               transcript, 'protein')
 
         if not protein_original.endswith('*'):
             output.addMessage(__file__, 3, 'ESTOP',
@@ -1712,7 +1781,8 @@ def process_variant(mutator, description, record, output):
         # Mark this as the current transcript we work with.
         transcript.current = True
 
-    record.checkRecord()
+    with output.timer('check-record'):
+        record.checkRecord()
 
     if transcript and not transcript.transcribe:
         # Todo: Shouldn't we add some message here?
@@ -1772,11 +1842,217 @@ def process_variant(mutator, description, record, output):
 
     # Add transcript-specific variant information.
     if transcript and record.record.geneList:
-        _add_transcript_info(mutator, transcript, output)
+        with output.timer('transcript-info'):
+            _add_transcript_info(mutator, record, gene, transcript, output)
+            cache.add_sequences(record.record)
 #process_variant
 
 
-def check_variant(description, output):
+def _protein_transcripts(record):
+    """
+    Get the transcripts for which the effect of the variant on the protein
+    is predicted. For other transcripts, the protein description is set to
+    'p.?'.
+
+    @arg record: GenRecord instance.
+    @type record: GenRecord.GenRecord
+
+    @return: Tuples of gene and transcript.
+    @rtype: generator
+    """
+    for gene in record.record.geneList:
+        for transcript in gene.transcriptList:
+
+            if not (transcript.CDS and transcript.translate) \
+                   or ';' in transcript.description \
+                   or transcript.description == '?':
+                # Default value is '?', but later on we don't prefix a 'p.'
+                # string, so we include it here. If there's no good reason
+                # for this, I think we should only add the 'p.' later (so
+                # __toProtDescr should also not add it).
+                transcript.proteinDescription = 'p.?'
+                continue
+
+            yield gene, transcript
+#_protein_transcripts
+
+
+def _check_protein_transcripts(mutator, record, output):
+    """
+    Warn about transcripts for which the protein cannot be predicted
+    because the CDS on the reference sequence is not a complete coding
+    sequence.
+
+    These warnings only depend on the reference sequence, so unlike the
+    protein level descriptions, they are cheap to get for all transcripts.
+
+    @arg mutator: Mutator instance with the variant applied.
+    @type mutator: mutator.Mutator
+    @arg record: GenRecord instance.
+    @type record: GenRecord.GenRecord
+    @arg output: An output object.
+    @type output: Modules.Output.Output
+    """
+    for gene, transcript in _protein_transcripts(record):
+        cds_original = _reference_sequence(mutator, record, gene,
+                                           transcript, 'CDS')
+
+        if len(cds_original) % 3:
+            if transcript.current:
+                output.addMessage(__file__, 2, "WCDS", "CDS length is " \
+                    "not a multiple of three in gene %s, transcript " \
+                    "variant %s (selected)." % (gene.name, transcript.name))
+            else:
+                output.addMessage(__file__, 2, "WCDS_OTHER", "CDS length is " \
+                    "not a multiple of three in gene %s, transcript " \
+                    "variant %s." % (gene.name, transcript.name))
+        elif _reference_sequence(mutator, record, gene, transcript,
+                                 'cds_protein') is None:
+            if transcript.current:
+                output.addMessage(
+                    __file__, 2, "WTRANS",
+                    "Original CDS could not be translated in gene "
+                    "%s, transcript variant %s (selected)."
+                    % (gene.name, transcript.name))
+            else:
+                output.addMessage(
+                    __file__, 2, "WTRANS_OTHER",
+                    "Original CDS could not be translated in gene "
+                    "%s, transcript variant %s."
+                    % (gene.name, transcript.name))
+
+    cache.add_sequences(record.record)
+#_check_protein_transcripts
+
+
+def _add_protein_descriptions(mutator, record, reference, descriptions,
+                              output):
+    """
+    Predict the effect of the variant on the protein of all transcripts and
+    add the protein level descriptions to the output.
+
+    This is called by the output object when the protein level descriptions
+    are needed (see check_variant). It adds no messages, the warnings about
+    transcripts without a complete coding sequence are added by
+    _check_protein_transcripts.
+
+    @arg mutator: Mutator instance with the variant applied.
+    @type mutator: mutator.Mutator
+    @arg record: GenRecord instance.
+    @type record: GenRecord.GenRecord
+    @arg reference: Reference sequence accession.
+    @type reference: unicode
+    @arg descriptions: Tuples of gene, transcript, generated description and
+        full description for all transcripts, in the order they should be
+        added to the output.
+    @type descriptions: list(tuple)
+    @arg output: An output object.
+    @type output: Modules.Output.Output
+    """
+    for gene, transcript in _protein_transcripts(record):
+        cds_original = _reference_sequence(mutator, record, gene,
+                                           transcript, 'CDS')
+
+        cds_variant = util.__nsplice(mutator.mutated,
+                                     mutator.shift_sites(transcript.mRNA.positionList),
+                                     mutator.shift_sites(transcript.CDS.location),
+                                     transcript.CM.orientation)
+        cds_variant.alphabet = IUPAC.unambiguous_dna
+
+        if transcript.CM.orientation == -1:
+            cds_variant = cds_variant.reverse_complement()
+
+        #if '*' in cds_original.translate()[:-1]:
+        #    output.addMessage(__file__, 3, "ESTOP",
+        #                      "In frame stop codon found.")
+        #    return
+        ##if
+
+        # Todo: Figure out if this is all ok, even if the CDS stop is
+        # somehow removed, if the sequence is really short, etc.
+
+        if not len(cds_original) % 3:
+            # FIXME this is a bit of a rancid fix.
+            protein_original = _reference_sequence(
+                mutator, record, gene, transcript, 'cds_protein')
+            if protein_original is None:
+                transcript.proteinDescription = 'p.?'
+            else:
+                # Because `cds_variant` might contain additional sequence
+                # after the actual CDS, we cannot use `cds=True` here.
+                # However, we do know that the first codon is a start codon
+                # and hence should translate to M. Which is what happens
+                # with `cds=True`, but not otherwise.
+                # So we manually translate the first codon to M. But only
+                # if it was not affected by the variant.
+                protein_variant = cds_variant.translate(table=transcript.txTable)
+                if protein_variant and unicode(cds_variant[:3]) == unicode(cds_original[:3]):
+                    protein_variant = protein_original[0] + protein_variant[1:]
+
+                    # Up to and including the first '*', or the entire string.
+                    try:
+                        stop = unicode(protein_variant).index('*')
+                        protein_variant = protein_variant[:stop + 1]
+                    except ValueError:
+                        pass
+
+                    try:
+                        cds_length = util.cds_length(
+                            mutator.shift_sites(transcript.CDS.positionList))
+                        transcript.proteinDescription = util.protein_description(
+                            cds_length, unicode(protein_original), unicode(protein_variant))[0]
+                    except IndexError:
+                        # Todo: Probably CDS start was hit by removal of exon..
+                        transcript.proteinDescription = 'p.?'
+
+                else:
+                    # Mutation in start codon.
+                    transcript.proteinDescription = 'p.?'
+
+        else:
+            transcript.proteinDescription = 'p.?'
+
+    cache.add_sequences(record.record)
+
+    for gene, transcript, generated_description, full_description \
+            in descriptions:
+
+        # Note: I don't think genomic_id is ever used, because it is
+        # always ''.
+        coding_description = ''
+        protein_description = ''
+        full_protein_description = ''
+        genomic_id = coding_id = protein_id = ''
+
+        if transcript.molType == 'c':
+            coding_description = 'c.%s' % generated_description
+            protein_description = transcript.proteinDescription
+            if record.record._sourcetype == 'LRG':
+                full_protein_description = '%sp%s:%s' % \
+                                           (reference, transcript.name,
+                                            protein_description)
+            else:
+                full_protein_description = '%s(%s_i%s):%s' % \
+                                           (reference, gene.name,
+                                            transcript.name,
+                                            protein_description)
+
+            coding_id, protein_id = \
+                       transcript.transcriptID, transcript.proteinID
+            output.addOutput('protDescriptions',
+                             full_protein_description)
+
+        # The 'NewDescriptions' field is used in _add_batch_output.
+        output.addOutput('NewDescriptions',
+                         (gene.name, transcript.name,
+                          transcript.molType, coding_description,
+                          protein_description, genomic_id, coding_id,
+                          protein_id, full_description,
+                          full_protein_description))
+#_add_protein_descriptions
+
+
+def check_variant(description, output, records=None):
     """
     Check the variant described by {description} according to the HGVS variant
     nomenclature and populate the {output} object with various information
@@ -1786,6 +2062,13 @@ def check_variant(description, output):
     @type description: string
     @arg output: An output object.
     @type output: Modules.Output.Output
+    @kwarg records: Records retrieved for earlier variant descriptions, as
+        functions creating a copy (see GenRecord.Record.copier) by reference
+        sequence identifier, or for NC records from the chromosomal
+        database by ('NC', part before the colon). Used instead of
+        retrieving the record again and updated with newly retrieved
+        records.
+    @type records: dict
 
     @todo: Documentation.
     @todo: Raise exceptions on failure instead of just return.
@@ -1793,7 +2076,8 @@ def check_variant(description, output):
     output.addOutput('inputvariant', description)
 
     grammar = Grammar(output)
-    parsed_description = grammar.parse(description)
+    with output.timer('parse'):
+        parsed_description = grammar.parse(description)
 
     if not parsed_description:
         # Parsing went wrong.
@@ -1843,16 +2127,35 @@ def check_variant(description, output):
     # It would have taken much more time to leave the previous flow, i.e.,
     # try to get it from the cache, then go to NCBI, and find out that the
     # reference file size is > 10MB.
-    if filetype == 'GB' and 'NC' in record_id:
-        retrieved_record = get_nc_record(record_id, parsed_description, output)
-    else:
-        retrieved_record = None
+    with output.timer('retrieve'):
+        if filetype == 'GB' and 'NC' in record_id:
+            # The part of the chromosome we get only depends on the
+            # transcript selector, unless the variant is described on the
+            # chromosome itself.
+            nc_key = None
+            if records is not None and \
+                   parsed_description.RefType not in ('g', ''):
+                nc_key = 'NC', description.split(':')[0]
+            if nc_key is not None and nc_key in records:
+                retrieved_record = records[nc_key]()
+            else:
+                retrieved_record = get_nc_record(record_id,
+                                                 parsed_description, output)
+                if nc_key is not None and retrieved_record is not None:
+                    records[nc_key] = retrieved_record.copier()
+        else:
+            retrieved_record = None
 
-    if retrieved_record is None:
-        retrieved_record = retriever.loadrecord(record_id)
-    else:
-        # To remove the download link text from the name checker page.
-        filetype = 'GB_NC'
+        if retrieved_record is None:
+            if records is not None and record_id in records:
+                retrieved_record = records[record_id]()
+            else:
+                retrieved_record = retriever.loadrecord(record_id)
+                if records is not None and retrieved_record:
+                    records[record_id] = retrieved_record.copier()
+        else:
+            # To remove the download link text from the name checker page.
+            filetype = 'GB_NC'
 
     if not retrieved_record:
         return
@@ -1906,7 +2209,8 @@ def check_variant(description, output):
     # information about the record, gene, transcript.
 
     try:
-        process_variant(mutator, parsed_description, record, output)
+        with output.timer('process-variant'):
+            process_variant(mutator, parsed_description, record, output)
     except _VariantError:
         return
     finally:
@@ -1960,103 +2264,6 @@ def check_variant(description, output):
                                           util.grouper(chromosomal_positions[2]))))
                     # Example value: ('chr12', [('29+4T>C', (2323, 2323)), ('230_233del', (5342, 5345))])
 
-    # Protein.
-    for gene in record.record.geneList:
-        for transcript in gene.transcriptList:
-
-            if not (transcript.CDS and transcript.translate) \
-                   or ';' in transcript.description \
-                   or transcript.description == '?':
-                # Default value is '?', but later on we don't prefix a 'p.'
-                # string, so we include it here. If there's no good reason
-                # for this, I think we should only add the 'p.' later (so
-                # __toProtDescr should also not add it).
-                transcript.proteinDescription = 'p.?'
-                continue
-
-            cds_original = util.splice(mutator.orig, transcript.CDS.positionList)
-            cds_original.alphabet = IUPAC.unambiguous_dna
-
-            cds_variant = util.__nsplice(mutator.mutated,
-                                         mutator.shift_sites(transcript.mRNA.positionList),
-                                         mutator.shift_sites(transcript.CDS.location),
-                                         transcript.CM.orientation)
-            cds_variant.alphabet = IUPAC.unambiguous_dna
-
-            if transcript.CM.orientation == -1:
-                cds_original = cds_original.reverse_complement()
-                cds_variant = cds_variant.reverse_complement()
-
-            #if '*' in cds_original.translate()[:-1]:
-            #    output.addMessage(__file__, 3, "ESTOP",
-            #                      "In frame stop codon found.")
-            #    return
-            ##if
-
-            # Todo: Figure out if this is all ok, even if the CDS stop is
-            # somehow removed, if the sequence is really short, etc.
-
-            if not len(cds_original) % 3:
-                try:
-                    # FIXME this is a bit of a rancid fix.
-                    protein_original = cds_original.translate(table=transcript.txTable, cds=True)
-                except CodonTable.TranslationError:
-                    if transcript.current:
-                        output.addMessage(
-                            __file__, 2, "WTRANS",
-                            "Original CDS could not be translated in gene "
-                            "%s, transcript variant %s (selected)."
-                            % (gene.name, transcript.name))
-                    else:
-                        output.addMessage(
-                            __file__, 2, "WTRANS_OTHER",
-                            "Original CDS could not be translated in gene "
-                            "%s, transcript variant %s."
-                            % (gene.name, transcript.name))
-                    transcript.proteinDescription = 'p.?'
-                else:
-                    # Because `cds_variant` might contain additional sequence
-                    # after the actual CDS, we cannot use `cds=True` here.
-                    # However, we do know that the first codon is a start codon
-                    # and hence should translate to M. Which is what happens
-                    # with `cds=True`, but not otherwise.
-                    # So we manually translate the first codon to M. But only
-                    # if it was not affected by the variant.
-                    protein_variant = cds_variant.translate(table=transcript.txTable)
-                    if protein_variant and unicode(cds_variant[:3]) == unicode(cds_original[:3]):
-                        protein_variant = protein_original[0] + protein_variant[1:]
-
-                        # Up to and including the first '*', or the entire string.
-                        try:
-                            stop = unicode(protein_variant).index('*')
-                            protein_variant = protein_variant[:stop + 1]
-                        except ValueError:
-                            pass
-
-                        try:
-                            cds_length = util.cds_length(
-                                mutator.shift_sites(transcript.CDS.positionList))
-                            transcript.proteinDescription = util.protein_description(
-                                cds_length, unicode(protein_original), unicode(protein_variant))[0]
-                        except IndexError:
-                            # Todo: Probably CDS start was hit by removal of exon..
-                            transcript.proteinDescription = 'p.?'
-
-                    else:
-                        # Mutation in start codon.
-                        transcript.proteinDescription = 'p.?'
-
-            else:
-                if transcript.current:
-                    output.addMessage(__file__, 2, "WCDS", "CDS length is " \
-                        "not a multiple of three in gene %s, transcript " \
-                        "variant %s (selected)." % (gene.name, transcript.name))
-                else:
-                    output.addMessage(__file__, 2, "WCDS_OTHER", "CDS length is " \
-                        "not a multiple of three in gene %s, transcript " \
-                        "variant %s." % (gene.name, transcript.name))
-                transcript.proteinDescription = 'p.?'
-
     reference = output.getOutput('reference')[-1]
     if ';' in record.record.description:
         generated_description = '[' + record.record.description + ']'
@@ -2078,18 +2285,12 @@ def check_variant(description, output):
                          (record.record.source_id,
                           record.record.molType, chromosomal_description))
 
-    # Now we add variant descriptions for all transcripts, including protein
-    # level descriptions.
+    # Now we add variant descriptions for all transcripts. Protein level
+    # descriptions are added on demand (see below).
+    descriptions = []
     for gene in record.record.geneList:
         for transcript in sorted(gene.transcriptList, key=attrgetter('name')):
-
-            # Note: I don't think genomic_id is ever used, because it is
-            # always ''.
-            coding_description = ''
-            protein_description = ''
             full_description = ''
-            full_protein_description = ''
-            genomic_id = coding_id = protein_id = ''
 
             if ';' in transcript.description:
                 generated_description = '[' + transcript.description + ']'
@@ -2112,32 +2313,66 @@ def check_variant(description, output):
                                     generated_description)
                 output.addOutput('descriptions', full_description)
 
-            if transcript.molType == 'c':
-                coding_description = 'c.%s' % generated_description
-                protein_description = transcript.proteinDescription
-                if record.record._sourcetype == 'LRG':
-                    full_protein_description = '%sp%s:%s' % \
-                                               (reference, transcript.name,
-                                                protein_description)
-                else:
-                    full_protein_description = '%s(%s_i%s):%s' % \
-                                               (reference, gene.name,
-                                                transcript.name,
-                                                protein_description)
-
-                coding_id, protein_id = \
-                           transcript.transcriptID, transcript.proteinID
-                output.addOutput('protDescriptions',
-                                 full_protein_description)
-
-            # The 'NewDescriptions' field is used in _add_batch_output.
-            output.addOutput('NewDescriptions',
-                             (gene.name, transcript.name,
-                              transcript.molType, coding_description,
-                              protein_description, genomic_id, coding_id,
-                              protein_id, full_description,
-                              full_protein_description))
-
-    _add_batch_output(output)
+            descriptions.append((gene, transcript, generated_description,
+                                 full_description))
+
+    _check_protein_transcripts(mutator, record, output)
+
+    # Predicting the protein of every transcript is the most expensive part
+    # for references with many transcripts, so we only do this if the
+    # protein descriptions are actually used (the selected transcript is
+    # already handled in _add_transcript_info). The batch output includes
+    # the protein descriptions. The only messages about this are added by
+    # _check_protein_transcripts above.
+    def add_protein_descriptions():
+        with output.timer('protein-descriptions'):
+            _add_protein_descriptions(mutator, record, reference,
+                                      descriptions, output)
+    output.addDeferredOutput(['protDescriptions', 'NewDescriptions'],
+                             add_protein_descriptions, messages=False)
+    output.addDeferredOutput(['batchDone'],
+                             lambda: _add_batch_output(output),
+                             messages=False)
 
 #check_variant
+
+
+def check_variants(descriptions, outputs):
+    """
+    Check many variant descriptions, see check_variant.
+
+    The descriptions are grouped by reference sequence and transcript
+    selector (the part before the colon). The record of a reference sequence
+    is retrieved once and every description on it is checked on a fresh copy
+    of the record. For NC references, the record is sliced from the
+    chromosomal database once per transcript selector, but again for every
+    description on the chromosome itself (g.), since the slice then depends
+    on the variant positions. The results are the same as those of
+    check_variant.
+
+    Every copy is a record as retrieved, so the record is still checked
+    (see GenRecord.checkRecord) for every description. The messages of
+    checking a record depend on the selected transcript.
+
+    @arg descriptions: Variant descriptions in HGVS notation.
+    @type descriptions: list(unicode)
+    @arg outputs: An output object for each variant description.
+    @type outputs: list(Modules.Output.Output)
+    """
+    groups = {}
+    for description, output in zip(descriptions, outputs):
+        groups.setdefault(description.split(':')[0], []).append(
+            (description, output))
+
+    reference = None
+    records = {}
+
+    # Groups on the same reference sequence are adjacent in sorted order, so
+    # we only have to keep the records of one reference sequence around.
+    for pre_colon in sorted(groups):
+        if pre_colon.split('(')[0] != reference:
+            reference = pre_colon.split('(')[0]
+            records = {}
+        for description, output in groups[pre_colon]:
+            check_variant(description, output, records=records)
+#check_variants
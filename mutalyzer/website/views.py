@@ -5,7 +5,6 @@ Mutalyzer website views.
 
 from __future__ import unicode_literals
 
-import bz2
 import os
 import pkg_resources
 import re
@@ -24,8 +23,8 @@ from sqlalchemy.orm.exc import NoResultFound
 import extractor
 
 import mutalyzer
-from mutalyzer import (announce, backtranslator, File, ncbi, Retriever,
-                       Scheduler, stats, util, variantchecker)
+from mutalyzer import (announce, backtranslator, compression, File, ncbi,
+                       Retriever, Scheduler, stats, util, variantchecker)
 from mutalyzer.config import settings
 from mutalyzer.db.models import BATCH_JOB_TYPES
 from mutalyzer.db.models import Assembly, BatchJob
@@ -859,7 +858,7 @@ def reference(filename):
     if not os.path.isfile(file_path):
         abort(404)
 
-    response = make_response(bz2.BZ2File(file_path, 'r').read())
+    response = make_response(compression.read_file(file_path))
 
     response.headers['Content-Type'] = 'text/plain; charset=utf-8'
     response.headers['Content-Disposition'] = ('attachment; filename="%s"'
@@ -5,6 +5,7 @@ Test fixtures.
 
 from __future__ import unicode_literals
 
+import io
 import os
 import shutil
 
@@ -32,7 +33,9 @@ def settings(request, tmpdir):
         'CACHE_DIR':    cache_dir,
         'LOG_FILE':     log_file,
         'DATABASE_URI': None,
-        'REDIS_URI':    redis_uri
+        'REDIS_URI':    redis_uri,
+        'ENTREZ_RATE_LIMIT': 1000,
+        'ENTREZ_RETRY_DELAY': 0
     })
 
     if redis_uri is not None:
@@ -731,3 +734,25 @@ def with_links(*links):
                 ids=[','.join('/'.join(a or '*' for a in l)
                               for l in links)])(test))
     return test_with_links
+
+
+def esummary_result(accession, length):
+    """
+    Create a file-like object with the result of an Entrez esummary query on
+    the nuccore database, for use in mocks of `Bio.Entrez.esummary`.
+
+    Only the fields used by Mutalyzer are included.
+    """
+    return io.BytesIO(
+        b'<?xml version="1.0" encoding="UTF-8" ?>\n'
+        b'<!DOCTYPE eSummaryResult PUBLIC "-//NLM//DTD esummary v1 20041029'
+        b'//EN" "https://eutils.ncbi.nlm.nih.gov/eutils/dtd/20041029/'
+        b'esummary-v1.dtd">\n'
+        b'<eSummaryResult>\n'
+        b'<DocSum>\n'
+        b'<Id>1</Id>\n'
+        b'<Item Name="Caption" Type="String">%s</Item>\n'
+        b'<Item Name="Length" Type="Integer">%d</Item>\n'
+        b'</DocSum>\n'
+        b'</eSummaryResult>\n' % (accession.split('.')[0].encode('utf-8'),
+                                  length))
@@ -0,0 +1,415 @@
+"""
+Tests for the mutalyzer.cache module.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+
+from mutalyzer import cache
+from mutalyzer import Retriever
+from mutalyzer.db.models import Reference
+from mutalyzer.GenRecord import Gene, Locus, PList, Record
+from mutalyzer.parsers.genbank import GBparser
+
+from fixtures import with_references
+
+
+def _record(size):
+    record = Record()
+    record.description = 'x' * size
+    return record
+
+
+def test_record_cache_copies():
+    """
+    Every lookup should return a fresh copy of the cached record.
+    """
+    records = cache.RecordCache(1048576)
+    records.put(('AB026906.1', 'abc'), _record(10))
+
+    first = records.get(('AB026906.1', 'abc'))
+    first.description = 'modified'
+    second = records.get(('AB026906.1', 'abc'))
+
+    assert second.description == 'x' * 10
+    assert first is not second
+
+
+def test_record_cache_slots():
+    """
+    Attributes stored in slots survive the round trip through the cache.
+    """
+    record = _record(10)
+    record.id = 'AB026906.1'
+    gene = Gene('COL1A1')
+    gene.newLocusTag()
+    transcript = Locus(gene.newLocusTag())
+    transcript.mRNA = PList()
+    transcript.mRNA.positionList = [1, 10, 20, 30]
+    gene.transcriptList.append(transcript)
+    record.geneList.append(gene)
+
+    records = cache.RecordCache(1048576)
+    records.put('a', record)
+    cached = records.get('a')
+
+    assert cached.id == 'AB026906.1'
+    assert cached.description == 'x' * 10
+    assert cached.geneList[0].newLocusTag() == '003'
+    transcript = cached.geneList[0].findLocus('002')
+    assert transcript.mRNA.positionList == [1, 10, 20, 30]
+
+
+def test_record_cache_checksum():
+    """
+    Records with another checksum are not served from the cache.
+    """
+    records = cache.RecordCache(1048576)
+    records.put(('AB026906.1', 'abc'), _record(10))
+
+    assert records.get(('AB026906.1', 'def')) is None
+    assert records.statistics()['misses'] == 1
+
+
+def test_record_cache_eviction():
+    """
+    Least recently used records are evicted to stay within the size limit.
+    """
+    records = cache.RecordCache(3500)
+    records.put('a', _record(1000))
+    records.put('b', _record(1000))
+    records.get('a')
+    records.put('c', _record(1000))
+
+    assert records.get('a') is not None
+    assert records.get('b') is None
+    assert records.get('c') is not None
+
+    statistics = records.statistics()
+    assert statistics['records'] == 2
+    assert statistics['size'] <= 3500
+    assert statistics['hits'] == 3
+    assert statistics['misses'] == 1
+    assert statistics['evictions'] == 1
+
+
+def test_record_cache_too_large():
+    """
+    Records larger than the size limit are not cached.
+    """
+    records = cache.RecordCache(100)
+    records.put('a', _record(1000))
+
+    assert records.get('a') is None
+    assert records.statistics()['size'] == 0
+
+
+def test_record_cache_disabled():
+    """
+    Nothing is cached with a size limit of 0.
+    """
+    records = cache.RecordCache(0)
+    records.put('a', _record(10))
+
+    assert records.get('a') is None
+
+
+@with_references('AB026906.1')
+def test_genbank_loadrecord_cached(output, references):
+    """
+    Loading a GenBank record twice should parse it only once.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    first = retriever.loadrecord('AB026906.1')
+    first.geneList[0].transcriptList[0].description = 'modified'
+    second = retriever.loadrecord('AB026906.1')
+
+    assert first is not second
+    assert second.id == 'AB026906.1'
+    assert second.geneList[0].transcriptList[0].description == ''
+    assert unicode(second.seq) == unicode(first.seq)
+
+    statistics = cache.records.statistics()
+    assert statistics['records'] == 1
+    assert statistics['hits'] == 1
+
+
+@with_references('LRG_1')
+def test_lrg_loadrecord_cached(output, references):
+    """
+    Loading an LRG record twice should parse it only once.
+    """
+    retriever = Retriever.LRGRetriever(output)
+    first = retriever.loadrecord('LRG_1')
+    second = retriever.loadrecord('LRG_1')
+
+    assert first is not second
+    assert second.id == 'LRG_1'
+    assert len(second.geneList) == len(first.geneList)
+    assert cache.records.statistics()['hits'] == 1
+
+
+@with_references('AB026906.1')
+def test_loadrecord_record_file(monkeypatch, output, references):
+    """
+    A record that is no longer cached in memory is read from its record file.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    first = retriever.loadrecord('AB026906.1')
+    assert os.path.isfile(cache.record_file('AB026906.1', 'gb'))
+
+    def create_record(self, filename):
+        raise AssertionError('Reference file should not be parsed')
+    monkeypatch.setattr(GBparser, 'create_record', create_record)
+
+    cache.records.clear()
+    second = retriever.loadrecord('AB026906.1')
+
+    assert second.id == 'AB026906.1'
+    assert unicode(second.seq) == unicode(first.seq)
+    assert cache.records.statistics()['records'] == 1
+
+
+@with_references('AB026906.1')
+def test_loadrecord_record_file_checksum(monkeypatch, output, references):
+    """
+    A record file for another version of the reference file is ignored.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    retriever.loadrecord('AB026906.1')
+
+    parsed = []
+    create_record = GBparser.create_record.im_func
+    def create_record_spy(self, filename):
+        parsed.append(filename)
+        return create_record(self, filename)
+    monkeypatch.setattr(GBparser, 'create_record', create_record_spy)
+
+    cache.records.clear()
+    references[0].checksum = '0' * 32
+    retriever.loadrecord('AB026906.1')
+
+    assert len(parsed) == 1
+
+
+@with_references('AB026906.1')
+def test_add_sequences(output, references):
+    """
+    Sequences added to a record are added to the cached record in all cache
+    tiers, without other changes to the record.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    record = retriever.loadrecord('AB026906.1')
+    assert record.cache_key == ('AB026906.1', references[0].checksum, 'gb')
+
+    record.description = 'modified'
+    record.addSequences(('COL1A1', '001', 1), {'mRNA': 'ATG'})
+    cache.add_sequences(record)
+
+    cached = retriever.loadrecord('AB026906.1')
+    assert cached.getSequences(('COL1A1', '001', 1)) == {'mRNA': 'ATG'}
+    assert cached.description != 'modified'
+    assert cached.popNewSequences() == {}
+
+    cache.records.clear()
+    cached = retriever.loadrecord('AB026906.1')
+    assert cached.getSequences(('COL1A1', '001', 1)) == {'mRNA': 'ATG'}
+
+
+@with_references('AB026906.1')
+def test_add_sequences_evicted(monkeypatch, settings, db, output,
+                               references):
+    """
+    Sequences added to a record after its reference file was evicted are
+    only added to the in-memory record cache, no record file is left behind.
+    """
+    record = Retriever.GenBankRetriever(output).loadrecord('AB026906.1')
+    key = 'AB026906.1', references[0].checksum
+
+    # Uploaded reference files are never evicted.
+    references[0].source = 'ncbi'
+    db.session.commit()
+    monkeypatch.setitem(settings, 'MAX_CACHE_DIR_SIZE', 1)
+    assert cache.evict() == 1
+    assert os.listdir(settings.CACHE_DIR) == []
+
+    record.addSequences(('COL1A1', '001', 1), {'mRNA': 'ATG'})
+    cache.add_sequences(record)
+
+    assert os.listdir(settings.CACHE_DIR) == []
+    cached = cache.records.get(key)
+    assert cached.getSequences(('COL1A1', '001', 1)) == {'mRNA': 'ATG'}
+
+
+@with_references('AB026906.1')
+def test_add_sequences_newer_version(settings, output, references):
+    """
+    Sequences added to a record do not replace the record file of a newer
+    version of the reference file.
+    """
+    record = Retriever.GenBankRetriever(output).loadrecord('AB026906.1')
+    cache.write_record_file('AB026906.1', '1' * 32, 'gb', b'newer')
+
+    record.addSequences(('COL1A1', '001', 1), {'mRNA': 'ATG'})
+    cache.add_sequences(record)
+
+    assert cache.read_record_file('AB026906.1', '1' * 32, 'gb') == b'newer'
+    cached = cache.records.get(('AB026906.1', references[0].checksum))
+    assert cached.getSequences(('COL1A1', '001', 1)) == {'mRNA': 'ATG'}
+
+
+@with_references('LRG_1')
+def test_cache_record(output, references):
+    """
+    Rebuilding a cached record writes its record file.
+    """
+    assert not Retriever.GenBankRetriever(output).cache_record(references[0])
+    assert Retriever.LRGRetriever(output).cache_record(references[0])
+
+    data = cache.read_record_file('LRG_1', references[0].checksum, 'xml')
+    assert data is not None
+    assert cache.read_record_file('LRG_1', '0' * 32, 'xml') is None
+
+
+def _cache_file(settings, filename, size, age):
+    path = os.path.join(settings.CACHE_DIR, filename)
+    with open(path, 'wb') as handle:
+        handle.write(b'x' * size)
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_evict(monkeypatch, settings, db):
+    """
+    Least recently used reference files are removed from the cache directory.
+    """
+    monkeypatch.setitem(settings, 'MAX_CACHE_DIR_SIZE', 3500)
+    db.session.add(Reference('UD_1', '0' * 32, 'upload'))
+    db.session.commit()
+
+    _cache_file(settings, 'NM_1.1.gb.bz2', 1000, 500)
+    _cache_file(settings, 'NM_1.1.gb.record', 200, 500)
+    _cache_file(settings, 'UD_1.gb.bz2', 1000, 400)
+    _cache_file(settings, 'LRG_1.xml.bz2', 1000, 300)
+    _cache_file(settings, 'batch-job-1.txt', 1000, 200)
+    _cache_file(settings, 'NM_2.1.gb.bz2', 1000, 100)
+
+    assert cache.evict() == 2
+    assert sorted(os.listdir(settings.CACHE_DIR)) == [
+        'NM_2.1.gb.bz2', 'UD_1.gb.bz2', 'batch-job-1.txt']
+    assert cache.cache_dir_statistics()['evictions'] == 2
+
+
+def test_evict_unbounded(settings):
+    """
+    Nothing is removed from an unbounded cache directory.
+    """
+    _cache_file(settings, 'NM_1.1.gb.bz2', 1000, 500)
+
+    assert cache.evict() == 0
+    assert os.listdir(settings.CACHE_DIR) == ['NM_1.1.gb.bz2']
+
+
+@with_references('AB026906.1')
+def test_cache_dir_statistics(output, references):
+    """
+    Loading a reference file from the cache directory is counted as a hit.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    retriever.loadrecord('AB026906.1')
+    retriever.loadrecord('AB026906.1')
+
+    statistics = cache.cache_dir_statistics()
+    assert statistics['hits'] == 2
+    assert statistics['misses'] == 0
+    assert statistics['files'] == 2
+
+
+def test_single_flight(settings):
+    """
+    Only one thread at a time can enter the context for a given key.
+    """
+    entered = threading.Event()
+    release = threading.Event()
+
+    def first():
+        with cache.single_flight('ncbi:NM_1.1'):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    entered.wait()
+
+    with cache.single_flight('ncbi:NM_2.1') as waited:
+        assert not waited
+
+    threading.Timer(0.2, release.set).start()
+    with cache.single_flight('ncbi:NM_1.1') as waited:
+        assert waited
+        assert release.is_set()
+
+    thread.join()
+
+
+def test_single_flight_lock_file(settings):
+    """
+    The lock file is removed when the context is exited.
+    """
+    with cache.single_flight('ncbi:NM_1.1'):
+        assert os.listdir(settings.CACHE_DIR) == ['.lock-ncbi:NM_1.1']
+    assert os.listdir(settings.CACHE_DIR) == []
+
+
+def test_single_flight_waiters(settings):
+    """
+    Threads waiting for the same key enter the context one at a time, also
+    after the lock file was removed by the thread they waited for.
+    """
+    inside = []
+    overlaps = []
+
+    def enter():
+        with cache.single_flight('ncbi:NM_1.1'):
+            if inside:
+                overlaps.append(True)
+            inside.append(True)
+            time.sleep(0.05)
+            inside.pop()
+
+    threads = [threading.Thread(target=enter) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not overlaps
+    assert os.listdir(settings.CACHE_DIR) == []
+
+
+def test_lrg_fetch_coalesced(settings, output):
+    """
+    A LRG file fetched by another process while waiting is not fetched again.
+    """
+    entered = threading.Event()
+
+    def first():
+        with cache.single_flight('lrg:LRG_1'):
+            entered.set()
+            time.sleep(0.2)
+            _cache_file(settings, 'LRG_1.xml.bz2', 1000, 0)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    entered.wait()
+
+    filename = Retriever.LRGRetriever(output).fetch('LRG_1')
+    thread.join()
+
+    assert filename == os.path.join(settings.CACHE_DIR, 'LRG_1.xml.bz2')
+    assert cache.cache_dir_statistics()['coalesced'] == 1
@@ -0,0 +1,84 @@
+"""
+Tests for the mutalyzer.compression module.
+"""
+
+
+from __future__ import unicode_literals
+
+import os
+
+import pytest
+
+from mutalyzer import compression
+from mutalyzer import Retriever
+
+from fixtures import with_references
+
+
+DATA = b'LOCUS       AB026906                3401 bp    DNA     linear   PRI\n'
+
+
+@pytest.mark.parametrize('codec', compression.available_codecs())
+def test_round_trip(tmpdir, codec):
+    """
+    Data compressed with any codec is read back unchanged.
+    """
+    filename = unicode(tmpdir.join('file'))
+    with open(filename, 'wb') as handle:
+        handle.write(compression.compress(DATA * 100, codec))
+
+    assert compression.detect_file(filename) == codec
+    assert compression.read_file(filename) == DATA * 100
+
+
+def test_incremental(tmpdir):
+    """
+    Data can be compressed incrementally.
+    """
+    comp = compression.compressor('gzip')
+    data = b''.join(comp.compress(DATA) for _ in range(100)) + comp.flush()
+
+    assert compression.detect(data) == 'gzip'
+
+    filename = unicode(tmpdir.join('file'))
+    with open(filename, 'wb') as handle:
+        handle.write(data)
+
+    assert compression.read_file(filename) == DATA * 100
+
+
+def test_unknown_codec():
+    """
+    Using an unknown codec is an error.
+    """
+    with pytest.raises(ValueError):
+        compression.compress(DATA, 'rar')
+
+
+def test_recompress(tmpdir):
+    """
+    Re-encoding a file keeps its contents.
+    """
+    filename = unicode(tmpdir.join('file'))
+    with open(filename, 'wb') as handle:
+        handle.write(compression.compress(DATA, 'bz2'))
+
+    assert compression.recompress(filename, 'none')
+    assert not compression.recompress(filename, 'none')
+    assert compression.detect_file(filename) == 'none'
+    assert compression.read_file(filename) == DATA
+
+
+@with_references('AB026906.1')
+def test_loadrecord_mixed_codecs(monkeypatch, settings, output, references):
+    """
+    Reference files written with another codec than the configured one can
+    still be loaded.
+    """
+    monkeypatch.setitem(settings, 'CACHE_COMPRESSION', 'gzip')
+    filename = os.path.join(settings.CACHE_DIR, 'AB026906.1.gb.bz2')
+    compression.recompress(filename)
+
+    record = Retriever.GenBankRetriever(output).loadrecord('AB026906.1')
+    assert compression.detect_file(filename) == 'gzip'
+    assert record.geneList[0].transcriptList[0].name == '001'
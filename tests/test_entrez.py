@@ -0,0 +1,219 @@
+"""
+Tests for the mutalyzer.entrez module.
+"""
+
+
+from __future__ import unicode_literals
+
+import io
+import time
+import urllib2
+
+from Bio import Entrez
+import pytest
+
+from mutalyzer import entrez
+from mutalyzer import stats
+from mutalyzer.redisclient import client as redis
+
+
+def test_token_bucket(monkeypatch):
+    """
+    Tokens are handed out at the configured rate.
+    """
+    now = [1000.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    monkeypatch.setattr(time, 'sleep', sleep)
+
+    bucket = entrez.TokenBucket(4)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.25)
+    now[0] += 1
+    assert bucket.acquire() == 0
+    assert waits == [pytest.approx(0.25)]
+
+
+def test_rate_limit(monkeypatch, settings):
+    """
+    The rate limit defaults to what the NCBI allows.
+    """
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT', None)
+    assert entrez.rate_limit() == 3
+    monkeypatch.setitem(settings, 'ENTREZ_API_KEY', 'abc')
+    assert entrez.rate_limit() == 10
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT', 5)
+    assert entrez.rate_limit() == 5
+
+
+def test_retry(monkeypatch, settings):
+    """
+    Failed requests are retried.
+    """
+    calls = []
+
+    def mock_efetch(**keywords):
+        calls.append(keywords)
+        if len(calls) < 3:
+            raise IOError()
+        return io.BytesIO(b'result')
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    handle = entrez.efetch(db='nuccore', id='NM_000059.3')
+
+    assert handle.read() == b'result'
+    assert calls == [{'db': 'nuccore', 'id': 'NM_000059.3'}] * 3
+    assert stats.get_total('entrez/efetch/error') == 2
+
+
+def test_retry_give_up(monkeypatch, settings):
+    """
+    Requests are tried at most `ENTREZ_MAX_TRIES` times.
+    """
+    calls = []
+
+    def mock_esearch(**keywords):
+        calls.append(keywords)
+        raise IOError()
+    monkeypatch.setattr(Entrez, 'esearch', mock_esearch)
+
+    with pytest.raises(IOError):
+        entrez.esearch(db='gene', term='BRCA2')
+    assert len(calls) == settings.ENTREZ_MAX_TRIES
+
+
+@pytest.mark.parametrize('max_tries', [0, -1])
+def test_retry_at_least_once(monkeypatch, settings, max_tries):
+    """
+    Requests are tried at least once, whatever `ENTREZ_MAX_TRIES` says.
+    """
+    calls = []
+
+    def mock_esearch(**keywords):
+        calls.append(keywords)
+        return 'result'
+    monkeypatch.setattr(Entrez, 'esearch', mock_esearch)
+    monkeypatch.setitem(settings, 'ENTREZ_MAX_TRIES', max_tries)
+
+    assert entrez.esearch(db='gene', term='BRCA2') == 'result'
+    assert len(calls) == 1
+
+
+def test_no_retry_client_error(monkeypatch, settings):
+    """
+    Requests failing with a client error are not retried.
+    """
+    calls = []
+
+    def mock_elink(**keywords):
+        calls.append(keywords)
+        raise urllib2.HTTPError('', 400, 'Bad Request', {}, None)
+    monkeypatch.setattr(Entrez, 'elink', mock_elink)
+
+    with pytest.raises(urllib2.HTTPError):
+        entrez.elink(dbfrom='nucleotide', db='protein', id='1')
+    assert len(calls) == 1
+
+
+class MockResponse(object):
+    """
+    Response of a `requests` session, as used by the Entrez client.
+    """
+    def __init__(self, data, status_code=200):
+        self.raw = io.BytesIO(data)
+        self.status_code = status_code
+        self.reason = 'OK'
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+class MockSession(object):
+    """
+    Session of the `requests` library, returning an empty response after
+    `latency` seconds.
+    """
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.urls = []
+
+    def get(self, url, **keywords):
+        self.urls.append(url)
+        time.sleep(self.latency)
+        return MockResponse(b'')
+
+
+def test_latency_histogram(monkeypatch, settings):
+    """
+    The latency of each HTTP request is added to the histogram of the
+    utility.
+    """
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT', 1000)
+    session = MockSession(latency=0.06)
+    monkeypatch.setattr(entrez._transport._local, 'session', session,
+                        raising=False)
+
+    entrez.esummary(db='nuccore', id='NM_000059.3')
+    entrez.esummary(db='nuccore', id='NM_000059.3')
+
+    assert len(session.urls) == 2
+    buckets, total = stats.get_histogram('entrez/esummary')
+    assert sum(count for _, count in buckets) == 2
+    assert buckets[1] == (stats.LATENCY_BUCKETS[1], 2)
+
+
+def test_no_entrez_delay(monkeypatch, settings):
+    """
+    Requests are only delayed by our own rate limit, not by the fixed delay
+    of `Bio.Entrez`.
+    """
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT', 1000)
+    session = MockSession()
+    monkeypatch.setattr(entrez._transport._local, 'session', session,
+                        raising=False)
+
+    waits = []
+    sleep = time.sleep
+    def sleep_spy(seconds):
+        waits.append(seconds)
+        sleep(seconds)
+    monkeypatch.setattr(time, 'sleep', sleep_spy)
+
+    for _ in range(3):
+        entrez.esearch(db='gene', term='BRCA2')
+
+    assert len(session.urls) == 3
+    assert all(seconds < 0.01 for seconds in waits)
+    buckets, _ = stats.get_histogram('entrez/esearch')
+    assert buckets[0] == (stats.LATENCY_BUCKETS[0], 3)
+
+
+def test_shared_rate_limit(monkeypatch, settings):
+    """
+    Requests of all processes are counted in Redis.
+    """
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT', 2)
+    monkeypatch.setitem(settings, 'ENTREZ_RATE_LIMIT_SHARED', True)
+    monkeypatch.setattr(Entrez, 'efetch', lambda **keywords: io.BytesIO(b''))
+
+    now = [1000.75]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    monkeypatch.setattr(time, 'sleep', sleep)
+
+    # Other processes already made two requests in this second.
+    redis.set('entrez:requests:1000', 2)
+
+    entrez.efetch(db='nuccore', id='NM_000059.3')
+
+    assert waits == [pytest.approx(0.25)]
+    assert redis.get('entrez:requests:1001') == '1'
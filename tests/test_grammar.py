@@ -5,13 +5,19 @@ Tests for the mutalyzer.grammar module.
 
 from __future__ import unicode_literals
 
+import threading
+
+from pyparsing import ParseException, ParseResults
 import pytest
 
+from mutalyzer import grammar as grammar_module
+from mutalyzer import stats
 from mutalyzer.grammar import Grammar
 
 
 @pytest.fixture
 def grammar(output):
+    grammar_module.parse_cache.clear()
     return Grammar(output)
 
 
@@ -162,3 +168,257 @@ def test_parse_minus_in_gene_symbol(parser):
     Gene symbol is allowed to contain a minus character.
     """
     parser('UD_132464528477(KRTAP2-4_v001):c.100del')
+
+
+def test_parse_statistics(output, grammar):
+    """
+    Parses, parse errors, and packrat cache usage are counted.
+    """
+    before = grammar_module.statistics()
+    assert grammar.parse('NM_002001.2:c.12del')
+    assert grammar.parse('NM_002001.2:c.12_13inv')
+    assert not grammar.parse('NM_002001.2:c.12dell')
+    after = grammar_module.statistics()
+
+    assert after['common_parses'] == before['common_parses'] + 1
+    assert after['parses'] == before['parses'] + 2
+    assert after['errors'] == before['errors'] + 1
+    assert after['parse_time'] > before['parse_time']
+    assert after['hits'] > before['hits']
+    assert after['misses'] > before['misses']
+    assert len(grammar_module.packrat_cache) == 0
+
+
+def test_parse_bounded_cache(monkeypatch, settings, output, grammar):
+    """
+    The packrat cache does not grow beyond its maximum size.
+    """
+    description = 'NM_002001.2:c.[%s]' % ';'.join(
+        '%d_%ddel' % (i, i + 1) for i in range(1, 40, 3))
+    expected = grammar.parse(description).dump()
+    before = grammar_module.statistics()
+
+    monkeypatch.setitem(settings, 'PACKRAT_CACHE_SIZE', 500)
+    grammar_module.parse_cache.clear()
+    assert grammar.parse(description).dump() == expected
+    after = grammar_module.statistics()
+
+    assert after['max_cache_size'] == 500
+    assert after['evictions'] > before['evictions']
+
+
+def test_parse_histograms(monkeypatch, settings, output, grammar):
+    """
+    Parse latencies are only added to the histograms if the STAGE_TIMINGS
+    setting is enabled.
+    """
+    assert grammar.parse('NM_002001.2:c.12_13inv')
+    buckets, _ = stats.get_histogram('grammar/parse')
+    assert sum(count for _, count in buckets) == 0
+
+    monkeypatch.setitem(settings, 'STAGE_TIMINGS', True)
+    grammar_module.parse_cache.clear()
+    assert grammar.parse('NM_002001.2:c.12_13inv')
+    for histogram in 'grammar/parse', 'grammar/wait':
+        buckets, _ = stats.get_histogram(histogram)
+        assert sum(count for _, count in buckets) == 1
+
+
+def test_publish_statistics(settings, output, grammar):
+    """
+    Parser counters are published to Redis, adding only what changed since
+    they were last published.
+    """
+    grammar_module.publish_statistics(force=True)
+    before = grammar_module.published_statistics()
+
+    assert grammar.parse('NM_002001.2:c.12del')
+    assert grammar.parse('NM_002001.2:c.12_13inv')
+    assert grammar.parse('NM_002001.2:c.12_13inv')
+    assert not grammar.parse('NM_002001.2:c.12dell')
+    grammar_module.publish_statistics(force=True)
+    grammar_module.publish_statistics(force=True)
+    after = grammar_module.published_statistics()
+
+    assert after['common-parses'] == before['common-parses'] + 1
+    assert after['parses'] == before['parses'] + 2
+    assert after['errors'] == before['errors'] + 1
+    assert after['parse-cache-hits'] == before['parse-cache-hits'] + 1
+    assert after['parse-cache-misses'] == before['parse-cache-misses'] + 2
+    assert after['packrat-misses'] > before['packrat-misses']
+
+    # Counters of the cache of parse outcomes start from zero again.
+    grammar_module.parse_cache.clear()
+    assert not grammar.parse('NM_002001.2:c.12dell')
+    grammar_module.publish_statistics(force=True)
+    assert (grammar_module.published_statistics()['parse-cache-misses'] ==
+            after['parse-cache-misses'] + 1)
+
+
+def test_parse_threads(output):
+    """
+    Descriptions can be parsed from multiple threads at the same time.
+    """
+    descriptions = ['NM_002001.2:c.[%d_%ddel;%dA>G]' % (i, i + 5, i + 10)
+                    for i in range(1, 20)]
+    expected = [Grammar(output).parse(d).dump() for d in descriptions]
+    results = {}
+
+    def parse(n):
+        results[n] = [Grammar(output).parse(d).dump() for d in descriptions]
+
+    threads = [threading.Thread(target=parse, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: expected for n in range(4)}
+
+
+def _structure(results):
+    """
+    Everything we know about a parse tree, for comparing parse trees.
+    """
+    if not isinstance(results, ParseResults):
+        return type(results), results
+    return (results.getName(),
+            [_structure(token) for token in results],
+            sorted((name, [(_structure(value), offset)
+                           for value, offset in values])
+                   for name, values
+                   in results._ParseResults__tokdict.items()))
+
+
+@pytest.mark.parametrize('description', [
+    'NM_003002.2:c.274G>T',
+    'NM_003002:c.274G>T',
+    'NM_003002.2:r.274g>u',
+    'NC_000011.9:g.111959693G>T',
+    'NC_000011.9(NM_003002.2):c.274-5_275+3del',
+    'NM_003002.2(SDHD_v001):c.-5del',
+    'NM_003002.2(SDHD_i001):c.274dup',
+    'NG_012337.1(KRTAP2-4):c.*5+3delA',
+    'AB026906.1(SDHD):c.274_276dupTTA',
+    'UD_139262478721:g.100del10',
+    'NM_003002.2:c.274_275insAT',
+    'NM_003002.2:c.274delinsAT',
+    'NM_003002.2:c.274_276delTTAinsAT',
+    'NM_003002.2:c.274_276del3insn',
+    'gi_1:c.1del'
+])
+def test_parse_common(description):
+    """
+    Descriptions of common shapes are parsed without the full grammar, with
+    the same results.
+    """
+    common = grammar_module.parse_common(description)
+    full = grammar_module.parse_string(Grammar.Var, description,
+                                       parse_all=True)
+
+    assert common is not None
+    assert _structure(common) == _structure(full)
+    assert common.dump() == full.dump()
+    assert common.asXML() == full.asXML()
+
+
+@pytest.mark.parametrize('description', [
+    'GI123:c.1del',
+    'LRG_1:g.1del',
+    'LRG_1t1:c.1del',
+    'NM_003002.2:c.274del10ins4',
+    'NM_003002.2:c.274+d5del',
+    'NM_003002.2:c.(274_275)del',
+    'NM_003002.2:c.[274del;280del]',
+    'NM_003002.2:c.274_275inv',
+    'NM_003002.2:p.Gln3Leu'
+])
+def test_parse_common_other(parser, description):
+    """
+    Descriptions of other shapes are left to the full grammar.
+    """
+    assert grammar_module.parse_common(description) is None
+    parser(description)
+
+
+@pytest.mark.parametrize('description', [
+    'NM_003002.2:c.274delAT\n',
+    'NM_003002.2:c.274delAT ',
+    'NM_003002.2:c.274G>T\t',
+    ' NM_003002.2:c.274G>T'
+])
+def test_parse_common_whitespace(description):
+    """
+    Descriptions with surrounding whitespace are left to the full grammar,
+    since it keeps trailing whitespace in the parse tree.
+    """
+    assert grammar_module.parse_common(description) is None
+    assert grammar_module.parse_string(Grammar.Var, description,
+                                       parse_all=True)
+
+
+@pytest.mark.parametrize('description', [
+    'NM_003002.2:c.274insA',
+    'NM_003002.2:c.274_275G>T',
+    'NM_003002.2:c.274G>',
+    'LRG_1(SDHD):c.274G>T'
+])
+def test_parse_common_invalid(description):
+    """
+    Invalid descriptions are not parsed without the full grammar.
+    """
+    assert grammar_module.parse_common(description) is None
+    with pytest.raises(ParseException):
+        grammar_module.parse_string(Grammar.Var, description, parse_all=True)
+
+
+def test_parse_cache(output, grammar):
+    """
+    Parse trees are cached and every hit gets its own copy.
+    """
+    description = 'NM_003002.2:c.[274G>T;280del]'
+    before = grammar_module.statistics()
+    parsed = grammar.parse(description)
+    expected = _structure(parsed)
+    parsed.SingleAlleleVarSet[0].RawVar['Arg1'] = 'C'
+
+    cached = grammar.parse(description)
+    assert _structure(cached) == expected
+    assert cached is not parsed
+    assert grammar.parse(description) is not cached
+
+    after = grammar_module.statistics()
+    assert after['parses'] == before['parses'] + 1
+    assert grammar_module.parse_cache.statistics() == {
+        'descriptions': 1, 'max_size': 10000, 'hits': 2, 'misses': 1,
+        'evictions': 0}
+
+
+def test_parse_cache_error(output, grammar):
+    """
+    Parse errors are cached with the position where they occurred.
+    """
+    description = 'NM_003002.2:c.274G>T>'
+    for _ in range(2):
+        assert grammar.parse(description) is None
+
+    errors = output.getMessagesWithErrorCode('EPARSE')
+    assert len(errors) == 2
+    assert errors[0].description == errors[1].description
+    assert output.getOutput('parseError') == [description, 20 * ' ' + '^'] * 2
+    assert grammar_module.parse_cache.statistics()['hits'] == 1
+
+
+def test_parse_cache_size(monkeypatch, settings, output, grammar):
+    """
+    Least recently used descriptions are evicted from the cache.
+    """
+    monkeypatch.setitem(settings, 'PARSE_CACHE_SIZE', 2)
+    for description in ['NM_003002.2:c.1_2inv', 'NM_003002.2:c.3_4inv',
+                        'NM_003002.2:c.1_2inv', 'NM_003002.2:c.5_6inv',
+                        'NM_003002.2:c.1_2inv', 'NM_003002.2:c.3_4inv']:
+        assert grammar.parse(description)
+
+    assert grammar_module.parse_cache.statistics() == {
+        'descriptions': 2, 'max_size': 2, 'hits': 2, 'misses': 4,
+        'evictions': 2}
@@ -7,9 +7,13 @@ from __future__ import unicode_literals
 
 import pytest
 import random
+import threading
+from Bio import Restriction
+from Bio.Alphabet import IUPAC
 from Bio.Seq import Seq
 
-from mutalyzer.mutator import Mutator
+from mutalyzer import mutator as mutator_module
+from mutalyzer.mutator import MutatedSequence, Mutator
 
 
 @pytest.fixture
@@ -1294,3 +1298,160 @@ def test_adjecent_ins_inv_2(mutator):
     mutator.insertion(2, 'G')
     mutator.inversion(2, 2)
     assert unicode(mutator.mutated) == unicode(Seq('AAGCGATCG'))
+
+
+@pytest.mark.parametrize('length', [1000])
+def test_shift_many_unordered(length, mutator):
+    """
+    Many variants applied in random order shift positions by the sum of the
+    preceding length changes.
+    """
+    starts = random.sample(range(1, length + 1, 5), 100)
+    changes = []
+    for start in starts:
+        if start % 2:
+            mutator.deletion(start, start + 1)
+            changes.append((start + 2, -2))
+        else:
+            mutator.insertion(start, 'ACG')
+            changes.append((start + 1, 3))
+
+    for p in range(1, length + 1):
+        assert mutator.shift(p) == p + sum(s for c, s in changes if c <= p)
+
+
+def test_mutated_sequence_delins():
+    """
+    Edits on a mutated sequence give the same sequence as edits on a string.
+    """
+    original = ''.join(random.choice('ACGT') for _ in range(200))
+    expected = original
+    sequence = MutatedSequence(Seq(original))
+
+    for _ in range(50):
+        start = random.randint(0, len(expected))
+        stop = random.randint(start, min(start + 10, len(expected)))
+        insertion = ''.join(random.choice('ACGT')
+                            for _ in range(random.randint(0, 5)))
+        expected = expected[:start] + insertion + expected[stop:]
+        sequence = sequence.delins(start, stop, insertion)
+
+        assert len(sequence) == len(expected)
+        assert unicode(sequence) == expected
+
+    for _ in range(50):
+        start = random.randint(-10, len(expected) + 10)
+        stop = random.randint(-10, len(expected) + 10)
+        assert unicode(sequence[start:stop]) == expected[start:stop]
+    assert unicode(sequence[::-1]) == expected[::-1]
+    assert [sequence[i] for i in range(len(expected))] == list(expected)
+    assert sequence[-1] == expected[-1]
+    with pytest.raises(IndexError):
+        sequence[len(expected)]
+
+
+def test_mutated_sequence_slice_type():
+    """
+    Slices of a mutated sequence are sequences with the original alphabet.
+    """
+    original = Seq('ATCGATCG', IUPAC.unambiguous_dna)
+    sequence = MutatedSequence(original).delins(2, 3, 'TT')
+
+    assert isinstance(sequence[1:5], Seq)
+    assert unicode(sequence[1:5]) == 'TTTG'
+    assert sequence[1:5].alphabet == IUPAC.unambiguous_dna
+    assert unicode(original) == 'ATCGATCG'
+
+
+def test_restriction_count(monkeypatch):
+    """
+    Restriction site counts are the same as found by Bio.Restriction.
+    """
+    monkeypatch.setattr(mutator_module, 'RESTRICTION_CACHE_SIZE', 10)
+    batch = Restriction.RestrictionBatch([], ['N'])
+
+    for _ in range(50):
+        sequence = ''.join(random.choice('ACGT')
+                           for _ in range(random.randint(0, 100)))
+        analysis = Restriction.Analysis(batch, Seq(sequence))
+        expected = dict((unicode(enzyme), len(sites)) for enzyme, sites
+                        in analysis.with_sites().items())
+        assert mutator_module.restriction_count(sequence) == expected
+        assert mutator_module.restriction_count(sequence) == expected
+
+    assert len(mutator_module._restriction_counts) <= 10
+
+
+def test_restriction_count_threads(monkeypatch):
+    """
+    Restriction site counts can be requested from multiple threads at the
+    same time.
+    """
+    monkeypatch.setattr(mutator_module, 'RESTRICTION_CACHE_SIZE', 5)
+    sequences = [''.join(random.choice('ACGT') for _ in range(30))
+                 for _ in range(20)]
+    expected = [dict(mutator_module.restriction_count(sequence))
+                for sequence in sequences]
+    results = {}
+
+    def count(n):
+        results[n] = [mutator_module.restriction_count(sequence)
+                      for _ in range(5) for sequence in sequences]
+
+    threads = [threading.Thread(target=count, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {n: expected * 5 for n in range(4)}
+    assert len(mutator_module._restriction_counts) <= 5
+
+
+@pytest.mark.parametrize('sequence', [Seq('ATCGAATTCGATCG')])
+def test_restriction_sites_on_demand(monkeypatch, output, mutator):
+    """
+    Restriction sites are only analysed when the output is asked for.
+    """
+    analysed = []
+    restriction_count = mutator_module.restriction_count
+
+    def mock_restriction_count(sequence):
+        analysed.append(sequence)
+        return restriction_count(sequence)
+    monkeypatch.setattr(mutator_module, 'restriction_count',
+                        mock_restriction_count)
+
+    mutator.substitution(5, 'T')   # g.5A>T
+    mutator.substitution(13, 'A')  # g.13C>A
+    assert analysed == []
+
+    sites = output.getOutput('restrictionSites')
+    assert len(analysed) == 4
+    assert 'EcoRI' in sites[0][1]
+    assert len(sites) == 2
+
+
+@pytest.mark.parametrize('sequence', [Seq('ATCGAATTCGATCG')])
+def test_restriction_sites_not_for_messages(monkeypatch, output, mutator):
+    """
+    Restriction sites are not analysed when only the messages or the summary
+    are asked for.
+    """
+    analysed = []
+    restriction_count = mutator_module.restriction_count
+
+    def mock_restriction_count(sequence):
+        analysed.append(sequence)
+        return restriction_count(sequence)
+    monkeypatch.setattr(mutator_module, 'restriction_count',
+                        mock_restriction_count)
+
+    mutator.substitution(5, 'T')  # g.5A>T
+    output.getMessages()
+    output.getMessagesWithErrorCode('EPARSE')
+    output.Summary()
+    assert analysed == []
+
+    assert len(output.getOutput('restrictionSites')) == 1
+    assert len(analysed) == 2
@@ -0,0 +1,103 @@
+"""
+Tests for the mutalyzer.output module.
+"""
+
+
+from __future__ import unicode_literals
+
+from mutalyzer import stats
+
+
+def test_deferred_output(output):
+    """
+    Deferred output is added when it is first retrieved.
+    """
+    calls = []
+
+    def add():
+        calls.append('add')
+        output.addOutput('a', 1)
+    output.addDeferredOutput(['a'], add)
+    output.addOutput('b', 2)
+
+    assert output.getOutput('b') == [2]
+    assert calls == []
+    assert output.getOutput('a') == [1]
+    assert output.getIndexedOutput('a', 0) == 1
+    assert calls == ['add']
+
+
+def test_deferred_output_messages(output):
+    """
+    Deferred output is added when the messages are retrieved.
+    """
+    def add():
+        output.addMessage(__file__, 2, 'WTEST', 'Test warning.')
+        output.addOutput('a', 1)
+    output.addDeferredOutput(['a'], add)
+
+    assert output.Summary()[1] == 1
+    assert len(output.getMessagesWithErrorCode('WTEST')) == 1
+    assert output.getOutput('a') == [1]
+
+
+def test_deferred_output_order(output):
+    """
+    Deferred output retrieved by another deferred function is added first.
+    """
+    def add_a():
+        output.addOutput('a', 1)
+
+    def add_b():
+        output.addOutput('b', output.getOutput('a')[0] + 1)
+    output.addDeferredOutput(['b'], add_b)
+    output.addDeferredOutput(['a'], add_a)
+
+    assert output.getOutput('b') == [2]
+    assert output.getOutput('a') == [1]
+
+
+def test_timer_disabled(output):
+    """
+    Nothing is measured if stage timings are disabled.
+    """
+    with output.timer('parse'):
+        pass
+    assert output.getTimings() == []
+
+
+def test_timer(monkeypatch, settings, output):
+    """
+    Durations are added up per stage and added to the stage histograms.
+    """
+    monkeypatch.setitem(settings, 'STAGE_TIMINGS', True)
+
+    with output.timer('parse'):
+        pass
+    with output.timer('retrieve'):
+        with output.timer('parse'):
+            pass
+
+    assert [stage for stage, _ in output.getTimings()] == ['parse',
+                                                           'retrieve']
+    assert all(seconds >= 0 for _, seconds in output.getTimings())
+    buckets, _ = stats.get_histogram('stage/parse')
+    assert sum(count for _, count in buckets) == 2
+
+
+def test_deferred_output_no_messages(output):
+    """
+    Deferred output without messages is not added when the messages are
+    retrieved.
+    """
+    calls = []
+
+    def add():
+        calls.append('add')
+        output.addOutput('a', 1)
+    output.addDeferredOutput(['a'], add, messages=False)
+
+    output.Summary()
+    output.getMessages()
+    assert calls == []
+    assert output.getOutput('a') == [1]
@@ -5,15 +5,23 @@ Tests for the mutalyzer.parsers.genbank module.
 
 from __future__ import unicode_literals
 
+import glob
 import os
 
+from Bio.SeqFeature import CompoundLocation, FeatureLocation
 import pytest
 
+from mutalyzer import compression
+from mutalyzer import ncbi
+from mutalyzer.parsers import genbank_fast
 from mutalyzer.parsers.genbank import GBparser
 
 from fixtures import with_references
 
 
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
 @pytest.fixture
 def parser():
     return GBparser()
@@ -153,3 +161,148 @@ def test_mrna_and_cds_addition_to_genes(settings, references, parser):
            [None]
     assert [t.proteinID for t in record.geneList[1].transcriptList] == \
            ['NP_000454.1']
+
+
+def _record_summary(record):
+    """
+    Everything in a record the rest of Mutalyzer uses.
+    """
+    summary = [record.source_id, record.source_accession,
+               record.source_version, record.organism, record.molType,
+               record.organelle, record.chromOffset, record.orientation,
+               unicode(record.seq), repr(record.seq.alphabet),
+               [(t.name, t.CDS.location)
+                for t in record.source.transcriptList]]
+    for gene in record.geneList:
+        summary.append((gene.name, gene.orientation, gene.location))
+        for transcript in gene.transcriptList:
+            attributes = {key: getattr(transcript, key)
+                          for key in transcript.__slots__}
+            for key in 'exon', 'mRNA', 'CDS':
+                plist = attributes.pop(key)
+                attributes[key] = plist and (plist.location,
+                                             plist.positionList)
+            summary.append(sorted(attributes.items()))
+    return summary
+
+
+@pytest.mark.parametrize('filename', sorted(
+    os.path.basename(f) for f in glob.glob(os.path.join(DATA_DIR, '*.gb.bz2'))))
+def test_fast_reader(monkeypatch, settings, parser, filename):
+    """
+    Records created with the fast GenBank reader are the same as those
+    created with BioPython.
+    """
+    def transcript_to_protein(accession, version=None, match_version=True):
+        raise ncbi.NoLinkError()
+    monkeypatch.setattr(ncbi, 'transcript_to_protein', transcript_to_protein)
+
+    path = os.path.join(DATA_DIR, filename)
+    assert (_record_summary(parser.create_record(path)) ==
+            _record_summary(parser.create_record(path, fast=False)))
+
+
+def test_fast_reader_lazy_sequence():
+    """
+    The sequence is converted on first access.
+    """
+    data = compression.read_file(
+        os.path.join(DATA_DIR, 'NM_000059.3.gb.bz2'))
+    biorecord = genbank_fast.read(data)
+
+    assert biorecord._seq is None
+    assert biorecord.id == 'NM_000059.3'
+    assert len(biorecord.seq) == 11386
+    assert unicode(biorecord.seq).startswith('GTGGCGCGAGCTTCTGAAACTAGGCGG')
+
+
+def test_fast_reader_unsupported():
+    """
+    Files with unsupported features are rejected by the fast reader.
+    """
+    data = compression.read_file(
+        os.path.join(DATA_DIR, 'AL449423.14.gb.bz2'))
+    with pytest.raises(genbank_fast.UnsupportedRecord):
+        genbank_fast.read(data)
+
+
+def _loci(count, product, cds_product):
+    """
+    Create `count` non-overlapping pairs of mRNA and CDS features.
+    """
+    rnas, cdss = [], []
+    for i in range(count):
+        start = i * 1000
+        rnas.append(genbank_fast.Feature(
+            'mRNA',
+            CompoundLocation([FeatureLocation(start, start + 100, 1),
+                              FeatureLocation(start + 200, start + 300, 1)]),
+            {'gene': ['A'], 'product': [product(i)]}))
+        cdss.append(genbank_fast.Feature(
+            'CDS',
+            CompoundLocation([FeatureLocation(start + 50, start + 100, 1),
+                              FeatureLocation(start + 200, start + 250, 1)]),
+            {'gene': ['A'], 'product': [cds_product(i)]}))
+    return rnas, cdss
+
+
+@pytest.mark.parametrize('product,cds_product,method', [
+    (lambda i: 'A, transcript variant %d' % i,
+     lambda i: 'A isoform %d' % i, 'product'),
+    (lambda i: 'A', lambda i: 'A', 'exhaustion')])
+def test_link_many_transcripts(monkeypatch, parser, product, cds_product,
+                               method):
+    """
+    Linking many transcripts of a gene only compares mRNA and CDS features
+    that can match.
+    """
+    count = 500
+    rnas, cdss = _loci(count, product, cds_product)
+
+    matches = []
+    match_by_range = GBparser._GBparser__matchByRange.im_func
+    def match_by_range_spy(self, mrna, cds):
+        matches.append((mrna, cds))
+        return match_by_range(self, mrna, cds)
+    monkeypatch.setattr(GBparser, '_GBparser__matchByRange',
+                        match_by_range_spy)
+
+    parser.link(rnas, cdss)
+
+    assert [rna.link for rna in rnas] == cdss
+    assert all(rna.linkMethod == method for rna in rnas)
+    assert len(matches) <= 2 * count
+
+
+def test_record_indexes(monkeypatch, parser):
+    """
+    Lookups on the indexes built by the parser give the same results as
+    scanning the gene and transcript lists.
+    """
+    def transcript_to_protein(accession, version=None, match_version=True):
+        raise ncbi.NoLinkError()
+    monkeypatch.setattr(ncbi, 'transcript_to_protein', transcript_to_protein)
+
+    record = parser.create_record(
+        os.path.join(DATA_DIR, 'UD_139262478721.gb.bz2'))
+    genes = record.geneList
+    transcripts = [(g, t) for g in genes for t in g.transcriptList]
+    assert len(transcripts) > 10
+
+    def lookups():
+        return ([record.findGene(g.name) for g in genes] +
+                [record.findGene('unknown')] +
+                [record.get_transcript_selector(t.transcriptID)
+                 for _, t in transcripts] +
+                [record.get_transcript_selector('NM_0.1')] +
+                [g.findLocus(t.name) for g, t in transcripts] +
+                [g.findLocus(str(int(t.name))) for g, t in transcripts] +
+                [g.findLocus('999') for g in genes] +
+                [g.findLink(t.link) for g, t in transcripts])
+    indexed = lookups()
+
+    assert record._genes is not None
+    for gene in genes:
+        gene._loci = gene._links = None
+    record._genes = record._transcripts = None
+    assert lookups() == indexed
@@ -8,6 +8,9 @@ from __future__ import unicode_literals
 import os
 import bz2
 
+from lxml import etree
+import pytest
+
 from mutalyzer.parsers.lrg import create_record
 
 from fixtures import with_references
@@ -41,6 +44,9 @@ def test_lrg_multiple_transcripts(settings, references):
     file_handle.close()
 
     assert len(record.geneList[0].transcriptList) == 2
+    assert (record.geneList[0].findLocus('2') is
+            record.geneList[0].transcriptList[1])
+    assert record.findGene(record.geneList[0].name) is record.geneList[0]
 
 
 @with_references('LRG_163')
@@ -55,3 +61,34 @@ def test_lrg_no_coding_sequence(settings, references):
 
     assert len(record.geneList[0].transcriptList) == 1
     assert record.geneList[0].transcriptList[0].CDS is None
+
+
+@with_references('LRG_1')
+def test_lrg_positions(settings, references):
+    """
+    Transcript, exon and CDS positions are taken from the fixed section in
+    the LRG coordinate system.
+    """
+    accession = references[0].accession
+    filename = os.path.join(settings.CACHE_DIR, '%s.xml.bz2' % accession)
+    file_handle = bz2.BZ2File(filename, 'r')
+    record = create_record(file_handle.read())
+    file_handle.close()
+
+    transcript = record.geneList[0].transcriptList[0]
+    assert transcript.location == [5001, 22544]
+    assert transcript.locusTag == 't1'
+    assert len(transcript.exon.positionList) == 102
+    assert transcript.exon.positionList[:4] == [5001, 5229, 6693, 6887]
+    assert transcript.exon.positionList[-2:] == [20992, 22544]
+    assert transcript.CDS.location == [5127, 21138]
+    assert transcript.CDS.positionList == []
+    assert unicode(record.seq).startswith('TTTGCCCAGGCTGGAGTGCAATG')
+
+
+def test_lrg_syntax_error():
+    """
+    Parsing a file that is not well-formed XML raises an error.
+    """
+    with pytest.raises(etree.XMLSyntaxError):
+        create_record(b'<lrg><fixed_annotation></lrg>')
@@ -0,0 +1,341 @@
+"""
+Tests for the mutalyzer.Retriever module.
+"""
+
+
+from __future__ import unicode_literals
+
+import bz2
+import hashlib
+import io
+import os
+
+from Bio import Entrez
+import pytest
+
+from mutalyzer import compression
+from mutalyzer import dbgb
+from mutalyzer import Retriever
+from mutalyzer.db.models import Reference
+from mutalyzer.dbgb import models as dbgb_models
+
+from fixtures import esummary_result, with_references
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
+
+
+def _cache_files(settings):
+    return sorted(os.listdir(settings.CACHE_DIR))
+
+
+class ChunkedHandle(io.BytesIO):
+    """
+    File-like object that returns at most `size` bytes per read, like a
+    network connection might.
+    """
+    def __init__(self, data, size):
+        io.BytesIO.__init__(self, data)
+        self.size = size
+        self.reads = 0
+
+    def read(self, n=-1):
+        self.reads += 1
+        if n < 0 or n > self.size:
+            n = self.size
+        return io.BytesIO.read(self, n)
+
+
+def test_download_chunks(monkeypatch, settings, output):
+    """
+    Downloaded data is converted, hashed and compressed chunk by chunk.
+    """
+    monkeypatch.setattr(Retriever, 'DOWNLOAD_CHUNK_SIZE', 64)
+    data = ('LOCUS caf\xe9\n' * 40 + 'CONTIG join()\n').encode('latin-1')
+    handle = ChunkedHandle(data, 10)
+
+    retriever = Retriever.GenBankRetriever(output)
+    tempname, md5sum, prefix, found = retriever._download(
+        handle, markers=(b'\nCONTIG', b'ORIGIN'))
+
+    assert handle.reads > len(data) // 64
+    assert md5sum == hashlib.md5(data).hexdigest()
+    assert prefix.startswith('LOCUS caf\xe9\n'.encode('utf-8'))
+    assert found == {b'\nCONTIG'}
+    assert (compression.read_file(tempname) ==
+            data.decode('latin-1').encode('utf-8'))
+
+    retriever._discard(tempname)
+    assert _cache_files(settings) == []
+
+
+def test_download_max_size(settings, output):
+    """
+    Downloads larger than the maximum size are aborted.
+    """
+    retriever = Retriever.GenBankRetriever(output)
+    assert retriever._download(io.BytesIO(b'x' * 1000), max_size=999) is None
+    assert _cache_files(settings) == []
+    assert len(output.getMessagesWithErrorCode('EFILESIZE')) == 1
+
+
+def test_fetch_streaming(monkeypatch, settings, output, db):
+    """
+    A fetched GenBank record is stored with the hash of the downloaded data.
+    """
+    with bz2.BZ2File(os.path.join(DATA_DIR, 'NM_000059.3.gb.bz2')) as handle:
+        data = handle.read()
+
+    def mock_esummary(*args, **kwargs):
+        return esummary_result('NM_000059.3', 11386)
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    def mock_efetch(*args, **kwargs):
+        return ChunkedHandle(data, 4096)
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    filename = Retriever.GenBankRetriever(output).fetch('NM_000059')
+
+    assert filename == os.path.join(settings.CACHE_DIR, 'NM_000059.3.gb.bz2')
+    assert compression.read_file(filename) == data
+    assert oct(os.stat(filename).st_mode & 0o777) == oct(0o644)
+    assert _cache_files(settings) == ['NM_000059.3.gb.bz2']
+
+    reference = Reference.query.filter_by(accession='NM_000059.3').one()
+    assert reference.checksum == hashlib.md5(data).hexdigest()
+
+
+def test_prefetch_checksum(monkeypatch, settings, output, db):
+    """
+    Prefetched GenBank records are stored exactly as they are fetched one by
+    one, with the same hash.
+    """
+    accessions = ['AB026906.1', 'NM_000059.3']
+    data = {}
+    for accession in accessions:
+        with bz2.BZ2File(os.path.join(DATA_DIR,
+                                      '%s.gb.bz2' % accession)) as handle:
+            data[accession] = handle.read()
+
+    def mock_efetch(*args, **kwargs):
+        return io.BytesIO(b''.join(data[accession] for accession
+                                   in kwargs['id'].split(',')))
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    def mock_esummary(*args, **kwargs):
+        return esummary_result(kwargs['id'], len(data[kwargs['id']]))
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    assert Retriever.GenBankRetriever(output).prefetch(accessions) == 2
+
+    for accession in accessions:
+        filename = os.path.join(settings.CACHE_DIR, '%s.gb.bz2' % accession)
+        assert compression.read_file(filename) == data[accession]
+
+        prefetched = Reference.query.filter_by(accession=accession).one()
+        checksum = prefetched.checksum
+        os.remove(filename)
+
+        Retriever.GenBankRetriever(output).fetch(accession)
+        fetched = Reference.query.filter_by(accession=accession).one()
+        assert fetched.checksum == checksum
+        assert checksum == hashlib.md5(data[accession]).hexdigest()
+
+
+def test_fetch_parse_error(monkeypatch, settings, output, db):
+    """
+    A downloaded file that cannot be parsed is not stored.
+    """
+    def mock_esummary(*args, **kwargs):
+        return esummary_result('NM_000059.3', 11386)
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    def mock_efetch(*args, **kwargs):
+        return io.BytesIO(b'LOCUS       garbage\n')
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    assert Retriever.GenBankRetriever(output).fetch('NM_000059') is None
+    assert _cache_files(settings) == []
+
+
+def test_fetch_with_parts(monkeypatch, settings, output, db):
+    """
+    A record of known length is fetched with its parts in one request.
+    """
+    with bz2.BZ2File(os.path.join(DATA_DIR, 'NG_012772.1.gb.bz2')) as handle:
+        data = handle.read()
+
+    def mock_esummary(*args, **kwargs):
+        return esummary_result('NG_012772.1', 91193)
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    requests = []
+    def mock_efetch(*args, **kwargs):
+        requests.append(kwargs['rettype'])
+        return io.BytesIO(data)
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    assert Retriever.GenBankRetriever(output).fetch('NG_012772.1')
+    assert requests == ['gbwithparts']
+
+
+def test_fetch_too_large(monkeypatch, settings, output, db):
+    """
+    A record exceeding the maximum file size is not downloaded.
+    """
+    def mock_esummary(*args, **kwargs):
+        return esummary_result('NC_000001.10', 249250621)
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    def mock_efetch(*args, **kwargs):
+        raise AssertionError('Record should not be downloaded')
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    assert Retriever.GenBankRetriever(output).fetch('NC_000001.10') is None
+    assert len(output.getMessagesWithErrorCode('ERETR')) == 1
+
+
+def test_fetch_unknown_length(monkeypatch, settings, output, db):
+    """
+    A record of unknown length is fetched again with its parts if it turns out
+    to be a constructed record.
+    """
+    with bz2.BZ2File(os.path.join(DATA_DIR, 'NG_012772.1.gb.bz2')) as handle:
+        data = handle.read()
+    contig = data[:data.index(b'\nORIGIN')] + b'\nCONTIG     join()\n//\n'
+
+    def mock_esummary(*args, **kwargs):
+        raise IOError()
+    monkeypatch.setattr(Entrez, 'esummary', mock_esummary)
+
+    requests = []
+    def mock_efetch(*args, **kwargs):
+        requests.append(kwargs['rettype'])
+        if kwargs['rettype'] == 'gb':
+            return io.BytesIO(contig)
+        return io.BytesIO(data)
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    filename = Retriever.GenBankRetriever(output).fetch('NG_012772.1')
+
+    assert requests == ['gb', 'gbwithparts']
+    assert compression.read_file(filename) == data
+
+
+def _add_local_chromosome(settings, tmpdir, record, accession, version,
+                          start, stop, orientation):
+    """
+    Add the chromosome from which `record` was sliced to the gbparser
+    database, with the sequence of the slice at its position in an otherwise
+    empty (sparse) sequence file.
+    """
+    settings.configure({'DATABASE_GB_URI': 'sqlite://',
+                        'SEQ_PATH': unicode(tmpdir) + '/'})
+
+    def chromosomal(position):
+        if orientation == 2:
+            return stop - position + 1
+        return start + position - 1
+
+    sequence = record.seq
+    if orientation == 2:
+        sequence = sequence.reverse_complement()
+    with open(os.path.join(unicode(tmpdir), 'abc.sequence'), 'wb') as handle:
+        handle.seek(start - 1)
+        handle.write(unicode(sequence).encode('ascii'))
+
+    reference = dbgb_models.Reference(
+        accession, version, 'def', 'abc', 'test', '13-AUG-2013', stop, 'dna',
+        '1')
+    dbgb.session.add(reference)
+    dbgb.session.commit()
+
+    for gene in record.geneList:
+        strand = '+' if (gene.orientation == 1) == (orientation == 1) else '-'
+        for transcript in gene.transcriptList:
+            if not transcript.transcriptID:
+                continue
+            exons = sorted(chromosomal(p)
+                           for p in transcript.mRNA.positionList)
+            # Non-coding transcripts have no protein version.
+            cds = [exons[0], exons[-1]]
+            protein = ['', None]
+            if transcript.proteinID:
+                cds = sorted(chromosomal(p)
+                             for p in transcript.CDS.location)
+                protein = transcript.proteinID.split('.')
+            transcript_accession, transcript_version = \
+                transcript.transcriptID.split('.')
+            db_transcript = dbgb_models.Transcript(
+                transcript_accession, transcript_version, protein[0],
+                protein[1], gene.name, None, strand, exons[0], exons[-1],
+                cds[0], cds[1], transcript.transcriptProduct,
+                transcript.proteinProduct,
+                ','.join(unicode(p) for p in exons[::2]),
+                ','.join(unicode(p) for p in exons[1::2]),
+                None, None, None, None, 'mRNA')
+            db_transcript.reference_id = reference.id
+            dbgb.session.add(db_transcript)
+    dbgb.session.commit()
+
+
+@pytest.mark.parametrize('ud,accession,start,stop,orientation', [
+    ('UD_150167851083', 'NC_000002.11', 234668819, 234682045, 1),
+    ('UD_139015218717', 'NC_000019.9', 58856171, 58869865, 2)])
+@with_references('UD_150167851083', 'A1BG')
+def test_local_slice(monkeypatch, settings, tmpdir, output, references, ud,
+                     accession, start, stop, orientation):
+    """
+    A slice built from the local chromosome gives the same record as the
+    slice retrieved from the NCBI.
+    """
+    expected = Retriever.GenBankRetriever(output).loadrecord(ud)
+    _add_local_chromosome(settings, tmpdir, expected,
+                          *accession.split('.') +
+                          [start, stop, orientation])
+    monkeypatch.setitem(settings, 'LOCAL_SLICES', True)
+
+    def mock_efetch(*args, **kwargs):
+        raise AssertionError('Slice should not be retrieved from the NCBI')
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    retriever = Retriever.GenBankRetriever(output)
+    local_ud = retriever.retrieveslice(accession, start, stop, orientation)
+    assert local_ud not in (None, ud)
+    record = retriever.loadrecord(local_ud)
+
+    assert unicode(record.seq) == unicode(expected.seq)
+    assert record.chromOffset == expected.chromOffset
+    assert record.orientation == expected.orientation
+
+    def transcripts(record):
+        return {t.transcriptID: (g.name, g.orientation,
+                                 t.mRNA.positionList, t.CDS and t.CDS.location,
+                                 t.proteinID)
+                for g in record.geneList for t in g.transcriptList
+                if t.transcriptID}
+    assert transcripts(record) == transcripts(expected)
+
+
+def test_local_slice_unavailable(monkeypatch, settings, tmpdir, output, db):
+    """
+    A slice of a chromosome that is not available locally is retrieved from
+    the NCBI.
+    """
+    monkeypatch.setitem(settings, 'LOCAL_SLICES', True)
+    monkeypatch.setitem(settings, 'SEQ_PATH', unicode(tmpdir) + '/')
+    path = os.path.join(DATA_DIR, 'UD_150167851083.gb.bz2')
+    with bz2.BZ2File(path) as handle:
+        data = handle.read()
+
+    requests = []
+    def mock_efetch(*args, **kwargs):
+        requests.append(kwargs['id'])
+        return io.BytesIO(data)
+    monkeypatch.setattr(Entrez, 'efetch', mock_efetch)
+
+    ud = Retriever.GenBankRetriever(output).retrieveslice(
+        'NC_000002.11', 234668819, 234682045, 1)
+
+    assert ud is not None
+    assert requests == ['NC_000002.11']
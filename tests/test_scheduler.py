@@ -20,7 +20,7 @@ from mutalyzer import File
 from mutalyzer import output
 from mutalyzer import Scheduler
 
-from fixtures import with_references
+from fixtures import esummary_result, with_references
 
 
 pytestmark = pytest.mark.usefixtures('db')
@@ -275,16 +275,22 @@ def test_name_checker_altered():
                  'BspHI,CviAII,FatI,Hpy188III,NlaIII']]
 
     # Patch GenBankRetriever.fetch to return the contents of NM_000059.3
-    # for NM_000059.
+    # for NM_000059 (and for NM_000059.3 when it is prefetched).
     def mock_efetch(*args, **kwargs):
-        if kwargs.get('id') != 'NM_000059':
+        if kwargs.get('id') not in ('NM_000059', 'NM_000059.3'):
             return Entrez.efetch(*args, **kwargs)
         path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                             'data',
                             'NM_000059.3.gb.bz2')
         return bz2.BZ2File(path)
 
-    with patch.object(Entrez, 'efetch', mock_efetch):
+    def mock_esummary(*args, **kwargs):
+        if kwargs.get('id') not in ('NM_000059', 'NM_000059.3'):
+            raise IOError()
+        return esummary_result('NM_000059.3', 11386)
+
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(Entrez, 'esummary', mock_esummary):
         _batch_job_plain_text(variants, expected, 'name-checker')
 
 
@@ -362,19 +368,66 @@ def test_name_checker_altered_long_entry():
                  'BspHI,CviAII,FatI,Hpy188III,NlaIII']]
 
     # Patch GenBankRetriever.fetch to return the contents of NM_000059.3
-    # for NM_000059.
+    # for NM_000059 (and for NM_000059.3 when it is prefetched).
     def mock_efetch(*args, **kwargs):
-        if kwargs.get('id') != 'NM_000059':
+        if kwargs.get('id') not in ('NM_000059', 'NM_000059.3'):
             return Entrez.efetch(*args, **kwargs)
         path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                             'data',
                             'NM_000059.3.gb.bz2')
         return bz2.BZ2File(path)
 
-    with patch.object(Entrez, 'efetch', mock_efetch):
+    def mock_esummary(*args, **kwargs):
+        if kwargs.get('id') not in ('NM_000059', 'NM_000059.3'):
+            raise IOError()
+        return esummary_result('NM_000059.3', 11386)
+
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(Entrez, 'esummary', mock_esummary):
         _batch_job_plain_text(variants, expected, 'name-checker')
 
 
+def test_name_checker_prefetch():
+    """
+    Name checker job fetching all references in one request.
+    """
+    variants = ['AB026906.1:c.274G>T',
+                'NM_000059.3:c.670G>T',
+                'AB026906.1:c.274del',
+                'NM_000059.3:c.670dup']
+
+    requests = []
+
+    def mock_efetch(*args, **kwargs):
+        requests.append(kwargs.get('id'))
+        raw_data = b''
+        for accession in kwargs.get('id').split(','):
+            path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                'data',
+                                '%s.gb.bz2' % accession)
+            raw_data += bz2.BZ2File(path).read()
+        return io.BytesIO(raw_data)
+
+    file_instance = File.File(output.Output('test'))
+    scheduler = Scheduler.Scheduler()
+    batch_file = io.BytesIO(('\n'.join(variants) + '\n').encode('utf-8'))
+    job, columns = file_instance.parseBatchFile(batch_file)
+    result_id = scheduler.addJob('test@test.test', job, columns,
+                                 'name-checker')
+
+    with patch.object(Entrez, 'efetch', mock_efetch):
+        scheduler.process()
+
+    assert requests == ['AB026906.1,NM_000059.3']
+
+    filename = 'batch-job-%s.txt' % result_id
+    result = io.open(os.path.join(settings.CACHE_DIR, filename),
+                     encoding='utf-8')
+    next(result)  # Header.
+    assert [line.split('\t')[4] for line in result] == [
+        'c.274G>T', 'c.670G>T', 'c.274del', 'c.670dup']
+
+
 @with_references('NM_000059.3')
 def test_name_checker_skipped():
     """
@@ -413,7 +466,8 @@ def test_name_checker_skipped():
             return Entrez.efetch(*args, **kwargs)
         raise IOError()
 
-    with patch.object(Entrez, 'efetch', mock_efetch):
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(Entrez, 'esummary', side_effect=IOError()):
         _batch_job_plain_text(variants, expected, 'name-checker')
 
 
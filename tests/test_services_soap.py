@@ -22,7 +22,7 @@ from mutalyzer.services.soap import application
 from mutalyzer import Scheduler
 from mutalyzer import models
 
-from fixtures import with_references
+from fixtures import esummary_result, with_references
 
 
 @pytest.fixture
@@ -487,6 +487,23 @@ def test_runmutalyzer(api):
     assert 'NM_003002.2(SDHD_v001):c.274G>T' in r.transcriptDescriptions.string
 
 
+@with_references('NM_003002.2')
+def test_runmutalyzer_timings(monkeypatch, settings, api):
+    """
+    Stage timings are included if enabled.
+    """
+    r = api('runMutalyzer', 'NM_003002.2:c.274G>T')
+    assert not getattr(r, 'timings', None)
+
+    monkeypatch.setitem(settings, 'STAGE_TIMINGS', True)
+    r = api('runMutalyzer', 'NM_003002.2:c.274G>T')
+    stages = [timing.stage for timing in r.timings.StageTiming]
+    for stage in ('parse', 'retrieve', 'process-variant', 'check-record',
+                  'transcript-info', 'protein-descriptions'):
+        assert stage in stages
+    assert 'restriction-sites' not in stages
+
+
 @pytest.mark.usefixtures('db')
 def test_runmutalyzer_reference_info_nm(api):
     """
@@ -502,7 +519,13 @@ def test_runmutalyzer_reference_info_nm(api):
                             'NM_003002.2.gb.bz2')
         return bz2.BZ2File(path)
 
-    with patch.object(Entrez, 'efetch', mock_efetch):
+    def mock_esummary(*args, **kwargs):
+        if kwargs.get('id') != 'NM_003002':
+            raise IOError()
+        return esummary_result('NM_003002.2', 1382)
+
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(Entrez, 'esummary', mock_esummary):
         r = api('runMutalyzer', 'NM_003002:c.274G>T')
 
     assert r.errors == 0
@@ -554,7 +577,13 @@ def test_runmutalyzer_reference_info_ng(api):
                             'NG_012772.1.gb.bz2')
         return bz2.BZ2File(path)
 
-    with patch.object(Entrez, 'efetch', mock_efetch):
+    def mock_esummary(*args, **kwargs):
+        if kwargs.get('id') != 'NG_012772':
+            raise IOError()
+        return esummary_result('NG_012772.1', 91193)
+
+    with patch.object(Entrez, 'efetch', mock_efetch), \
+            patch.object(Entrez, 'esummary', mock_esummary):
         r = api('runMutalyzer', 'NG_012772:g.18964del')
 
     assert r.errors == 0
@@ -7,6 +7,9 @@ from __future__ import unicode_literals
 
 import pytest
 
+from mutalyzer import variantchecker
+from mutalyzer.mutator import MutatedSequence
+from mutalyzer.output import Output
 from mutalyzer.variantchecker import check_variant
 
 from fixtures import with_references
@@ -2422,3 +2425,169 @@ def test_ex_multiple_operations(output, checker):
     errorcount, warncount, summary = output.Summary()
     assert errorcount == 0
     assert output.getOutput('gDescription')[0] == u'g.[4823del;2954_4952del]'
+
+
+@with_references('DMD')
+def test_protein_descriptions_on_demand(monkeypatch, output, checker):
+    """
+    Proteins of all transcripts are only predicted if the protein
+    descriptions are used.
+    """
+    calls = []
+    add_protein_descriptions = variantchecker._add_protein_descriptions
+    def add_protein_descriptions_spy(*args):
+        calls.append(args)
+        return add_protein_descriptions(*args)
+    monkeypatch.setattr(variantchecker, '_add_protein_descriptions',
+                        add_protein_descriptions_spy)
+
+    checker('UD_139262478721(DMD_v001):c.100del')
+    descriptions = output.getOutput('descriptions')
+    assert 'UD_139262478721(DMD_v001):c.100del' in descriptions
+    assert not calls
+
+    protein_descriptions = output.getOutput('protDescriptions')
+    assert len(calls) == 1
+    assert ('UD_139262478721(DMD_i001):p.(Ser34Valfs*10)'
+            in protein_descriptions)
+    assert len(output.getOutput('NewDescriptions')) == len(descriptions)
+    assert len(calls) == 1
+
+
+@with_references('DMD')
+def test_protein_descriptions_not_for_messages(monkeypatch, output, checker):
+    """
+    Proteins of all transcripts are not predicted if only the messages or
+    the summary are retrieved.
+    """
+    calls = []
+    add_protein_descriptions = variantchecker._add_protein_descriptions
+    def add_protein_descriptions_spy(*args):
+        calls.append(args)
+        return add_protein_descriptions(*args)
+    monkeypatch.setattr(variantchecker, '_add_protein_descriptions',
+                        add_protein_descriptions_spy)
+
+    checker('UD_139262478721(DMD_v001):c.100del')
+    messages = output.getMessages()
+    errorcount, warncount, summary = output.Summary()
+    assert errorcount == 0
+    assert not calls
+
+    assert output.getOutput('protDescriptions')
+    assert len(calls) == 1
+    assert output.getMessages() == messages
+
+
+@with_references('DMD')
+def test_reference_sequences_cached(monkeypatch, output, checker):
+    """
+    Reference sequences of transcripts are kept with the cached record, so
+    they are only computed once.
+    """
+    spliced = []
+    splice = variantchecker.util.splice
+    def splice_spy(s, splice_sites):
+        if not isinstance(s, MutatedSequence):
+            spliced.append(splice_sites)
+        return splice(s, splice_sites)
+    monkeypatch.setattr(variantchecker.util, 'splice', splice_spy)
+
+    checker('UD_139262478721(DMD_v001):c.100del')
+    protein = output.getIndexedOutput('oldProtein', 0)
+    protein_descriptions = output.getOutput('protDescriptions')
+    assert protein.startswith('M')
+    assert spliced
+
+    del spliced[:]
+    second_output = Output('test')
+    check_variant('UD_139262478721(DMD_v001):c.100del', second_output)
+    assert second_output.getIndexedOutput('oldProtein', 0) == protein
+    assert (second_output.getOutput('protDescriptions') ==
+            protein_descriptions)
+    assert not spliced
+
+
+@with_references('DMD', 'NM_003002.2')
+def test_check_variants(monkeypatch):
+    """
+    Checking variant descriptions in bulk gives the same results as checking
+    them one by one, and retrieves each reference sequence only once.
+    """
+    descriptions = ['UD_139262478721(DMD_v001):c.100del',
+                    'NM_003002.2:c.274G>T',
+                    'UD_139262478721(DMD_v002):c.100del',
+                    'UD_139262478721(DMD_v001):c.100del',
+                    'UD_139262478721(DMD_v001):c.100_101insA',
+                    'UD_139262478721(DMD_v001):c.10000000del',
+                    'NM_003002.2:c.274del',
+                    'NM_003002.2:c.274Q>T']
+    names = ['genomicDescription', 'descriptions', 'protDescriptions',
+             'oldProtein', 'newProtein', 'visualisation', 'legends',
+             'restrictionSites', 'batchDone']
+
+    def results(outputs):
+        return [([(m.code, m.description) for m in output.getMessages()],
+                 [output.getOutput(name) for name in names])
+                for output in outputs]
+
+    expected = [Output('test') for _ in descriptions]
+    for description, output in zip(descriptions, expected):
+        check_variant(description, output)
+
+    loaded = []
+    loadrecord = variantchecker.Retriever.GenBankRetriever.loadrecord.im_func
+    def loadrecord_spy(self, identifier):
+        loaded.append(identifier)
+        return loadrecord(self, identifier)
+    monkeypatch.setattr(variantchecker.Retriever.GenBankRetriever,
+                        'loadrecord', loadrecord_spy)
+
+    outputs = [Output('test') for _ in descriptions]
+    variantchecker.check_variants(descriptions, outputs)
+
+    assert sorted(loaded) == ['NM_003002.2', 'UD_139262478721']
+    assert results(outputs) == results(expected)
+
+
+@with_references('DMD')
+def test_check_variants_nc(monkeypatch):
+    """
+    Checking variant descriptions on an NC reference in bulk slices the
+    chromosome once per transcript selector, unless the variant is described
+    on the chromosome itself.
+    """
+    descriptions = ['NC_000023.10(DMD_v001):c.100del',
+                    'NC_000023.10(DMD_v001):c.100_101insA',
+                    'NC_000023.10(DMD_v002):c.100del',
+                    'NC_000023.10(DMD_v001):c.100del',
+                    'NC_000023.10:g.100del',
+                    'NC_000023.10:g.200del']
+    names = ['genomicDescription', 'descriptions', 'protDescriptions',
+             'oldProtein', 'newProtein', 'recordType', 'legends']
+
+    sliced = []
+    def get_nc_record(record_id, parsed_description, output):
+        sliced.append(record_id)
+        return variantchecker.Retriever.GenBankRetriever(output).loadrecord(
+            'UD_139262478721')
+    monkeypatch.setattr(variantchecker, 'get_nc_record', get_nc_record)
+
+    def results(outputs):
+        return [([(m.code, m.description) for m in output.getMessages()],
+                 [output.getOutput(name) for name in names])
+                for output in outputs]
+
+    expected = [Output('test') for _ in descriptions]
+    for description, output in zip(descriptions, expected):
+        check_variant(description, output)
+    assert len(sliced) == len(descriptions)
+
+    del sliced[:]
+    outputs = [Output('test') for _ in descriptions]
+    variantchecker.check_variants(descriptions, outputs)
+
+    assert len(sliced) == 4
+    assert results(outputs) == results(expected)
+    assert outputs[0].getOutput('recordType') == ['GB_NC']
+    assert all(output.Summary()[0] == 0 for output in outputs)